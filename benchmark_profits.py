@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+def build_database(path, positions):
+    """Créer une base synthétique avec `positions` bots et copy trades actifs"""
+    import main
+
+    main.DATABASE = path
+    main.BACKUP_ENABLED = False  # pas d'instantané de la base synthétique
+    main.db_pool = main.SQLiteConnectionPool(path, max_size=2)
+    main.init_db()
+
+    conn = main.get_db_connection()
+    users_count = max(1, positions // 4)
+    strategies = [row[0] for row in conn.execute('SELECT id FROM trading_strategies')]
+    traders = [row[0] for row in conn.execute('SELECT id FROM top_traders')]
+
+    conn.executemany('''
+        INSERT INTO users (email, password_hash, first_name, last_name, referral_code, balance)
+        VALUES (?, 'x', 'Bench', 'User', ?, 1000)
+    ''', ((f'bench{i}@example.com', f'BENCH{i}') for i in range(users_count)))
+    first_user = conn.execute('SELECT MIN(id) FROM users WHERE email LIKE "bench%"').fetchone()[0]
+
+    rng = random.Random(42)
+    bots = positions // 2
+    copies = positions - bots
+
+    conn.executemany('''
+        INSERT INTO user_trading_bots (user_id, strategy_id, amount, daily_profit)
+        VALUES (?, ?, ?, ?)
+    ''', ((first_user + rng.randrange(users_count), rng.choice(strategies), 100.0, 2.5) for _ in range(bots)))
+
+    conn.executemany('''
+        INSERT INTO user_copy_trading (user_id, trader_id, amount, copy_ratio)
+        VALUES (?, ?, ?, ?)
+    ''', ((first_user + rng.randrange(users_count), rng.choice(traders), 250.0, rng.choice((0.5, 1.0, 1.5))) for _ in range(copies)))
+
+    conn.commit()
+    conn.close()
+
+def run(positions, workers):
+    import main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+
+        started = time.perf_counter()
+        build_database(path, positions)
+        print(f"📦 {positions} positions synthétiques créées en {time.perf_counter() - started:.1f}s")
+
+        # Dates de run distinctes : chaque mode crédite l'ensemble des positions
+        sequential = main.calculate_daily_profits(run_date='bench-sequential', workers=0)
+        parallel = main.calculate_daily_profits(run_date='bench-parallel', workers=workers)
+
+        main.db_pool = main.SQLiteConnectionPool(main.DATABASE)
+
+    return sequential['elapsed'], parallel['elapsed']
+
+def main():
+    """Comparer le calcul des profits ensembliste et le calcul parallèle par tranches"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--positions', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    results = []
+    for positions in args.positions:
+        sequential, parallel = run(positions, args.workers)
+        results.append((positions, sequential, parallel))
+
+    print(f"\n{'positions':>10} | {'ensembliste':>11} | {f'{args.workers} processus':>12} | {'accélération':>12}")
+    for positions, sequential, parallel in results:
+        speedup = sequential / parallel if parallel else 0
+        print(f"{positions:>10} | {sequential:>10.2f}s | {parallel:>11.2f}s | {speedup:>11.2f}x")
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
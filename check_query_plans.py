@@ -0,0 +1,157 @@
+import os
+import re
+import ast
+import sys
+import sqlite3
+import tempfile
+
+SOURCE_FILES = ['main.py', 'ledger.py']
+
+# Tables qui grossissent avec l'activité : un SCAN complet sur l'une d'elles est un échec
+HOT_TABLES = {
+    'users', 'user_investments', 'user_staking', 'user_frozen_investments',
+    'user_trading_bots', 'user_copy_trading', 'project_investments',
+    'transactions', 'notifications', 'support_tickets', 'support_messages',
+    'security_logs', 'portfolio_distributions', 'profit_runs', 'user_portfolio_stats'
+}
+
+# Parcours complets voulus (initialisation, agrégats admin, job quotidien)
+ALLOWED_SCANS = [
+    ('init_db', None),
+    ('database_has_users', 'users'),
+    ('PLATFORM_COUNTERS_RECOUNT_SQL', None),
+    ('admin_dashboard', 'transactions'),
+    ('_collect_profit_credits', None),
+    ('_profit_shard_ranges', None),
+    ('calculate_daily_profits', 'profit_credits'),
+    ('_apply_profit_credits', None),
+    ('PORTFOLIO_STATS_REBUILD_SQL', None),
+]
+
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?([\w.]+)')
+ALIAS_RE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+([\w.]+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+SQL_KEYWORDS = {'where', 'join', 'left', 'inner', 'on', 'set', 'order', 'group', 'limit', 'values', 'select', 'union', 'as'}
+
+def extract_statements(path):
+    """Requêtes SQL littérales passées à execute()/executemany() (avec leur fonction ou constante),
+    et emplacements des requêtes construites dynamiquement, que le plan ne peut pas vérifier"""
+    tree = ast.parse(open(path, encoding='utf-8').read())
+    statements = []
+    dynamic = []
+    # execute(CONSTANTE) : la requête est déjà analysée avec les constantes de module
+    constants = {
+        target.id for assignment in tree.body if isinstance(assignment, ast.Assign)
+        for target in assignment.targets if isinstance(target, ast.Name)
+    }
+
+    for function in ast.walk(tree):
+        if not isinstance(function, ast.FunctionDef):
+            continue
+        for node in ast.walk(function):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ('execute', 'executemany') and node.args):
+                continue
+            if isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+                sql = ' '.join(node.args[0].value.split())
+                if sql.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                    statements.append((function.name, node.lineno, sql))
+            elif not (isinstance(node.args[0], ast.Name) and node.args[0].id in constants):
+                dynamic.append((function.name, node.lineno))
+
+    # Requêtes déclarées en constantes de module (HISTORY_QUERIES, API_RESOURCES...)
+    for assignment in tree.body:
+        if not (isinstance(assignment, ast.Assign) and len(assignment.targets) == 1
+                and isinstance(assignment.targets[0], ast.Name)):
+            continue
+        for node in ast.walk(assignment.value):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                sql = ' '.join(node.value.split())
+                if sql.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                    statements.append((assignment.targets[0].id, node.lineno, sql))
+
+    return statements, dynamic
+
+def alias_map(sql):
+    aliases = {}
+    for table, alias in ALIAS_RE.findall(sql):
+        table = table.split('.')[-1]
+        aliases[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+def full_scans(conn, sql):
+    params = [None] * re.sub(r"'[^']*'", '', sql).count('?')
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    aliases = alias_map(sql)
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        match = SCAN_RE.match(detail)
+        # SCAN = parcours complet (même via un index) ; SEARCH = accès indexé
+        if match:
+            name = match.group(1).split('.')[-1]
+            scans.append(aliases.get(name, name))
+    return scans
+
+def is_allowed(function, table):
+    return any(function == name and (allowed is None or allowed == table) for name, allowed in ALLOWED_SCANS)
+
+def main():
+    """Rapport EXPLAIN QUERY PLAN : échoue si une requête fréquente parcourt une table entière"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, root)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'plans.db')
+        import main as app_module
+
+        app_module.DATABASE = os.environ['DATABASE_PATH']
+        app_module.init_db()
+
+        conn = sqlite3.connect(app_module.DATABASE)
+        app_module._create_profit_credits_table(conn)
+
+        failures = []
+        unchecked = []
+        seen = set()
+        checked = 0
+        for source in SOURCE_FILES:
+            statements, dynamic = extract_statements(os.path.join(root, source))
+            unchecked += [(source, lineno, function) for function, lineno in dynamic]
+            seen.update(function for function, _, _ in statements)
+            for function, lineno, sql in statements:
+                try:
+                    scans = full_scans(conn, sql)
+                except sqlite3.Error as e:
+                    print(f"⚠️ {source}:{lineno} ({function}) ignorée: {e}")
+                    continue
+
+                checked += 1
+                for table in scans:
+                    if table in HOT_TABLES and not is_allowed(function, table):
+                        failures.append((source, lineno, function, table, sql))
+
+        conn.close()
+
+    print(f"🔍 {checked} requêtes analysées")
+    # SQL dynamique (f-strings des sauvegardes et restaurations, PRAGMA...) : signalé, pas vérifié
+    for source, lineno, function in sorted(unchecked):
+        print(f"⚠️ {source}:{lineno} ({function}) SQL non littéral, plan non vérifié")
+    if unchecked:
+        print(f"⚠️ {len(unchecked)} requête(s) dynamique(s) non vérifiée(s)")
+    # Une entrée qui ne correspond plus à aucune requête analysée est à retirer
+    for name, table in ALLOWED_SCANS:
+        if name not in seen:
+            print(f"⚠️ ALLOWED_SCANS: ({name!r}, {table!r}) ne correspond à aucune requête analysée")
+    for source, lineno, function, table, sql in failures:
+        print(f"❌ {source}:{lineno} ({function}) SCAN {table}: {sql[:120]}")
+
+    if failures:
+        print(f"\n{len(failures)} parcours complet(s) de table sur des requêtes fréquentes")
+        sys.exit(1)
+
+    print("✅ Aucune requête fréquente ne parcourt une table entière")
+
+if __name__ == "__main__":
+    main()
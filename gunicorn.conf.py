@@ -0,0 +1,15 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = 120
+# Les flux SSE du support occupent un thread, pas tout le worker (plafonnés par SUPPORT_STREAM_MAX_PER_WORKER)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+def on_starting(server):
+    """DDL et comptes admin une seule fois, dans le master, avant le fork des workers"""
+    import main
+    main.bootstrap_database()
+    # Les workers sont forkés depuis le master : aucune connexion SQLite ne doit leur être transmise
+    main.db_pool.close_all()
@@ -0,0 +1,43 @@
+"""Mouvements de solde : débit conditionnel en une requête et journal append-only ledger_entries"""
+
+def debit(conn, user_id, amount, kind, reference=None):
+    """Débite amount si le solde le permet ; renvoie le nouveau solde, ou None si le solde est insuffisant
+
+    Le contrôle et l'écriture tiennent dans un seul UPDATE : aucune fenêtre entre lecture et écriture.
+    Sur None rien n'a été écrit, mais l'appelant doit annuler sa transaction (rollback)."""
+    if amount <= 0:
+        raise ValueError(f'Montant de débit invalide: {amount}')
+
+    rows = conn.execute('''
+        UPDATE users SET balance = balance - ?
+        WHERE id = ? AND balance >= ?
+        RETURNING balance
+    ''', (amount, user_id, amount)).fetchall()
+    if not rows:
+        return None
+
+    record(conn, user_id, -amount, rows[0][0], kind, reference)
+    return rows[0][0]
+
+def credit(conn, user_id, amount, kind, reference=None):
+    """Crédite amount ; renvoie le nouveau solde, ou None si l'utilisateur n'existe pas"""
+    if amount < 0:
+        raise ValueError(f'Montant de crédit invalide: {amount}')
+
+    rows = conn.execute('''
+        UPDATE users SET balance = balance + ?
+        WHERE id = ?
+        RETURNING balance
+    ''', (amount, user_id)).fetchall()
+    if not rows:
+        return None
+
+    record(conn, user_id, amount, rows[0][0], kind, reference)
+    return rows[0][0]
+
+def record(conn, user_id, amount, balance_after, kind, reference=None):
+    """Ajouter une écriture au journal (montant signé, solde après mouvement)"""
+    conn.execute('''
+        INSERT INTO ledger_entries (user_id, amount, balance_after, kind, reference)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, amount, balance_after, kind, reference))
@@ -1,17 +1,37 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, g, has_app_context, get_template_attribute
 from werkzeug.security import generate_password_hash, check_password_hash
+from jinja2 import nodes
+from jinja2.ext import Extension
 import sqlite3
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import hashlib
+import hmac
 import secrets
 import json
 from functools import wraps
+from collections import OrderedDict
 import threading
 import time
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import sqlite3
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import gzip
+import shutil
+import re
+import html
+import yields
+import ledger
+
+# Compression zstd optionnelle pour les instantanés locaux (gzip sinon)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
 
 # Utilisation de SQLite pour la persistance
 REPLIT_DB_AVAILABLE = False
@@ -23,7 +43,8 @@ TELEGRAM_USER_BOT_ENABLED = False
 
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
+# Clé stable via SECRET_KEY ; sinon aléatoire par démarrage (partagée par les workers forkés depuis le master)
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 
 # Configuration PWA
 @app.route('/static/sw.js')
@@ -46,7 +67,7 @@ if REPLIT_DB_AVAILABLE:
     os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
     print(f"📂 Base de données persistante: {DATABASE}")
 else:
-    DATABASE = 'investment_platform.db'
+    DATABASE = os.environ.get('DATABASE_PATH', 'investment_platform.db')
 
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -54,6 +75,7 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Database initialization
 def init_db():
     conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
     # Users table
@@ -152,256 +174,26 @@ def init_db():
         )
     ''')
 
-def backup_critical_data():
-    """Sauvegarder les données critiques dans Replit DB"""
-    if not REPLIT_DB_AVAILABLE:
-        return
-    
-    try:
-        conn = get_db_connection()
-        
-        # Sauvegarder TOUS les investissements ROI (actifs et terminés)
-        all_investments = conn.execute('''
-            SELECT * FROM user_investments ORDER BY start_date DESC
-        ''').fetchall()
-        
-        investments_data = []
-        for inv in all_investments:
-            investments_data.append(dict(inv))
-        
-        replit_db['all_investments_history'] = json.dumps(investments_data, default=str)
-        
-        # Sauvegarder TOUS les investissements staking (actifs et terminés)
-        all_staking = conn.execute('''
-            SELECT * FROM user_staking ORDER BY start_date DESC
-        ''').fetchall()
-        
-        staking_data = []
-        for stake in all_staking:
-            staking_data.append(dict(stake))
-        
-        replit_db['all_staking_history'] = json.dumps(staking_data, default=str)
-        
-        # Sauvegarder TOUS les bots de trading (actifs et terminés)
-        all_bots = conn.execute('''
-            SELECT * FROM user_trading_bots ORDER BY start_date DESC
-        ''').fetchall()
-        
-        bots_data = []
-        for bot in all_bots:
-            bots_data.append(dict(bot))
-        
-        replit_db['all_bots_history'] = json.dumps(bots_data, default=str)
-        
-        # Sauvegarder TOUS les copy trades (actifs et terminés)
-        all_copy_trades = conn.execute('''
-            SELECT * FROM user_copy_trading ORDER BY start_date DESC
-        ''').fetchall()
-        
-        copy_trades_data = []
-        for trade in all_copy_trades:
-            copy_trades_data.append(dict(trade))
-        
-        replit_db['all_copy_trading_history'] = json.dumps(copy_trades_data, default=str)
-        
-        # Sauvegarder TOUS les investissements projets
-        all_projects = conn.execute('''
-            SELECT * FROM project_investments ORDER BY investment_date DESC
-        ''').fetchall()
-        
-        projects_data = []
-        for proj in all_projects:
-            projects_data.append(dict(proj))
-        
-        replit_db['all_projects_history'] = json.dumps(projects_data, default=str)
-        
-        # Sauvegarder TOUTES les transactions
-        all_transactions = conn.execute('''
-            SELECT * FROM transactions ORDER BY created_at DESC
-        ''').fetchall()
-        
-        transactions_data = []
-        for trans in all_transactions:
-            transactions_data.append(dict(trans))
-        
-        replit_db['all_transactions_history'] = json.dumps(transactions_data, default=str)
-        
-        # Sauvegarder les soldes utilisateurs
-        users = conn.execute('SELECT id, email, balance, first_name, last_name FROM users').fetchall()
-        users_data = []
-        for user in users:
-            users_data.append(dict(user))
-        
-        replit_db['user_balances'] = json.dumps(users_data, default=str)
-        
-        # Sauvegarder les plans pour restauration
-        roi_plans = conn.execute('SELECT * FROM roi_plans').fetchall()
-        roi_plans_data = []
-        for plan in roi_plans:
-            roi_plans_data.append(dict(plan))
-        replit_db['roi_plans_backup'] = json.dumps(roi_plans_data, default=str)
-        
-        replit_db['last_backup'] = datetime.now().isoformat()
-        conn.close()
-        
-        print("✅ Sauvegarde complète de l'historique effectuée")
-        
-    except Exception as e:
-        print(f"❌ Erreur sauvegarde: {e}")
-
-def restore_critical_data():
-    """Restaurer les données critiques depuis Replit DB"""
-    if not REPLIT_DB_AVAILABLE:
-        return False
-    
-    try:
-        # Vérifier s'il y a une sauvegarde disponible
-        if 'last_backup' not in replit_db:
-            return False
-        
-        conn = get_db_connection()
-        
-        print("🔄 Restauration de l'historique complet depuis la sauvegarde...")
-        
-        # Restaurer TOUS les investissements ROI
-        if 'all_investments_history' in replit_db:
-            investments_data = json.loads(replit_db['all_investments_history'])
-            for inv in investments_data:
-                try:
-                    conn.execute('''
-                        INSERT OR REPLACE INTO user_investments 
-                        (id, user_id, plan_id, amount, start_date, end_date, daily_profit, total_earned, is_active, transaction_hash)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        inv.get('id'), inv.get('user_id'), inv.get('plan_id'), 
-                        inv.get('amount'), inv.get('start_date'), inv.get('end_date'),
-                        inv.get('daily_profit'), inv.get('total_earned', 0), 
-                        inv.get('is_active', 1), inv.get('transaction_hash')
-                    ))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration investissement {inv.get('id')}: {e}")
-        
-        # Restaurer TOUS les investissements staking
-        if 'all_staking_history' in replit_db:
-            staking_data = json.loads(replit_db['all_staking_history'])
-            for stake in staking_data:
-                try:
-                    conn.execute('''
-                        INSERT OR REPLACE INTO user_staking 
-                        (id, user_id, plan_id, amount, start_date, end_date, is_active, is_withdrawn, total_earned, transaction_hash)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        stake.get('id'), stake.get('user_id'), stake.get('plan_id'),
-                        stake.get('amount'), stake.get('start_date'), stake.get('end_date'),
-                        stake.get('is_active', 1), stake.get('is_withdrawn', 0),
-                        stake.get('total_earned', 0), stake.get('transaction_hash')
-                    ))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration staking {stake.get('id')}: {e}")
-        
-        # Restaurer TOUS les bots de trading
-        if 'all_bots_history' in replit_db:
-            bots_data = json.loads(replit_db['all_bots_history'])
-            for bot in bots_data:
-                try:
-                    conn.execute('''
-                        INSERT OR REPLACE INTO user_trading_bots 
-                        (id, user_id, strategy_id, amount, start_date, end_date, is_active, total_profit, daily_profit, last_profit_date, transaction_hash)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        bot.get('id'), bot.get('user_id'), bot.get('strategy_id'),
-                        bot.get('amount'), bot.get('start_date'), bot.get('end_date'),
-                        bot.get('is_active', 1), bot.get('total_profit', 0),
-                        bot.get('daily_profit', 0), bot.get('last_profit_date'), bot.get('transaction_hash')
-                    ))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration bot {bot.get('id')}: {e}")
-        
-        # Restaurer TOUS les copy trades
-        if 'all_copy_trading_history' in replit_db:
-            copy_trades_data = json.loads(replit_db['all_copy_trading_history'])
-            for trade in copy_trades_data:
-                try:
-                    conn.execute('''
-                        INSERT OR REPLACE INTO user_copy_trading 
-                        (id, user_id, trader_id, amount, start_date, end_date, is_active, total_profit, copy_ratio, transaction_hash)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        trade.get('id'), trade.get('user_id'), trade.get('trader_id'),
-                        trade.get('amount'), trade.get('start_date'), trade.get('end_date'),
-                        trade.get('is_active', 1), trade.get('total_profit', 0),
-                        trade.get('copy_ratio', 1.0), trade.get('transaction_hash')
-                    ))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration copy trade {trade.get('id')}: {e}")
-        
-        # Restaurer TOUS les investissements projets
-        if 'all_projects_history' in replit_db:
-            projects_data = json.loads(replit_db['all_projects_history'])
-            for proj in projects_data:
-                try:
-                    conn.execute('''
-                        INSERT OR REPLACE INTO project_investments 
-                        (id, user_id, project_id, amount, investment_date, transaction_hash)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        proj.get('id'), proj.get('user_id'), proj.get('project_id'),
-                        proj.get('amount'), proj.get('investment_date'), proj.get('transaction_hash')
-                    ))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration projet {proj.get('id')}: {e}")
-        
-        # Restaurer TOUTES les transactions
-        if 'all_transactions_history' in replit_db:
-            transactions_data = json.loads(replit_db['all_transactions_history'])
-            for trans in transactions_data:
-                try:
-                    conn.execute('''
-                        INSERT OR REPLACE INTO transactions 
-                        (id, user_id, type, amount, status, transaction_hash, created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        trans.get('id'), trans.get('user_id'), trans.get('type'),
-                        trans.get('amount'), trans.get('status'), trans.get('transaction_hash'),
-                        trans.get('created_at'), trans.get('updated_at')
-                    ))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration transaction {trans.get('id')}: {e}")
-        
-        # Restaurer les soldes utilisateurs
-        if 'user_balances' in replit_db:
-            users_data = json.loads(replit_db['user_balances'])
-            for user in users_data:
-                try:
-                    conn.execute('''
-                        UPDATE users SET balance = ? WHERE id = ?
-                    ''', (user.get('balance', 0), user.get('id')))
-                except Exception as e:
-                    print(f"⚠️ Erreur restauration solde utilisateur {user.get('id')}: {e}")
-        
-        conn.commit()
-        conn.close()
-        
-        last_backup = replit_db.get('last_backup', 'Inconnue')
-        print(f"✅ Historique complet restauré depuis la sauvegarde du {last_backup}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Erreur restauration: {e}")
-        return False
-
-    # Transactions table
+    # Profit Runs ledger : une ligne par position créditée et par jour
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS profit_runs (
+            run_date TEXT NOT NULL,
+            position_type TEXT NOT NULL,
+            position_id INTEGER NOT NULL,
             user_id INTEGER NOT NULL,
-            type TEXT NOT NULL,
             amount REAL NOT NULL,
-            status TEXT DEFAULT 'pending',
-            transaction_hash TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+            PRIMARY KEY (run_date, position_type, position_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Profit Run Days table : checkpoint par jour de calcul
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profit_run_days (
+            run_date TEXT PRIMARY KEY,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            credited_count INTEGER DEFAULT 0
         )
     ''')
 
@@ -674,15 +466,18 @@ def restore_critical_data():
         )
     ''')
 
-    # Insert default FAQ entries
-    cursor.execute('''
-        INSERT OR IGNORE INTO faq (question, answer, category) VALUES 
-        ('Comment déposer des fonds ?', 'Rendez-vous dans votre portefeuille et cliquez sur "Déposer". Suivez les instructions pour transférer vos USDT.', 'wallet'),
-        ('Quand puis-je retirer mes gains ?', 'Vos gains quotidiens sont disponibles immédiatement pour retrait. Le capital initial est libéré à la fin du plan.', 'investment'),
-        ('Les investissements sont-ils sécurisés ?', 'Oui, nous utilisons des smart contracts et un système de sécurité multicouche pour protéger vos investissements.', 'security'),
-        ('Comment fonctionne le parrainage ?', 'Partagez votre code de parrainage unique et recevez 5% sur tous les investissements de vos filleuls.', 'referral'),
-        ('Quel est le montant minimum d investissement ?', 'Le montant minimum est de 20 USDT pour tous nos plans d investissement.', 'investment')
-    ''')
+    # Insert default FAQ entries (only if not exist)
+    faq_count = cursor.execute('SELECT COUNT(*) as count FROM faq').fetchone()['count']
+
+    if faq_count == 0:
+        cursor.execute('''
+            INSERT OR IGNORE INTO faq (question, answer, category) VALUES 
+            ('Comment déposer des fonds ?', 'Rendez-vous dans votre portefeuille et cliquez sur "Déposer". Suivez les instructions pour transférer vos USDT.', 'wallet'),
+            ('Quand puis-je retirer mes gains ?', 'Vos gains quotidiens sont disponibles immédiatement pour retrait. Le capital initial est libéré à la fin du plan.', 'investment'),
+            ('Les investissements sont-ils sécurisés ?', 'Oui, nous utilisons des smart contracts et un système de sécurité multicouche pour protéger vos investissements.', 'security'),
+            ('Comment fonctionne le parrainage ?', 'Partagez votre code de parrainage unique et recevez 5% sur tous les investissements de vos filleuls.', 'referral'),
+            ('Quel est le montant minimum d investissement ?', 'Le montant minimum est de 20 USDT pour tous nos plans d investissement.', 'investment')
+        ''')
 
     
 
@@ -811,11 +606,864 @@ def restore_critical_data():
     ''')
 
     conn.commit()
+
+    run_migrations(conn)
     conn.close()
 
-# État global pour l'activation admin
-ADMIN_ACCESS_ENABLED = False
-ADMIN_ACCESS_EXPIRY = None
+# Migrations de schéma, suivies via PRAGMA user_version
+# Ajouter toujours une nouvelle version à la fin, ne jamais modifier une version déjà déployée
+SCHEMA_MIGRATIONS = [
+    (1, 'Index des requêtes fréquentes', [
+        'CREATE INDEX IF NOT EXISTS idx_user_investments_user ON user_investments (user_id, start_date)',
+        'CREATE INDEX IF NOT EXISTS idx_user_staking_user ON user_staking (user_id, start_date)',
+        'CREATE INDEX IF NOT EXISTS idx_user_trading_bots_user_active ON user_trading_bots (user_id, is_active)',
+        'CREATE INDEX IF NOT EXISTS idx_user_copy_trading_user_active ON user_copy_trading (user_id, is_active)',
+        'CREATE INDEX IF NOT EXISTS idx_project_investments_user ON project_investments (user_id, investment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_project_investments_project ON project_investments (project_id)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_user_read_created ON notifications (user_id, is_read, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_status_created ON transactions (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_support_tickets_user ON support_tickets (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_support_messages_ticket ON support_messages (ticket_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_security_logs_user_created ON security_logs (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_users_referred_by ON users (referred_by)',
+    ]),
+    (2, 'Table app_meta (empreintes de démarrage)', [
+        '''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+]
+
+# Tables sauvegardées et colonnes retenues
+BACKUP_TABLES = [
+    ('user_investments', '*'),
+    ('user_staking', '*'),
+    ('user_trading_bots', '*'),
+    ('user_copy_trading', '*'),
+    ('project_investments', '*'),
+    ('transactions', '*'),
+    ('users', 'id, email, balance, first_name, last_name'),
+    ('roi_plans', '*'),
+]
+
+SCHEMA_MIGRATIONS.append(
+    (3, 'Journal des modifications pour les sauvegardes incrémentales', [
+        '''
+        CREATE TABLE IF NOT EXISTS backup_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_backup_changes_table_seq ON backup_changes (table_name, seq)',
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_backup_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO backup_changes (table_name, row_id) VALUES ('{table}', NEW.id);
+        END
+        '''
+        for table, _ in BACKUP_TABLES
+        for event in ('INSERT', 'UPDATE')
+    ])
+)
+
+# Agrégats du portefeuille par utilisateur, recalculés entièrement à partir des positions
+# (les investissements projets comptent toujours comme actifs)
+PORTFOLIO_STATS_REBUILD_SQL = '''
+    INSERT OR REPLACE INTO user_portfolio_stats
+    (user_id, total_invested, total_profits, active_count, completed_count, total_count, updated_at)
+    SELECT user_id, SUM(amount), SUM(profit), SUM(active), SUM(1 - active), COUNT(*), CURRENT_TIMESTAMP
+    FROM (
+        SELECT user_id, COALESCE(amount, 0) as amount, COALESCE(total_earned, 0) as profit,
+               CASE WHEN is_active THEN 1 ELSE 0 END as active
+        FROM user_investments
+        UNION ALL
+        SELECT user_id, COALESCE(amount, 0), COALESCE(total_earned, 0), CASE WHEN is_active THEN 1 ELSE 0 END
+        FROM user_staking
+        UNION ALL
+        SELECT user_id, COALESCE(amount, 0), COALESCE(total_profit, 0), CASE WHEN is_active THEN 1 ELSE 0 END
+        FROM user_trading_bots
+        UNION ALL
+        SELECT user_id, COALESCE(amount, 0), COALESCE(total_profit, 0), CASE WHEN is_active THEN 1 ELSE 0 END
+        FROM user_copy_trading
+        UNION ALL
+        SELECT user_id, COALESCE(amount, 0), 0, 1
+        FROM project_investments
+    )
+    GROUP BY user_id
+'''
+
+SCHEMA_MIGRATIONS.append(
+    (4, 'Agrégats du portefeuille par utilisateur', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_portfolio_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_invested REAL NOT NULL DEFAULT 0,
+            total_profits REAL NOT NULL DEFAULT 0,
+            active_count INTEGER NOT NULL DEFAULT 0,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            total_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        PORTFOLIO_STATS_REBUILD_SQL,
+        # Pagination de l'historique par (start_date, id)
+        'CREATE INDEX IF NOT EXISTS idx_user_trading_bots_user_start ON user_trading_bots (user_id, start_date)',
+        'CREATE INDEX IF NOT EXISTS idx_user_copy_trading_user_start ON user_copy_trading (user_id, start_date)',
+    ])
+)
+
+SCHEMA_MIGRATIONS.append(
+    (5, 'Pagination par curseur des transactions par utilisateur', [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions (user_id, created_at)',
+    ])
+)
+
+SCHEMA_MIGRATIONS.append(
+    (6, 'Lecture des messages de support par curseur since_id', [
+        'CREATE INDEX IF NOT EXISTS idx_support_messages_ticket_id ON support_messages (ticket_id, id)',
+    ])
+)
+
+SCHEMA_MIGRATIONS.append(
+    (7, 'Deltas des transactions pour la page admin', [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_status_updated ON transactions (status, updated_at)',
+        # Sur les bases où updated_at a été ajoutée par ALTER TABLE, la colonne n'a pas de valeur par défaut
+        'UPDATE transactions SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_updated_at_default
+        AFTER INSERT ON transactions
+        WHEN NEW.updated_at IS NULL
+        BEGIN
+            UPDATE transactions SET updated_at = COALESCE(NEW.created_at, CURRENT_TIMESTAMP) WHERE id = NEW.id;
+        END
+        ''',
+    ])
+)
+
+# Compteurs globaux du dashboard admin : recomptage complet (migration et réconciliation périodique)
+PLATFORM_COUNTERS_RECOUNT_SQL = '''
+    SELECT 'total_users', COUNT(*) FROM users
+    UNION ALL
+    SELECT 'pending_kyc', COUNT(*) FROM users WHERE kyc_status = 'pending'
+    UNION ALL
+    SELECT 'total_investments', COALESCE(SUM(amount), 0) FROM user_investments
+    UNION ALL
+    SELECT 'total_projects', COUNT(*) FROM projects
+    UNION ALL
+    SELECT 'open_tickets', COUNT(*) FROM support_tickets WHERE status != 'closed'
+    UNION ALL
+    SELECT 'tickets_status:' || COALESCE(status, ''), COUNT(*) FROM support_tickets GROUP BY status
+'''
+
+# (table, événement, [(compteur, variation)]) : les triggers maintiennent les compteurs
+# dans la transaction de chaque écriture (inscription, investissement, ticket ouvert/fermé...)
+PLATFORM_COUNTER_TRIGGERS = [
+    ('users', 'AFTER INSERT', [('total_users', '1'), ('pending_kyc', "COALESCE(NEW.kyc_status = 'pending', 0)")]),
+    ('users', 'AFTER DELETE', [('total_users', '-1'), ('pending_kyc', "-COALESCE(OLD.kyc_status = 'pending', 0)")]),
+    ('users', 'AFTER UPDATE OF kyc_status', [
+        ('pending_kyc', "COALESCE(NEW.kyc_status = 'pending', 0) - COALESCE(OLD.kyc_status = 'pending', 0)"),
+    ]),
+    ('user_investments', 'AFTER INSERT', [('total_investments', 'COALESCE(NEW.amount, 0)')]),
+    ('user_investments', 'AFTER DELETE', [('total_investments', '-COALESCE(OLD.amount, 0)')]),
+    ('user_investments', 'AFTER UPDATE OF amount', [('total_investments', 'COALESCE(NEW.amount, 0) - COALESCE(OLD.amount, 0)')]),
+    ('projects', 'AFTER INSERT', [('total_projects', '1')]),
+    ('projects', 'AFTER DELETE', [('total_projects', '-1')]),
+    ('support_tickets', 'AFTER INSERT', [('open_tickets', "COALESCE(NEW.status != 'closed', 0)")]),
+    ('support_tickets', 'AFTER DELETE', [('open_tickets', "-COALESCE(OLD.status != 'closed', 0)")]),
+    ('support_tickets', 'AFTER UPDATE OF status', [
+        ('open_tickets', "COALESCE(NEW.status != 'closed', 0) - COALESCE(OLD.status != 'closed', 0)"),
+    ]),
+]
+
+SCHEMA_MIGRATIONS.append(
+    (8, 'Compteurs globaux de la plateforme', [
+        '''
+        CREATE TABLE IF NOT EXISTS platform_counters (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'INSERT OR REPLACE INTO platform_counters (name, value) ' + PLATFORM_COUNTERS_RECOUNT_SQL,
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_counters_{event.split()[1].lower()}
+        {event} ON {table}
+        BEGIN
+            {' '.join(
+                f"UPDATE platform_counters SET value = value + ({delta}), updated_at = CURRENT_TIMESTAMP WHERE name = '{name}';"
+                for name, delta in counters
+            )}
+        END
+        '''
+        for table, event, counters in PLATFORM_COUNTER_TRIGGERS
+    ])
+)
+
+SCHEMA_MIGRATIONS.append(
+    (9, 'Compteur de messages dénormalisé et listing paginé des tickets', [
+        'ALTER TABLE support_tickets ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE support_tickets ADD COLUMN last_message_at TIMESTAMP',
+        '''
+        UPDATE support_tickets
+        SET message_count = messages.count, last_message_at = messages.last_at
+        FROM (
+            SELECT ticket_id, COUNT(*) as count, MAX(created_at) as last_at
+            FROM support_messages GROUP BY ticket_id
+        ) AS messages
+        WHERE support_tickets.id = messages.ticket_id
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_support_tickets_created ON support_tickets (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_support_tickets_status_created ON support_tickets (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_support_tickets_priority_created ON support_tickets (priority, created_at)',
+    ])
+)
+
+# Recherche plein texte du support : une ligne FTS5 par ticket, message et question de FAQ.
+# rowid = id * 3 + type, pour que les triggers mettent l'index à jour par clé
+SUPPORT_SEARCH_KINDS = ('ticket', 'message', 'faq')
+SUPPORT_SEARCH_SOURCES = [
+    # (table, type, ticket_id, title, body, colonnes surveillées)
+    ('support_tickets', 0, '{row}.id', '{row}.subject', "''", 'subject'),
+    ('support_messages', 1, '{row}.ticket_id', "''", '{row}.message', 'message'),
+    ('faq', 2, 'NULL', '{row}.question', '{row}.answer', 'question, answer'),
+]
+
+def _support_search_statements():
+    statements = [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS support_search USING fts5(
+            ticket_id UNINDEXED, title, body,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''',
+    ]
+    for table, kind, ticket_id, title, body, columns in SUPPORT_SEARCH_SOURCES:
+        def values(row):
+            return (f'{row}.id * 3 + {kind}, {ticket_id.format(row=row)}, '
+                    f'COALESCE({title.format(row=row)}, \'\'), COALESCE({body.format(row=row)}, \'\')')
+        insert = f'INSERT INTO support_search (rowid, ticket_id, title, body) VALUES ({values("NEW")});'
+        delete = f'DELETE FROM support_search WHERE rowid = OLD.id * 3 + {kind};'
+        statements += [
+            f'INSERT INTO support_search (rowid, ticket_id, title, body) SELECT {values(table)} FROM {table}',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_insert AFTER INSERT ON {table} BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_update AFTER UPDATE OF {columns} ON {table} BEGIN {delete} {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_delete AFTER DELETE ON {table} BEGIN {delete} END',
+        ]
+    return statements
+
+SCHEMA_MIGRATIONS.append(
+    (10, 'Recherche plein texte FTS5 des tickets, messages et FAQ', _support_search_statements())
+)
+
+SCHEMA_MIGRATIONS.append(
+    (11, 'Journal append-only des mouvements de solde', [
+        '''
+        CREATE TABLE IF NOT EXISTS ledger_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            balance_after REAL NOT NULL,
+            kind TEXT NOT NULL,
+            reference TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ledger_entries_user ON ledger_entries (user_id, id)',
+    ])
+)
+
+# Tables du catalogue (petites, quasi statiques) : toute écriture incrémente la génération partagée
+CATALOG_SOURCE_TABLES = ('roi_plans', 'staking_plans', 'frozen_plans', 'trading_strategies', 'top_traders', 'faq')
+
+SCHEMA_MIGRATIONS.append(
+    (12, 'Génération du catalogue en cache', [
+        "INSERT OR IGNORE INTO app_meta (key, value) VALUES ('catalog_generation', '0')",
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_catalog_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE app_meta SET value = CAST(value AS INTEGER) + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE key = 'catalog_generation';
+        END
+        '''
+        for table in CATALOG_SOURCE_TABLES
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ])
+)
+
+# Tickets par statut : un compteur 'tickets_status:<statut>' par valeur rencontrée (upsert dans les triggers)
+TICKET_STATUS_COUNTER = "'tickets_status:' || COALESCE({row}.status, '')"
+
+def _ticket_status_delta(row, delta):
+    return (f"INSERT INTO platform_counters (name, value) VALUES ({TICKET_STATUS_COUNTER.format(row=row)}, {delta}) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + ({delta}), updated_at = CURRENT_TIMESTAMP;")
+
+SCHEMA_MIGRATIONS.append(
+    (13, 'Compteurs de tickets par statut', [
+        f'''
+        INSERT OR REPLACE INTO platform_counters (name, value)
+        SELECT {TICKET_STATUS_COUNTER.format(row='support_tickets')}, COUNT(*) FROM support_tickets GROUP BY status
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_support_tickets_status_counts_insert
+        AFTER INSERT ON support_tickets
+        BEGIN {_ticket_status_delta('NEW', 1)} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_support_tickets_status_counts_delete
+        AFTER DELETE ON support_tickets
+        BEGIN {_ticket_status_delta('OLD', -1)} END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_support_tickets_status_counts_update
+        AFTER UPDATE OF status ON support_tickets
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN {_ticket_status_delta('OLD', -1)} {_ticket_status_delta('NEW', 1)} END
+        ''',
+    ])
+)
+
+SCHEMA_VERSION = max(version for version, _, _ in SCHEMA_MIGRATIONS)
+
+def run_migrations(conn):
+    """Appliquer les migrations dont la version dépasse PRAGMA user_version"""
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+    for version, description, statements in SCHEMA_MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA user_version est transactionnel : la version avance avec la migration
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.execute('COMMIT')
+            print(f"✅ Migration {version} appliquée: {description}")
+        except sqlite3.Error as e:
+            conn.execute('ROLLBACK')
+            print(f"❌ Erreur migration {version}: {e}")
+            raise
+
+    return max(current_version, SCHEMA_VERSION)
+
+def bump_portfolio_stats(conn, user_id, invested=0, profits=0, opened=0, closed=0):
+    """Mettre à jour les agrégats d'un utilisateur dans la transaction de l'écriture"""
+    conn.execute('''
+        INSERT INTO user_portfolio_stats
+        (user_id, total_invested, total_profits, active_count, completed_count, total_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_invested = total_invested + excluded.total_invested,
+            total_profits = total_profits + excluded.total_profits,
+            active_count = active_count + excluded.active_count,
+            completed_count = completed_count + excluded.completed_count,
+            total_count = total_count + excluded.total_count,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, invested, profits, opened - closed, closed, opened))
+
+def rebuild_portfolio_stats(conn):
+    """Recalculer tous les agrégats (après une restauration en masse)"""
+    conn.execute('DELETE FROM user_portfolio_stats')
+    conn.execute(PORTFOLIO_STATS_REBUILD_SQL)
+
+def reconcile_platform_counters(conn=None):
+    """Recompter les compteurs globaux et corriger la dérive (job périodique, après restauration)"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+
+    try:
+        if own_connection:
+            conn.execute('BEGIN IMMEDIATE')
+        stored = dict(conn.execute('SELECT name, value FROM platform_counters').fetchall())
+        recounted = conn.execute(PLATFORM_COUNTERS_RECOUNT_SQL).fetchall()
+        # Un statut de ticket qui n'existe plus n'apparaît pas dans le recomptage : son compteur revient à 0
+        recounted_names = {name for name, _ in recounted}
+        recounted += [
+            (name, 0) for name in stored
+            if name.startswith('tickets_status:') and name not in recounted_names
+        ]
+        # Les sommes incrémentales et le SUM complet peuvent différer à l'arrondi près
+        drift = {
+            name: value - stored.get(name, 0) for name, value in recounted
+            if name not in stored or abs(value - stored[name]) > 1e-6
+        }
+        if drift:
+            conn.executemany('''
+                INSERT OR REPLACE INTO platform_counters (name, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', recounted)
+        if own_connection:
+            conn.execute('COMMIT')
+    except Exception:
+        if own_connection:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        if own_connection:
+            conn.close()
+
+    if drift:
+        print(f"⚠️ Compteurs de la plateforme corrigés: {drift}")
+    admin_stats_cache.clear()
+    return drift
+
+# Sauvegarde en flux : segments NDJSON de BACKUP_CHUNK_SIZE lignes, deltas depuis le dernier high-water mark
+BACKUP_CHUNK_SIZE = 500
+BACKUP_FULL_EVERY = 48  # une sauvegarde complète toutes les 48 sauvegardes incrémentales
+
+def _write_backup_segments(conn, table, columns, backup_id, low_seq=None, high_seq=None):
+    """Écrire les lignes d'une table (toutes, ou celles modifiées entre deux seq) par segments"""
+    if low_seq is None:
+        cursor = conn.execute(f'SELECT {columns} FROM {table} ORDER BY id')
+    else:
+        cursor = conn.execute(f'''
+            SELECT {columns} FROM {table}
+            WHERE id IN (
+                SELECT row_id FROM backup_changes
+                WHERE table_name = ? AND seq > ? AND seq <= ?
+            )
+            ORDER BY id
+        ''', (table, low_seq, high_seq))
+
+    segments = []
+    while True:
+        rows = cursor.fetchmany(BACKUP_CHUNK_SIZE)
+        if not rows:
+            break
+        key = f'backup:{backup_id}:{table}:{len(segments)}'
+        replit_db[key] = '\n'.join(json.dumps(dict(row), default=str) for row in rows)
+        segments.append({'key': key, 'table': table, 'rows': len(rows)})
+    return segments
+
+def _backup_to_replit():
+    """Sauvegarder les données critiques dans Replit DB (incrémental, mémoire constante)"""
+    if not REPLIT_DB_AVAILABLE:
+        return
+    
+    try:
+        conn = get_db_connection()
+
+        manifest = json.loads(replit_db['backup_manifest']) if 'backup_manifest' in replit_db else None
+        high_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM backup_changes').fetchone()[0]
+        full = manifest is None or manifest.get('deltas', 0) >= BACKUP_FULL_EVERY
+        low_seq = None if full else manifest['watermark']
+        backup_id = datetime.now().strftime('%Y%m%d%H%M%S')
+
+        segments = []
+        for table, columns in BACKUP_TABLES:
+            segments += _write_backup_segments(conn, table, columns, backup_id, low_seq, high_seq)
+
+        if full:
+            old_keys = [segment['key'] for segment in manifest['segments']] if manifest else []
+            manifest = {'watermark': high_seq, 'deltas': 0, 'segments': segments}
+        else:
+            old_keys = []
+            manifest['watermark'] = high_seq
+            manifest['deltas'] += 1
+            manifest['segments'] += segments
+
+        replit_db['backup_manifest'] = json.dumps(manifest)
+        replit_db['last_backup'] = datetime.now().isoformat()
+
+        # L'ancienne chaîne n'est supprimée qu'une fois le nouveau manifeste écrit
+        for key in old_keys:
+            del replit_db[key]
+
+        # Les modifications sauvegardées ne sont plus utiles
+        conn.execute('DELETE FROM backup_changes WHERE seq <= ?', (high_seq,))
+        conn.commit()
+        conn.close()
+
+        rows = sum(segment['rows'] for segment in segments)
+        print(f"✅ Sauvegarde {'complète' if full else 'incrémentale'} effectuée: {rows} lignes en {len(segments)} segments")
+        
+    except Exception as e:
+        print(f"❌ Erreur sauvegarde: {e}")
+
+def _iter_backup_rows(table):
+    """Relire en flux les lignes sauvegardées d'une table, segment par segment"""
+    manifest = json.loads(replit_db['backup_manifest'])
+    for segment in manifest['segments']:
+        if segment['table'] != table:
+            continue
+        for line in replit_db[segment['key']].splitlines():
+            yield json.loads(line)
+
+# Restauration en masse : colonnes restaurées et valeurs par défaut de chaque table
+RESTORE_BATCH_SIZE = 5000
+RESTORE_PROGRESS_EVERY = 50000
+RESTORE_TABLES = [
+    ('user_investments',
+     ('id', 'user_id', 'plan_id', 'amount', 'start_date', 'end_date', 'daily_profit', 'total_earned', 'is_active', 'transaction_hash'),
+     {'total_earned': 0, 'is_active': 1}),
+    ('user_staking',
+     ('id', 'user_id', 'plan_id', 'amount', 'start_date', 'end_date', 'is_active', 'is_withdrawn', 'total_earned', 'transaction_hash'),
+     {'is_active': 1, 'is_withdrawn': 0, 'total_earned': 0}),
+    ('user_trading_bots',
+     ('id', 'user_id', 'strategy_id', 'amount', 'start_date', 'end_date', 'is_active', 'total_profit', 'daily_profit', 'last_profit_date', 'transaction_hash'),
+     {'is_active': 1, 'total_profit': 0, 'daily_profit': 0}),
+    ('user_copy_trading',
+     ('id', 'user_id', 'trader_id', 'amount', 'start_date', 'end_date', 'is_active', 'total_profit', 'copy_ratio', 'transaction_hash'),
+     {'is_active': 1, 'total_profit': 0, 'copy_ratio': 1.0}),
+    ('project_investments',
+     ('id', 'user_id', 'project_id', 'amount', 'investment_date', 'transaction_hash'),
+     {}),
+    ('transactions',
+     ('id', 'user_id', 'type', 'amount', 'status', 'transaction_hash', 'created_at', 'updated_at'),
+     {}),
+    # Seuls les soldes sont restaurés : les comptes eux-mêmes existent déjà
+    ('users', ('id', 'balance'), {'balance': 0}),
+]
+
+def _valid_restore_row(row, columns):
+    """Une ligne est chargée si elle a un id entier (et un user_id entier quand la table en a un)"""
+    if not isinstance(row, dict) or not isinstance(row.get('id'), int):
+        return False
+    return 'user_id' not in columns or isinstance(row.get('user_id'), int)
+
+def _stage_backup_table(conn, table, columns, defaults, progress):
+    """Charger les lignes sauvegardées d'une table dans temp.restore_<table> par lots executemany"""
+    staging = f'restore_{table}'
+    column_list = ', '.join(columns)
+    conn.execute(f'DROP TABLE IF EXISTS temp.{staging}')
+    conn.execute(f'CREATE TEMP TABLE {staging} AS SELECT {column_list} FROM main.{table} LIMIT 0')
+    insert_sql = f'INSERT INTO temp.{staging} ({column_list}) VALUES ({", ".join("?" * len(columns))})'
+
+    loaded = rejected = 0
+    batch = []
+    for row in _iter_backup_rows(table):
+        if not _valid_restore_row(row, columns):
+            rejected += 1
+            continue
+        batch.append(tuple(row.get(column, defaults.get(column)) for column in columns))
+        if len(batch) >= RESTORE_BATCH_SIZE:
+            conn.executemany(insert_sql, batch)
+            loaded += len(batch)
+            batch = []
+            progress(table, loaded)
+    if batch:
+        conn.executemany(insert_sql, batch)
+        loaded += len(batch)
+
+    if rejected:
+        print(f"⚠️ {table}: {rejected} lignes invalides ignorées")
+    return staging, loaded
+
+def _restore_from_replit():
+    """Restaurer les données critiques depuis Replit DB (tables de transit, une seule transaction)"""
+    if not REPLIT_DB_AVAILABLE:
+        return False
+    
+    try:
+        # Vérifier s'il y a une sauvegarde disponible
+        if 'backup_manifest' not in replit_db:
+            return False
+        
+        conn = get_db_connection()
+        started = time.perf_counter()
+        total = {'rows': 0, 'reported': 0}
+
+        def progress(table, loaded):
+            if total['rows'] + loaded - total['reported'] >= RESTORE_PROGRESS_EVERY:
+                total['reported'] = total['rows'] + loaded
+                print(f"🔄 Restauration: {total['reported']} lignes chargées ({table})")
+
+        print("🔄 Restauration de l'historique complet depuis la sauvegarde...")
+
+        staged = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            changes_before = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM backup_changes').fetchone()[0]
+
+            for table, columns, defaults in RESTORE_TABLES:
+                staging, loaded = _stage_backup_table(conn, table, columns, defaults, progress)
+                staged.append(staging)
+                total['rows'] += loaded
+
+                # Une ligne peut figurer dans la complète et dans plusieurs deltas : la dernière version gagne
+                latest = f'SELECT {", ".join(columns)} FROM temp.{staging} WHERE rowid IN (SELECT MAX(rowid) FROM temp.{staging} GROUP BY id)'
+                if table == 'users':
+                    conn.execute(f'''
+                        UPDATE users SET balance = restored.balance
+                        FROM ({latest}) AS restored
+                        WHERE users.id = restored.id
+                    ''')
+                else:
+                    conn.execute(f'INSERT OR REPLACE INTO main.{table} ({", ".join(columns)}) {latest}')
+
+            rebuild_portfolio_stats(conn)
+            reconcile_platform_counters(conn)
+
+            # Les lignes restaurées sont déjà dans la sauvegarde : ne pas les renvoyer au prochain delta
+            conn.execute('DELETE FROM backup_changes WHERE seq > ?', (changes_before,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            for staging in staged:
+                conn.execute(f'DROP TABLE IF EXISTS temp.{staging}')
+            conn.close()
+
+        elapsed = time.perf_counter() - started
+        last_backup = replit_db.get('last_backup', 'Inconnue')
+        print(f"✅ Historique complet restauré depuis la sauvegarde du {last_backup}: "
+              f"{total['rows']} lignes en {elapsed:.1f}s ({total['rows'] / elapsed if elapsed else 0:.0f} lignes/s)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Erreur restauration: {e}")
+        return False
+
+# Instantanés locaux : copie page à page via l'API de sauvegarde en ligne de SQLite
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_RETENTION_DAYS = float(os.environ.get('BACKUP_RETENTION_DAYS', 7))
+BACKUP_PAGES_PER_STEP = 1024  # les écrivains ne sont bloqués que le temps d'une étape
+SNAPSHOT_SUFFIXES = ('.db.zst', '.db.gz')
+
+def _snapshot_prefix():
+    return os.path.splitext(os.path.basename(DATABASE))[0] + '-'
+
+def _compress_snapshot(raw_path, snapshot_path):
+    with open(raw_path, 'rb') as source:
+        if snapshot_path.endswith('.zst'):
+            with open(snapshot_path, 'wb') as target:
+                zstandard.ZstdCompressor(level=3).copy_stream(source, target)
+        else:
+            with gzip.open(snapshot_path, 'wb', compresslevel=6) as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+def _decompress_snapshot(snapshot_path, raw_path):
+    with open(raw_path, 'wb') as target:
+        if snapshot_path.endswith('.zst'):
+            with open(snapshot_path, 'rb') as source:
+                zstandard.ZstdDecompressor().copy_stream(source, target)
+        else:
+            with gzip.open(snapshot_path, 'rb') as source:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+def list_local_snapshots():
+    """Instantanés locaux de la base, du plus récent au plus ancien"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    prefix = _snapshot_prefix()
+    snapshots = [
+        os.path.join(BACKUP_DIR, name) for name in os.listdir(BACKUP_DIR)
+        if name.startswith(prefix) and name.endswith(SNAPSHOT_SUFFIXES)
+    ]
+    return sorted(snapshots, key=os.path.getmtime, reverse=True)
+
+def _rotate_local_snapshots():
+    """Supprimer les instantanés plus vieux que BACKUP_RETENTION_DAYS (le plus récent est toujours gardé)"""
+    cutoff = time.time() - BACKUP_RETENTION_DAYS * 86400
+    removed = 0
+    for path in list_local_snapshots()[1:]:
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
+
+def _backup_to_local():
+    """Instantané compressé de toute la base (y compris notifications et support) dans BACKUP_DIR"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    started = time.perf_counter()
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    raw_path = os.path.join(BACKUP_DIR, f'.{_snapshot_prefix()}{stamp}.db.tmp')
+    snapshot_path = os.path.join(BACKUP_DIR, f'{_snapshot_prefix()}{stamp}{".db.zst" if ZSTD_AVAILABLE else ".db.gz"}')
+
+    try:
+        source = sqlite3.connect(DATABASE, timeout=30)
+        target = sqlite3.connect(raw_path)
+        try:
+            high_seq = source.execute('SELECT COALESCE(MAX(seq), 0) FROM backup_changes').fetchone()[0]
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP)
+
+            # L'instantané contient toute la base : le journal des modifications déjà couvertes ne sert plus
+            source.execute('DELETE FROM backup_changes WHERE seq <= ?', (high_seq,))
+            source.commit()
+        finally:
+            target.close()
+            source.close()
+
+        # Écriture dans un fichier temporaire puis renommage : un instantané visible est toujours complet
+        _compress_snapshot(raw_path, snapshot_path + '.part')
+        os.replace(snapshot_path + '.part', snapshot_path)
+        removed = _rotate_local_snapshots()
+
+        print(f"✅ Instantané local créé: {snapshot_path} "
+              f"({os.path.getsize(snapshot_path) / 1024:.0f} Ko en {time.perf_counter() - started:.1f}s, {removed} ancien(s) supprimé(s))")
+        return snapshot_path
+    except Exception as e:
+        print(f"❌ Erreur sauvegarde locale: {e}")
+        if os.path.exists(snapshot_path + '.part'):
+            os.remove(snapshot_path + '.part')
+        return None
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+def database_has_users():
+    """Vrai si la base existe et contient déjà des comptes (données vivantes à ne pas écraser)"""
+    if not os.path.exists(DATABASE):
+        return False
+    try:
+        conn = sqlite3.connect(DATABASE, timeout=60.0)
+        try:
+            return conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+def _restore_from_local():
+    """Recopier le dernier instantané local dans une base encore vide, puis rejouer les migrations"""
+    snapshots = list_local_snapshots()
+    if not snapshots:
+        return False
+
+    # L'instantané remplace toute la base : tout ce qui a été écrit depuis serait perdu
+    if database_has_users():
+        print("⚠️ Restauration locale refusée: la base contient déjà des comptes")
+        return False
+
+    snapshot_path = snapshots[0]
+    raw_path = os.path.join(BACKUP_DIR, f'.restore-{os.getpid()}.db.tmp')
+    started = time.perf_counter()
+    print(f"🔄 Restauration depuis l'instantané local {snapshot_path}...")
+
+    try:
+        _decompress_snapshot(snapshot_path, raw_path)
+        source = sqlite3.connect(raw_path)
+        target = sqlite3.connect(DATABASE, timeout=30)
+        try:
+            generation = target.execute("SELECT value FROM app_meta WHERE key = 'catalog_generation'").fetchone()
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP)
+            # L'instantané peut précéder des migrations plus récentes
+            run_migrations(target)
+            # Génération strictement supérieure à celle d'avant la restauration : aucun worker ne garde son catalogue
+            target.execute('''
+                UPDATE app_meta SET value = MAX(CAST(value AS INTEGER), ?) + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE key = 'catalog_generation'
+            ''', (int(generation[0]) if generation else 0,))
+            target.commit()
+        finally:
+            target.close()
+            source.close()
+
+        print(f"✅ Base restaurée depuis {snapshot_path} en {time.perf_counter() - started:.1f}s")
+        return True
+    except Exception as e:
+        print(f"❌ Erreur restauration locale: {e}")
+        return False
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+# Cible de sauvegarde : 'local' (instantanés SQLite), 'replit' (Replit DB) ou 'none'
+BACKUP_TARGET = os.environ.get('BACKUP_TARGET', 'replit' if REPLIT_DB_AVAILABLE else 'local').lower()
+BACKUP_TARGETS = {
+    'local': (_backup_to_local, _restore_from_local),
+    'replit': (_backup_to_replit, _restore_from_replit),
+}
+BACKUP_ENABLED = BACKUP_TARGET == 'local' or (BACKUP_TARGET == 'replit' and REPLIT_DB_AVAILABLE)
+
+def backup_critical_data():
+    """Sauvegarder vers la cible configurée par BACKUP_TARGET"""
+    if not BACKUP_ENABLED:
+        return
+    backup, _ = BACKUP_TARGETS[BACKUP_TARGET]
+    return backup()
+
+def restore_critical_data():
+    """Restaurer depuis la cible configurée par BACKUP_TARGET"""
+    if not BACKUP_ENABLED:
+        return False
+    _, restore = BACKUP_TARGETS[BACKUP_TARGET]
+    restored = restore()
+    if restored:
+        clear_caches_after_restore()
+    return restored
+
+def clear_caches_after_restore():
+    """Vider les caches du processus ; les autres workers expirent par TTL ou voient la nouvelle génération"""
+    dashboard_cache.clear()
+    admin_stats_cache.clear()
+    page_cache.clear()
+    catalog.invalidate()
+    admin_access.invalidate()
+
+# Activation admin partagée entre workers : échéance (timestamp Unix) dans la ligne app_meta
+# 'admin_access_expiry', relue au plus une fois toutes les ADMIN_ACCESS_CACHE_TTL secondes par processus
+ADMIN_ACCESS_CACHE_TTL = float(os.environ.get('ADMIN_ACCESS_CACHE_TTL', 2))
+ADMIN_ACCESS_KEY = 'admin_access_expiry'
+
+class AdminAccessState:
+    """Cache de lecture de l'échéance d'activation ; une échéance dépassée désactive sans relire la base"""
+
+    def __init__(self, ttl=2):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._expiry = None
+        self._fetched_at = None
+
+    def expiry(self):
+        """Échéance courante (None si désactivé), depuis le cache tant qu'il est frais"""
+        now = time.monotonic()
+        with self._lock:
+            if self._fetched_at is not None and now - self._fetched_at < self.ttl:
+                expiry = self._expiry
+                return expiry if expiry is not None and time.time() < expiry else None
+
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT value FROM app_meta WHERE key = ?', (ADMIN_ACCESS_KEY,)).fetchone()
+        finally:
+            conn.close()
+        expiry = float(row[0]) if row and row[0] else None
+
+        with self._lock:
+            self._expiry, self._fetched_at = expiry, now
+        return expiry if expiry is not None and time.time() < expiry else None
+
+    def set(self, expiry):
+        """Écrire l'échéance (None pour désactiver) ; les autres workers la voient au plus tard après ttl"""
+        conn = get_db_connection()
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO app_meta (key, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (ADMIN_ACCESS_KEY, '' if expiry is None else repr(expiry)))
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._expiry, self._fetched_at = expiry, time.monotonic()
+
+    def is_enabled(self):
+        return self.expiry() is not None
+
+    def invalidate(self):
+        """Relire l'échéance au prochain contrôle"""
+        with self._lock:
+            self._fetched_at = None
+
+admin_access = AdminAccessState(ADMIN_ACCESS_CACHE_TTL)
 
 # Authentication decorator
 def login_required(f):
@@ -826,22 +1474,25 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def api_login_required(f):
+    """Comme login_required, mais répond 401 en JSON au lieu de rediriger"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentification requise'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Admin decorator avec vérification d'activation
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        global ADMIN_ACCESS_ENABLED, ADMIN_ACCESS_EXPIRY
-
-        # Vérifier si l'accès admin est expiré
-        if ADMIN_ACCESS_EXPIRY and datetime.now() > ADMIN_ACCESS_EXPIRY:
-            ADMIN_ACCESS_ENABLED = False
-            ADMIN_ACCESS_EXPIRY = None
-
         if 'user_id' not in session or session.get('is_admin') != True:
             flash('Accès refusé. Privilèges administrateur requis.', 'error')
             return redirect(url_for('dashboard'))
 
-        if not ADMIN_ACCESS_ENABLED:
+        # Échéance partagée entre workers, lue dans le cache du processus
+        if not admin_access.is_enabled():
             flash('Accès administrateur désactivé. Activez d\'abord l\'accès avec la commande appropriée.', 'warning')
             return redirect(url_for('admin_activation_required'))
 
@@ -850,280 +1501,885 @@ def admin_required(f):
 
 def enable_admin_access(duration_minutes=30):
     """Active l'accès admin pour une durée limitée"""
-    global ADMIN_ACCESS_ENABLED, ADMIN_ACCESS_EXPIRY
-    ADMIN_ACCESS_ENABLED = True
-    ADMIN_ACCESS_EXPIRY = datetime.now() + timedelta(minutes=duration_minutes)
-    print(f"🔓 Accès admin activé pour {duration_minutes} minutes jusqu'à {ADMIN_ACCESS_EXPIRY.strftime('%H:%M:%S')}")
+    expiry = datetime.now() + timedelta(minutes=duration_minutes)
+    admin_access.set(expiry.timestamp())
+    print(f"🔓 Accès admin activé pour {duration_minutes} minutes jusqu'à {expiry.strftime('%H:%M:%S')}")
 
 def disable_admin_access():
     """Désactive immédiatement l'accès admin"""
-    global ADMIN_ACCESS_ENABLED, ADMIN_ACCESS_EXPIRY
-    ADMIN_ACCESS_ENABLED = False
-    ADMIN_ACCESS_EXPIRY = None
+    admin_access.set(None)
     print("🔒 Accès admin désactivé")
 
 def get_admin_status():
     """Retourne le statut de l'accès admin"""
-    global ADMIN_ACCESS_ENABLED, ADMIN_ACCESS_EXPIRY
-
-    if ADMIN_ACCESS_EXPIRY and datetime.now() > ADMIN_ACCESS_EXPIRY:
-        ADMIN_ACCESS_ENABLED = False
-        ADMIN_ACCESS_EXPIRY = None
+    expiry = admin_access.expiry()
 
     return {
-        'enabled': ADMIN_ACCESS_ENABLED,
-        'expiry': ADMIN_ACCESS_EXPIRY,
-        'remaining_minutes': (ADMIN_ACCESS_EXPIRY - datetime.now()).total_seconds() / 60 if ADMIN_ACCESS_EXPIRY else 0
+        'enabled': expiry is not None,
+        'expiry': datetime.fromtimestamp(expiry) if expiry else None,
+        'remaining_minutes': (expiry - time.time()) / 60 if expiry else 0
     }
 
-# Utility functions
-def get_db_connection():
-    import time
-    max_retries = 5
-    for attempt in range(max_retries):
+# Pool de connexions SQLite
+# Taille du pool par processus (donc par worker gunicorn) : au moins un par thread gthread,
+# sinon les requêtes attendent une connexion alors que des threads sont libres
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', GUNICORN_THREADS))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+class SQLiteConnectionPool:
+    """Pool de connexions SQLite physiques, PRAGMAs appliqués une seule fois par connexion"""
+
+    def __init__(self, database, max_size=4, timeout=30.0):
+        self.database = database
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Appelé à la création et après un fork (les connexions ne se partagent pas entre processus)
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _connect(self):
+        max_retries = 5
+        for attempt in range(max_retries):
+            try:
+                conn = sqlite3.connect(self.database, timeout=60.0, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                # Enable WAL mode for better concurrency
+                conn.execute('PRAGMA journal_mode=WAL;')
+                conn.execute('PRAGMA busy_timeout=60000;')  # 60 seconds timeout
+                conn.execute('PRAGMA synchronous=NORMAL;')  # Better performance
+                conn.execute('PRAGMA cache_size=10000;')     # Larger cache
+                conn.execute('PRAGMA temp_store=memory;')    # Use memory for temp
+                return conn
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e) and attempt < max_retries - 1:
+                    time.sleep(0.5 * (attempt + 1))  # Progressive backoff
+                    continue
+                else:
+                    print(f"❌ Database connection failed after {max_retries} attempts: {e}")
+                    raise e
+            except Exception as e:
+                print(f"❌ Unexpected database error: {e}")
+                raise e
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
         try:
-            conn = sqlite3.connect(DATABASE, timeout=60.0)
-            conn.row_factory = sqlite3.Row
-            # Enable WAL mode for better concurrency
-            conn.execute('PRAGMA journal_mode=WAL;')
-            conn.execute('PRAGMA busy_timeout=60000;')  # 60 seconds timeout
-            conn.execute('PRAGMA synchronous=NORMAL;')  # Better performance
-            conn.execute('PRAGMA cache_size=10000;')     # Larger cache
-            conn.execute('PRAGMA temp_store=memory;')    # Use memory for temp
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
             return conn
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                time.sleep(0.5 * (attempt + 1))  # Progressive backoff
-                continue
-            else:
-                print(f"❌ Database connection failed after {max_retries} attempts: {e}")
-                raise e
-        except Exception as e:
-            print(f"❌ Unexpected database error: {e}")
-            raise e
-    return conn
+        except queue.Empty:
+            pass
 
-def generate_transaction_hash():
-    return hashlib.sha256(f"{datetime.now().isoformat()}{secrets.token_hex(16)}".encode()).hexdigest()
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
 
-def generate_referral_code():
-    return secrets.token_urlsafe(8).upper()
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
 
-def add_notification(user_id, title, message, type='info'):
-    import time
-    max_retries = 3
-    for attempt in range(max_retries):
         try:
-            conn = get_db_connection()
-            conn.execute('''
-                INSERT INTO notifications (user_id, title, message, type)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, title, message, type))
-            conn.commit()
-            conn.close()
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"Pool de connexions épuisé après {self.timeout}s d'attente")
+
+    def release(self, conn):
+        if self._pid != os.getpid():
             return
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                time.sleep(0.1 * (attempt + 1))  # Progressive backoff
-                continue
-            else:
-                print(f"❌ Erreur ajout notification après {attempt + 1} tentatives: {e}")
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Connexion inutilisable : on la jette et on libère sa place
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Fermer les connexions inactives (avant un fork : les workers ne doivent pas en hériter)"""
+        closed = 0
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            closed += 1
+        with self._lock:
+            self._created -= closed
+        return closed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'max_size': self.max_size,
+                'open_connections': self._created,
+                'idle_connections': self._idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits
+            }
+
+db_pool = SQLiteConnectionPool(DATABASE, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+_db_local = threading.local()
+
+class _ConnectionHolder:
+    """Connexion physique partagée par toutes les poignées d'une même requête ou d'un même thread"""
+
+    def __init__(self, conn, request_scoped):
+        self.conn = conn
+        self.request_scoped = request_scoped
+        self.refs = 0
+        self.pending_commit = False
+
+class PooledConnection:
+    """Poignée vers la connexion du pool : close() ne ferme pas la connexion physique
+
+    La première poignée ouverte est propriétaire de la transaction ; une poignée empruntée par un
+    helper imbriqué (log_security_action...) ne valide ni n'annule : son commit() est reporté au
+    commit du propriétaire, ou à la fermeture de la dernière poignée si personne n'a annulé."""
+
+    def __init__(self, holder):
+        self._holder = holder
+        self._closed = False
+        self.owner = holder.refs == 0
+        holder.refs += 1
+
+    def __getattr__(self, name):
+        return getattr(self._holder.conn, name)
+
+    def commit(self):
+        if self.owner:
+            self._holder.pending_commit = False
+            self._holder.conn.commit()
+        else:
+            self._holder.pending_commit = True
+
+    def rollback(self):
+        if self.owner:
+            self._holder.pending_commit = False
+            self._holder.conn.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Comme sqlite3.Connection : commit si le bloc réussit, rollback sinon
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        holder = self._holder
+        holder.refs -= 1
+        if holder.refs > 0:
+            return
+        # Comme un vrai close() : le travail non commité est abandonné, sauf commit d'un helper imbriqué
+        _finish_transaction(holder)
+        if not holder.request_scoped:
+            _db_local.holder = None
+            db_pool.release(holder.conn)
+
+def _finish_transaction(holder, failed=False):
+    """Fin de la dernière poignée : valider les commits reportés, annuler le reste"""
+    commit = holder.pending_commit and not failed
+    holder.pending_commit = False
+    if holder.conn.in_transaction:
+        if commit:
+            holder.conn.commit()
+        else:
+            holder.conn.rollback()
+
+# Utility functions
+def get_db_connection():
+    """Connexion du pool, partagée pendant toute la requête (ou tout le thread hors requête)"""
+    if has_app_context():
+        holder = g.get('_db_holder')
+        if holder is None:
+            holder = _ConnectionHolder(db_pool.acquire(), request_scoped=True)
+            g._db_holder = holder
+    else:
+        holder = getattr(_db_local, 'holder', None)
+        if holder is None:
+            holder = _ConnectionHolder(db_pool.acquire(), request_scoped=False)
+            _db_local.holder = holder
+    return PooledConnection(holder)
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    """Rendre la connexion de la requête au pool"""
+    holder = g.pop('_db_holder', None)
+    if holder is not None:
+        try:
+            _finish_transaction(holder, failed=exception is not None)
+        except sqlite3.Error as e:
+            print(f"❌ Erreur validation en fin de requête: {e}")
+        db_pool.release(holder.conn)
+
+def generate_transaction_hash():
+    return hashlib.sha256(f"{datetime.now().isoformat()}{secrets.token_hex(16)}".encode()).hexdigest()
+
+def generate_referral_code():
+    return secrets.token_urlsafe(8).upper()
+
+class TTLCache:
+    """LRU borné avec expiration, partagé entre threads ; l'expiration couvre les écritures des autres workers"""
+
+    def __init__(self, max_size=2048, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
+
+# Modèle de lecture du tableau de bord : LRU par utilisateur, invalidé par les écritures
+DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 2048))
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+
+dashboard_cache = TTLCache(DASHBOARD_CACHE_SIZE, DASHBOARD_CACHE_TTL)
+
+def invalidate_dashboard(*user_ids):
+    """À appeler après le commit de toute écriture visible sur le tableau de bord"""
+    dashboard_cache.invalidate(*user_ids)
+
+# Instantané des compteurs globaux servi au dashboard admin
+ADMIN_STATS_TTL = float(os.environ.get('ADMIN_STATS_TTL', 30))
+PLATFORM_COUNTERS_RECONCILE_MINUTES = int(os.environ.get('PLATFORM_COUNTERS_RECONCILE_MINUTES', 60))
+
+admin_stats_cache = TTLCache(1, ADMIN_STATS_TTL)
+
+# Catalogue partagé par les routes : chaque entrée est une requête complète, lue une fois par génération
+CATALOG_CHECK_TTL = float(os.environ.get('CATALOG_CHECK_TTL', 5))
+CATALOG_QUERIES = {
+    'roi_plans': 'SELECT * FROM roi_plans',
+    'ultra_plans': '''
+        SELECT * FROM roi_plans
+        WHERE is_active = 1 AND daily_rate >= 0.20
+        ORDER BY daily_rate DESC, duration_days ASC
+    ''',
+    'staking_plans': 'SELECT * FROM staking_plans',
+    'active_staking_plans': 'SELECT * FROM staking_plans WHERE is_active = 1',
+    'frozen_plans': 'SELECT * FROM frozen_plans',
+    'active_frozen_plans': 'SELECT * FROM frozen_plans WHERE is_active = 1',
+    'trading_strategies': 'SELECT * FROM trading_strategies',
+    'active_trading_strategies': '''
+        SELECT * FROM trading_strategies
+        WHERE is_active = 1
+        ORDER BY risk_level, expected_daily_return DESC
+    ''',
+    'top_traders': 'SELECT * FROM top_traders',
+    'active_top_traders': '''
+        SELECT * FROM top_traders
+        WHERE is_active = 1
+        ORDER BY total_return DESC
+    ''',
+    'faq': 'SELECT * FROM faq WHERE is_active = 1 ORDER BY category, id',
+}
+
+class CatalogCache:
+    """Tables de référence en mémoire, rechargées quand la génération partagée (app_meta) change"""
+
+    def __init__(self, queries, check_ttl=5):
+        self.queries = queries
+        self.check_ttl = check_ttl
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked_at = None
+        self._entries = {}
+        self.reloads = 0
+
+    def _current(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_ttl:
+                return self._entries
+
+            # Un seul thread relit la génération (une ligne), et le catalogue si elle a changé
+            conn = get_db_connection()
+            try:
+                row = conn.execute("SELECT value FROM app_meta WHERE key = 'catalog_generation'").fetchone()
+                generation = row[0] if row else None
+                if generation is None or generation != self._generation:
+                    entries = {}
+                    for name, sql in self.queries.items():
+                        rows = conn.execute(sql).fetchall()
+                        entries[name] = (rows, {row['id']: row for row in rows})
+                    self._entries = entries
+                    self._generation = generation
+                    self.reloads += 1
+            finally:
+                conn.close()
+
+            self._checked_at = now
+            return self._entries
+
+    def rows(self, name):
+        """Toutes les lignes d'une entrée, dans l'ordre de sa requête"""
+        return self._current()[name][0]
+
+    def get(self, name, row_id):
+        """Une ligne par id (None si absente)"""
+        try:
+            return self._current()[name][1].get(int(row_id))
+        except (TypeError, ValueError):
+            return None
+
+    def by_id(self, name):
+        return self._current()[name][1]
+
+    def invalidate(self):
+        """Forcer la relecture de la génération (après une écriture du catalogue dans ce worker)"""
+        with self._lock:
+            self._checked_at = None
+
+    def stats(self):
+        with self._lock:
+            return {'generation': self._generation, 'reloads': self.reloads, 'check_ttl': self.check_ttl,
+                    'entries': {name: len(entry[0]) for name, entry in self._entries.items()}}
+
+catalog = CatalogCache(CATALOG_QUERIES, CATALOG_CHECK_TTL)
+
+# Cache de fragments Jinja : {% cache 'nom', clé1, clé2 %}...{% endcache %} garde le HTML rendu
+# par (template, nom, clés) ; les clés doivent couvrir tout ce dont le fragment dépend
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 256))
+FRAGMENT_CACHE_TTL = float(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+
+fragment_cache = TTLCache(FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL)
+
+class FragmentCacheExtension(Extension):
+    """Balise {% cache %} : le corps n'est rendu qu'une fois par clé"""
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key, caller):
+        key = tuple(key)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = caller()
+            fragment_cache.put(key, html)
+        return html
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+# Pages publiques (/, /login, /register) : rendues une fois par worker pour les visiteurs anonymes
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 64))
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 300))
+
+page_cache = TTLCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL)
+
+def cached_public_page(f):
+    """Servir la page anonyme depuis le cache, avec ETag/Last-Modified (304 si le client l'a déjà)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Connecté ou message flash en attente : la page dépend de la session
+        if request.method != 'GET' or 'user_id' in session or '_flashes' in session:
+            return f(*args, **kwargs)
+
+        key = request.full_path
+        entry = page_cache.get(key)
+        if entry is None:
+            body = f(*args, **kwargs)
+            if not isinstance(body, str):
+                return body
+            entry = (body, hashlib.sha256(body.encode()).hexdigest()[:32], datetime.now(timezone.utc).replace(microsecond=0))
+            page_cache.put(key, entry)
+
+        body, etag, last_modified = entry
+        response = app.response_class(body, mimetype='text/html')
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+    return decorated_function
+
+def load_platform_stats(conn):
+    """Compteurs globaux lus dans platform_counters (une ligne par compteur, aucun parcours de table)"""
+    stats = admin_stats_cache.get('platform')
+    if stats is None:
+        counters = dict(conn.execute('SELECT name, value FROM platform_counters').fetchall())
+        stats = {
+            'total_users': int(counters.get('total_users', 0)),
+            'total_investments': counters.get('total_investments', 0),
+            'total_projects': int(counters.get('total_projects', 0)),
+            'pending_kyc': int(counters.get('pending_kyc', 0)),
+            'open_tickets': int(counters.get('open_tickets', 0)),
+        }
+        admin_stats_cache.put('platform', stats)
+    return stats
+
+def load_ticket_status_counts(conn):
+    """Nombre de tickets par statut, lu dans platform_counters (recherche sur la clé primaire)"""
+    rows = conn.execute('''
+        SELECT name, value FROM platform_counters
+        WHERE name >= 'tickets_status:' AND name < 'tickets_status;'
+    ''').fetchall()
+    return {name.split(':', 1)[1]: int(value) for name, value in rows if value}
+
+# Outbox des notifications : les routes empilent, un thread écrit par lots
+NOTIFICATION_QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 10000))
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 200))
+NOTIFICATION_FLUSH_MS = int(os.environ.get('NOTIFICATION_FLUSH_MS', 250))
+NOTIFICATION_PUT_TIMEOUT = float(os.environ.get('NOTIFICATION_PUT_TIMEOUT', 2))
+
+class NotificationOutbox:
+    """File bornée vidée par un thread d'écriture qui insère les notifications par lots"""
+
+    def __init__(self, max_size=10000, batch_size=200, flush_ms=250, put_timeout=2.0):
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_ms / 1000
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _ensure_started(self):
+        # Le thread ne survit pas à un fork : chaque worker gunicorn démarre le sien
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+            self._thread.start()
+
+    def put(self, user_id, title, message, type):
+        self._ensure_started()
+        try:
+            # File pleine : on attend le thread d'écriture. Jamais d'écriture dans le thread appelant,
+            # dont la connexion de requête peut porter une transaction encore ouverte
+            self._queue.put((user_id, title, message, type), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            print(f"❌ Outbox des notifications pleine depuis {self.put_timeout}s, notification perdue pour l'utilisateur {user_id}")
+
+    def flush(self, timeout=5.0):
+        """Attendre que toutes les notifications en file soient écrites"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        max_retries = 3
+        for attempt in range(max_retries):
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.executemany('''
+                    INSERT INTO notifications (user_id, title, message, type)
+                    VALUES (?, ?, ?, ?)
+                ''', batch)
+                conn.commit()
+                conn.close()
+                invalidate_dashboard(*{row[0] for row in batch})
+                return
+            except sqlite3.OperationalError as e:
+                if conn is not None:
+                    conn.close()
+                if "database is locked" in str(e) and attempt < max_retries - 1:
+                    time.sleep(0.1 * (attempt + 1))  # Progressive backoff
+                    continue
+                else:
+                    print(f"❌ Erreur écriture de {len(batch)} notification(s) après {attempt + 1} tentatives: {e}")
+                    break
+            except Exception as e:
+                if conn is not None:
+                    conn.close()
+                print(f"❌ Erreur écriture notifications: {e}")
                 break
-        except Exception as e:
-            print(f"❌ Erreur ajout notification: {e}")
-            break
+
+notification_outbox = NotificationOutbox(NOTIFICATION_QUEUE_SIZE, NOTIFICATION_BATCH_SIZE, NOTIFICATION_FLUSH_MS,
+                                         NOTIFICATION_PUT_TIMEOUT)
+atexit.register(notification_outbox.flush)
+
+def add_notification(user_id, title, message, type='info'):
+    """Mettre une notification en file ; elle est écrite par lots hors de la requête"""
+    notification_outbox.put(user_id, title, message, type)
 
 # Scheduled tasks
-def calculate_daily_profits():
-    # Sauvegarder les données importantes si Replit DB est disponible
-    if REPLIT_DB_AVAILABLE:
-        backup_critical_data()
-    
-    conn = get_db_connection()
-    
-    # Plus d'investissements ROI actifs
-    active_investments = []
+# Mode parallèle du calcul des profits : 0 ou 1 = SQL ensembliste dans le processus courant
+PROFIT_WORKERS = int(os.environ.get('PROFIT_WORKERS', 0))
+PROFIT_SHARDS_PER_WORKER = 4
+
+def _create_profit_credits_table(conn):
+    conn.execute('DROP TABLE IF EXISTS temp.profit_credits')
+    conn.execute('''
+        CREATE TEMP TABLE profit_credits (
+            position_type TEXT NOT NULL,
+            position_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            label TEXT
+        )
+    ''')
 
-    # Récupérer tous les bots de trading actifs
-    active_bots = conn.execute('''
-        SELECT utb.*, u.email, ts.name as strategy_name
+def _collect_profit_credits(conn, run_date):
+    """Remplit la table temporaire profit_credits avec les crédits du jour non encore versés"""
+    _create_profit_credits_table(conn)
+
+    # Bots de trading : profit quotidien fixe
+    conn.execute('''
+        INSERT INTO temp.profit_credits (position_type, position_id, user_id, amount, label)
+        SELECT 'bot', utb.id, utb.user_id, utb.daily_profit, ts.name
         FROM user_trading_bots utb
         JOIN users u ON utb.user_id = u.id
         JOIN trading_strategies ts ON utb.strategy_id = ts.id
-        WHERE utb.is_active = 1
-    ''').fetchall()
-
-    # Récupérer tous les copy trades actifs
-    active_copies = conn.execute('''
-        SELECT uct.*, u.email, tt.name as trader_name, tt.monthly_return
+        WHERE utb.is_active = 1 AND utb.daily_profit > 0
+          AND NOT EXISTS (
+              SELECT 1 FROM profit_runs pr
+              WHERE pr.run_date = ? AND pr.position_type = 'bot' AND pr.position_id = utb.id
+          )
+    ''', (run_date,))
+
+    # Copy trades : rendement mensuel du trader / 30 × montant × ratio de copie
+    # (même formule que yields.copy_daily_profit, vérifiée par tests/test_profits.py)
+    conn.execute('''
+        INSERT INTO temp.profit_credits (position_type, position_id, user_id, amount, label)
+        SELECT 'copy', uct.id, uct.user_id,
+               uct.amount * (tt.monthly_return / 100.0 / 30) * COALESCE(uct.copy_ratio, 1.0), tt.name
         FROM user_copy_trading uct
         JOIN users u ON uct.user_id = u.id
         JOIN top_traders tt ON uct.trader_id = tt.id
         WHERE uct.is_active = 1
-    ''').fetchall()
+          AND uct.amount * (tt.monthly_return / 100.0 / 30) * COALESCE(uct.copy_ratio, 1.0) > 0
+          AND NOT EXISTS (
+              SELECT 1 FROM profit_runs pr
+              WHERE pr.run_date = ? AND pr.position_type = 'copy' AND pr.position_id = uct.id
+          )
+    ''', (run_date,))
+
+def _apply_profit_credits(conn, run_date):
+    """Applique en SQL ensembliste les crédits présents dans temp.profit_credits"""
+    # Soldes : un seul UPDATE par utilisateur, tous types de positions confondus
+    conn.execute('''
+        UPDATE users
+        SET balance = balance + c.total
+        FROM (
+            SELECT user_id, SUM(amount) as total
+            FROM temp.profit_credits
+            GROUP BY user_id
+        ) c
+        WHERE users.id = c.user_id
+    ''')
 
-    print(f"🔄 Calcul des profits pour {len(active_investments)} investissements, {len(active_bots)} bots, {len(active_copies)} copy trades")
+    # Une écriture de journal par utilisateur crédité, avec le solde après crédit
+    conn.execute('''
+        INSERT INTO ledger_entries (user_id, amount, balance_after, kind, reference)
+        SELECT c.user_id, c.total, u.balance, 'daily_profit', ?
+        FROM (
+            SELECT user_id, SUM(amount) as total
+            FROM temp.profit_credits
+            GROUP BY user_id
+        ) c
+        JOIN users u ON u.id = c.user_id
+    ''', (f'profit_runs:{run_date}',))
 
-    # Traiter les investissements ROI classiques
-    for investment in active_investments:
-        try:
-            # Vérifier si l'investissement est vraiment actif (pas expiré)
-            from datetime import datetime
-            if investment['end_date']:
-                end_date = datetime.fromisoformat(investment['end_date'].replace('Z', ''))
-                if datetime.now() > end_date:
-                    # Marquer comme terminé
-                    conn.execute('''
-                        UPDATE user_investments 
-                        SET is_active = 0 
-                        WHERE id = ?
-                    ''', (investment['id'],))
-                    
-                    add_notification(
-                        investment['user_id'],
-                        'Plan d\'investissement terminé',
-                        f'Votre plan {investment["plan_name"]} est arrivé à terme. Total gagné: {investment["total_earned"]:.2f} USDT',
-                        'info'
-                    )
-                    continue
+    conn.execute('''
+        UPDATE user_trading_bots
+        SET total_profit = COALESCE(user_trading_bots.total_profit, 0) + c.amount,
+            last_profit_date = CURRENT_TIMESTAMP
+        FROM temp.profit_credits c
+        WHERE c.position_type = 'bot' AND user_trading_bots.id = c.position_id
+    ''')
 
-            # Calculate daily profit
-            daily_profit = investment['daily_profit']
-            
-            if daily_profit > 0:
-                print(f"💰 Ajout de {daily_profit:.2f} USDT pour l'utilisateur {investment['user_id']} - Plan: {investment['plan_name']}")
-
-                # Update user balance
-                conn.execute('''
-                    UPDATE users 
-                    SET balance = balance + ? 
-                    WHERE id = ?
-                ''', (daily_profit, investment['user_id']))
-
-                # Update total earned
-                current_earned = investment.get('total_earned', 0) or 0
-                new_total_earned = current_earned + daily_profit
-                conn.execute('''
-                    UPDATE user_investments 
-                    SET total_earned = ? 
-                    WHERE id = ?
-                ''', (new_total_earned, investment['id']))
-
-                # Add transaction record
-                conn.execute('''
-                    INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
-                    VALUES (?, 'daily_profit', ?, 'completed', ?)
-                ''', (investment['user_id'], daily_profit, generate_transaction_hash()))
-
-                # Add notification
-                add_notification(
-                    investment['user_id'],
-                    'Profit journalier reçu',
-                    f'Vous avez reçu {daily_profit:.2f} USDT de votre plan {investment["plan_name"]}',
-                    'success'
-                )
+    conn.execute('''
+        UPDATE user_copy_trading
+        SET total_profit = COALESCE(user_copy_trading.total_profit, 0) + c.amount
+        FROM temp.profit_credits c
+        WHERE c.position_type = 'copy' AND user_copy_trading.id = c.position_id
+    ''')
 
-        except Exception as e:
-            print(f"❌ Erreur calcul profit pour investissement {investment['id']}: {e}")
-            continue
+    conn.execute('''
+        INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
+        SELECT user_id,
+               CASE position_type WHEN 'bot' THEN 'bot_profit' ELSE 'copy_profit' END,
+               amount, 'completed', lower(hex(randomblob(32)))
+        FROM temp.profit_credits
+    ''')
 
-    # Traiter les bots de trading
-    for bot in active_bots:
-        try:
-            daily_profit = bot['daily_profit']
-            
-            if daily_profit > 0:
-                print(f"🤖 Ajout de {daily_profit:.2f} USDT pour le bot {bot['id']} de l'utilisateur {bot['user_id']}")
-
-                # Mettre à jour le solde utilisateur
-                conn.execute('''
-                    UPDATE users 
-                    SET balance = balance + ? 
-                    WHERE id = ?
-                ''', (daily_profit, bot['user_id']))
-
-                # Mettre à jour les profits totaux du bot
-                current_profit = bot.get('total_profit', 0) or 0
-                new_total_profit = current_profit + daily_profit
-                conn.execute('''
-                    UPDATE user_trading_bots 
-                    SET total_profit = ?, last_profit_date = CURRENT_TIMESTAMP 
-                    WHERE id = ?
-                ''', (new_total_profit, bot['id']))
-
-                # Ajouter transaction
-                conn.execute('''
-                    INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
-                    VALUES (?, 'bot_profit', ?, 'completed', ?)
-                ''', (bot['user_id'], daily_profit, generate_transaction_hash()))
-
-                # Ajouter notification
-                add_notification(
-                    bot['user_id'],
-                    'Profit bot de trading',
-                    f'Votre bot {bot["strategy_name"]} a généré {daily_profit:.2f} USDT de profit!',
-                    'success'
-                )
+    conn.execute('''
+        INSERT INTO notifications (user_id, title, message, type)
+        SELECT user_id,
+               CASE position_type WHEN 'bot' THEN 'Profit bot de trading' ELSE 'Profit copy trading' END,
+               CASE position_type
+                   WHEN 'bot' THEN 'Votre bot ' || label || ' a généré ' || printf('%.2f', amount) || ' USDT de profit!'
+                   ELSE 'Votre copy de ' || label || ' a généré ' || printf('%.2f', amount) || ' USDT de profit!'
+               END,
+               'success'
+        FROM temp.profit_credits
+    ''')
 
-        except Exception as e:
-            print(f"❌ Erreur calcul profit pour bot {bot['id']}: {e}")
-            continue
+    conn.execute('''
+        INSERT INTO user_portfolio_stats (user_id, total_profits)
+        SELECT user_id, SUM(amount)
+        FROM temp.profit_credits
+        WHERE 1
+        GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_profits = total_profits + excluded.total_profits,
+            updated_at = CURRENT_TIMESTAMP
+    ''')
+
+    # Ledger : rend le crédit idempotent pour ce jour
+    conn.execute('''
+        INSERT INTO profit_runs (run_date, position_type, position_id, user_id, amount)
+        SELECT ?, position_type, position_id, user_id, amount
+        FROM temp.profit_credits
+    ''', (run_date,))
+
+def _compute_profit_shard(database, run_date, user_id_min, user_id_max):
+    """Calcule dans un processus du pool les crédits d'une tranche d'utilisateurs"""
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True, timeout=60.0)
+    try:
+        columns = yields.load_active_positions(conn, run_date, user_id_min, user_id_max)
+        return yields.credit_rows(yields.compute_daily_yields(columns))
+    finally:
+        conn.close()
+
+def _profit_shard_ranges(conn, shards):
+    """Découpe l'intervalle des user_id ayant des positions actives en tranches contiguës"""
+    bounds = conn.execute('''
+        SELECT MIN(lo), MAX(hi) FROM (
+            SELECT MIN(user_id) as lo, MAX(user_id) as hi FROM user_trading_bots WHERE is_active = 1
+            UNION ALL
+            SELECT MIN(user_id), MAX(user_id) FROM user_copy_trading WHERE is_active = 1
+        )
+    ''').fetchone()
+    low, high = bounds[0], bounds[1]
+    if low is None:
+        return []
+
+    step = max(1, (high - low + 1) // shards + 1)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+def _run_sharded_profit_credits(conn, run_date, workers):
+    """Calcul parallèle par tranches de user_id ; un seul écrivain applique chaque tranche"""
+    ranges = _profit_shard_ranges(conn, workers * PROFIT_SHARDS_PER_WORKER)
+    database = os.path.abspath(DATABASE)
+    bots_count = 0
+    copies_count = 0
+
+    print(f"🔀 Calcul parallèle: {len(ranges)} tranches sur {workers} processus")
+
+    # spawn : pas de fork d'un processus qui héberge déjà des threads (scheduler, serveur)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(_compute_profit_shard, database, run_date, low, high)
+            for low, high in ranges
+        ]
+        for future in as_completed(futures):
+            credits = future.result()
+            if not credits:
+                continue
+
+            # Une transaction par tranche, écriture réservée d'emblée : le ledger permet la reprise si le job s'arrête
+            conn.execute('BEGIN IMMEDIATE')
+            _create_profit_credits_table(conn)
+            conn.executemany('''
+                INSERT INTO temp.profit_credits (position_type, position_id, user_id, amount, label)
+                VALUES (?, ?, ?, ?, ?)
+            ''', credits)
+            _apply_profit_credits(conn, run_date)
+            conn.commit()
+
+            for credit in credits:
+                if credit[0] == 'bot':
+                    bots_count += 1
+                else:
+                    copies_count += 1
+
+    return bots_count, copies_count
+
+def calculate_daily_profits(run_date=None, workers=None):
+    """Créditer les profits du jour ; idempotent et reprenable grâce au ledger profit_runs"""
+    run_date = run_date or datetime.now().date().isoformat()
+    workers = PROFIT_WORKERS if workers is None else workers
+
+    conn = get_db_connection()
 
-    # Traiter les copy trades
-    for copy_trade in active_copies:
+    # Checkpoint du jour : si le calcul est terminé, l'appel ne fait rien
+    checkpoint = conn.execute('''
+        SELECT completed_at, credited_count FROM profit_run_days WHERE run_date = ?
+    ''', (run_date,)).fetchone()
+    if checkpoint and checkpoint['completed_at']:
+        conn.close()
+        print(f"ℹ️ Profits du {run_date} déjà calculés ({checkpoint['credited_count']} positions)")
+        return {'run_date': run_date, 'already_completed': True, 'bots': 0, 'copies': 0, 'elapsed': 0, 'rows_per_second': 0}
+
+    # Sauvegarder les données importantes avant de créditer
+    if BACKUP_ENABLED:
+        backup_critical_data()
+
+    started = time.perf_counter()
+
+    try:
+        conn.execute('INSERT OR IGNORE INTO profit_run_days (run_date) VALUES (?)', (run_date,))
+        conn.commit()
+
+        if workers > 1:
+            bots_count, copies_count = _run_sharded_profit_credits(conn, run_date, workers)
+            print(f"🔄 Profits du {run_date} calculés pour {bots_count} bots, {copies_count} copy trades")
+        else:
+            # Verrou d'écriture pris avant la lecture : une transaction différée promue en écriture
+            # échouerait (SQLITE_BUSY_SNAPSHOT) dès qu'une requête commite entre la collecte et les crédits
+            conn.execute('BEGIN IMMEDIATE')
+
+            # Seules les positions pas encore créditées ce jour sont reprises (reprise après crash)
+            _collect_profit_credits(conn, run_date)
+
+            counts = dict(conn.execute('''
+                SELECT position_type, COUNT(*) FROM temp.profit_credits GROUP BY position_type
+            ''').fetchall())
+            bots_count = counts.get('bot', 0)
+            copies_count = counts.get('copy', 0)
+            print(f"🔄 Calcul des profits du {run_date} pour {bots_count} bots, {copies_count} copy trades")
+
+            # Une seule transaction pour tous les crédits, soldes, transactions, notifications et le ledger
+            _apply_profit_credits(conn, run_date)
+
+        conn.execute('''
+            UPDATE profit_run_days
+            SET completed_at = CURRENT_TIMESTAMP,
+                credited_count = (SELECT COUNT(*) FROM profit_runs WHERE run_date = ?)
+            WHERE run_date = ?
+        ''', (run_date, run_date))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erreur calcul des profits quotidiens: {e}")
+        raise
+    finally:
         try:
-            # Calculer le profit basé sur le rendement mensuel du trader
-            monthly_return = copy_trade['monthly_return'] / 100  # Convertir en décimal
-            daily_return = monthly_return / 30  # Approximation quotidienne
-            daily_profit = copy_trade['amount'] * daily_return * copy_trade['copy_ratio']
-            
-            if daily_profit > 0:
-                print(f"📈 Ajout de {daily_profit:.2f} USDT pour le copy trade {copy_trade['id']} de l'utilisateur {copy_trade['user_id']}")
-
-                # Mettre à jour le solde utilisateur
-                conn.execute('''
-                    UPDATE users 
-                    SET balance = balance + ? 
-                    WHERE id = ?
-                ''', (daily_profit, copy_trade['user_id']))
-
-                # Mettre à jour les profits totaux du copy trade
-                current_profit = copy_trade.get('total_profit', 0) or 0
-                new_total_profit = current_profit + daily_profit
-                conn.execute('''
-                    UPDATE user_copy_trading 
-                    SET total_profit = ? 
-                    WHERE id = ?
-                ''', (new_total_profit, copy_trade['id']))
-
-                # Ajouter transaction
-                conn.execute('''
-                    INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
-                    VALUES (?, 'copy_profit', ?, 'completed', ?)
-                ''', (copy_trade['user_id'], daily_profit, generate_transaction_hash()))
-
-                # Ajouter notification
-                add_notification(
-                    copy_trade['user_id'],
-                    'Profit copy trading',
-                    f'Votre copy de {copy_trade["trader_name"]} a généré {daily_profit:.2f} USDT de profit!',
-                    'success'
-                )
+            conn.execute('DROP TABLE IF EXISTS temp.profit_credits')
+        except sqlite3.Error:
+            pass
+        conn.close()
+        # Les soldes crédités touchent potentiellement tous les tableaux de bord du processus
+        dashboard_cache.clear()
 
-        except Exception as e:
-            print(f"❌ Erreur calcul profit pour copy trade {copy_trade['id']}: {e}")
-            continue
+    credited = bots_count + copies_count
+    elapsed = time.perf_counter() - started
+    rate = credited / elapsed if elapsed > 0 else 0
+    print(f"✅ Calcul des profits quotidiens terminé: {credited} positions créditées en {elapsed:.2f}s ({rate:.0f} lignes/s)")
 
-    conn.commit()
-    conn.close()
-    print("✅ Calcul des profits quotidiens terminé")
+    return {'run_date': run_date, 'already_completed': False, 'bots': bots_count, 'copies': copies_count, 'elapsed': elapsed, 'rows_per_second': rate}
 
 # Routes
 @app.route('/')
+@cached_public_page
 def index():
     return render_template('index.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@cached_public_page
 def register():
     if request.method == 'POST':
         data = request.get_json() if request.is_json else request.form
@@ -1167,6 +2423,7 @@ def register():
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@cached_public_page
 def login():
     if request.method == 'POST':
         data = request.get_json() if request.is_json else request.form
@@ -1215,16 +2472,28 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
+def _parse_notification_date(value):
+    """created_at SQLite (texte) -> datetime, parsé une fois à la construction du modèle"""
+    try:
+        if isinstance(value, str):
+            # Remove timezone suffix if present and parse
+            return datetime.fromisoformat(value.replace('Z', '').replace('+00:00', ''))
+        if hasattr(value, 'strftime'):
+            return value
+    except ValueError as e:
+        print(f"⚠️ Erreur parsing date notification: {e}")
+    return datetime.now()
+
+def load_dashboard(user_id):
+    """Modèle de lecture du tableau de bord : servi depuis dashboard_cache tant qu'aucune écriture ne l'invalide"""
+    model = dashboard_cache.get(user_id)
+    if model is not None:
+        return model
+
     conn = get_db_connection()
 
     # Get user info
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-
-    # Get active investments (sans les plans ROI)
-    investments = []
+    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
 
     # Get project investments
     project_investments = conn.execute('''
@@ -1233,7 +2502,7 @@ def dashboard():
         JOIN projects p ON pi.project_id = p.id
         WHERE pi.user_id = ?
         ORDER BY pi.investment_date DESC
-    ''', (session['user_id'],)).fetchall()
+    ''', (user_id,)).fetchall()
 
     # Get notifications
     notifications_raw = conn.execute('''
@@ -1241,63 +2510,45 @@ def dashboard():
         WHERE user_id = ? AND is_read = 0
         ORDER BY created_at DESC
         LIMIT 5
-    ''', (session['user_id'],)).fetchall()
+    ''', (user_id,)).fetchall()
+
+    conn.close()
 
-    # Convert notifications to dict and parse datetime safely
     notifications = []
     for notif in notifications_raw:
         notif_dict = dict(notif)
-        try:
-            if notif_dict.get('created_at'):
-                if isinstance(notif_dict['created_at'], str):
-                    # Remove timezone suffix if present and parse
-                    date_str = notif_dict['created_at'].replace('Z', '').replace('+00:00', '')
-                    notif_dict['created_at'] = datetime.fromisoformat(date_str)
-                elif hasattr(notif_dict['created_at'], 'strftime'):
-                    # Already a datetime object
-                    pass
-                else:
-                    notif_dict['created_at'] = datetime.now()
-            else:
-                notif_dict['created_at'] = datetime.now()
-        except Exception as e:
-            print(f"⚠️ Erreur parsing date notification: {e}")
-            notif_dict['created_at'] = datetime.now()
+        notif_dict['created_at'] = _parse_notification_date(notif_dict.get('created_at'))
         notifications.append(notif_dict)
 
-    conn.close()
+    model = {
+        'user': dict(user) if user else None,
+        'project_investments': [dict(row) for row in project_investments],
+        'notifications': notifications,
+    }
+    if user:
+        dashboard_cache.put(user_id, model)
+    return model
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    model = load_dashboard(session['user_id'])
 
-    # Debug info
-    print(f"DEBUG: User {session['user_id']} has {len(investments)} active investments")
-    for inv in investments:
-        print(f"DEBUG: Investment {inv['id']}: {inv['plan_name']}, amount: {inv['amount']}, active: {inv['is_active']}")
+    # Get active investments (sans les plans ROI)
+    investments = []
 
     return render_template('dashboard.html', 
-                         user=user, 
+                         user=model['user'], 
                          investments=investments, 
-                         project_investments=project_investments,
-                         notifications=notifications)
-
-
-
-
+                         project_investments=model['project_investments'],
+                         notifications=model['notifications'])
 
 @app.route('/ultra-plans')
 @login_required
 def ultra_plans():
     """Page dédiée aux plans ultra-rentables (20%+ quotidien)"""
-    conn = get_db_connection()
-    
-    # Récupérer seulement les plans ultra-rentables (20%+ quotidien)
-    ultra_plans = conn.execute('''
-        SELECT * FROM roi_plans 
-        WHERE is_active = 1 AND daily_rate >= 0.20
-        ORDER BY daily_rate DESC, duration_days ASC
-    ''').fetchall()
-    
-    conn.close()
-
-    return render_template('ultra_plans.html', ultra_plans=ultra_plans)
+    # Plans ultra-rentables (20%+ quotidien), depuis le catalogue en mémoire
+    return render_template('ultra_plans.html', ultra_plans=catalog.rows('ultra_plans'))
 
 @app.route('/invest-roi', methods=['POST'])
 @login_required
@@ -1307,29 +2558,28 @@ def invest_roi():
     plan_id = data.get('plan_id')
     amount = float(data.get('amount', 0))
 
-    conn = get_db_connection()
-
     # Récupérer les détails du plan
-    plan = conn.execute('SELECT * FROM roi_plans WHERE id = ?', (plan_id,)).fetchone()
+    plan = catalog.get('roi_plans', plan_id)
     if not plan:
-        conn.close()
         return jsonify({'error': 'Plan non trouvé'}), 404
 
     # Vérifier les limites de montant
     if amount < plan['min_amount'] or amount > plan['max_amount']:
-        conn.close()
         return jsonify({'error': f'Montant doit être entre {plan["min_amount"]} et {plan["max_amount"]} USDT'}), 400
 
-    # Vérifier le solde utilisateur
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    conn = get_db_connection()
+
+    # Débiter le solde utilisateur (contrôle et écriture en une seule requête)
+    transaction_hash = generate_transaction_hash()
+    if ledger.debit(conn, session['user_id'], amount, 'roi_investment', transaction_hash) is None:
+        conn.rollback()
         conn.close()
         return jsonify({'error': 'Solde insuffisant'}), 400
 
     # Calculer les dates et profits
     start_date = datetime.now()
-    end_date = start_date + timedelta(days=plan['duration_days'])
-    daily_profit = amount * plan['daily_rate']
+    end_date = yields.plan_end_date(start_date, plan['duration_days'])
+    daily_profit = yields.roi_daily_profit(amount, plan['daily_rate'])
 
     # Créer l'investissement
     cursor = conn.execute('''
@@ -1337,16 +2587,16 @@ def invest_roi():
         VALUES (?, ?, ?, ?, ?, ?, ?)
     ''', (session['user_id'], plan_id, amount, start_date, end_date, daily_profit, generate_transaction_hash()))
 
-    # Mettre à jour le solde utilisateur
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
-
     # Ajouter transaction
     conn.execute('''
         INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
         VALUES (?, 'roi_investment', ?, 'completed', ?)
-    ''', (session['user_id'], amount, generate_transaction_hash()))
+    ''', (session['user_id'], amount, transaction_hash))
+
+    bump_portfolio_stats(conn, session['user_id'], invested=amount, opened=1)
 
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     # Ajouter notification
@@ -1361,180 +2611,197 @@ def invest_roi():
 
 
 
-@app.route('/investment-history')
-@login_required
-def investment_history():
-    """Page d'historique complet des investissements"""
-    conn = get_db_connection()
-
-    # Récupérer tous les investissements ROI de l'utilisateur
-    roi_investments = conn.execute('''
+# Historique paginé par curseur (date, id) décroissant, une requête par type de position
+HISTORY_PAGE_SIZE = 20
+HISTORY_CURSOR_START = ('9999-12-31', 0)  # avant toute date réelle : première page
+HISTORY_QUERIES = {
+    'roi': ('''
         SELECT ui.*, rp.name as plan_name
         FROM user_investments ui
         LEFT JOIN roi_plans rp ON ui.plan_id = rp.id
-        WHERE ui.user_id = ?
-        ORDER BY ui.start_date DESC
-    ''', (session['user_id'],)).fetchall()
-
-    # Récupérer tous les investissements staking
-    staking_investments = conn.execute('''
+        WHERE ui.user_id = ? AND (ui.start_date, ui.id) < (?, ?)
+        ORDER BY ui.start_date DESC, ui.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+    'staking': ('''
         SELECT us.*, sp.name as plan_name, sp.duration_days, sp.annual_rate
         FROM user_staking us
         LEFT JOIN staking_plans sp ON us.plan_id = sp.id
-        WHERE us.user_id = ?
-        ORDER BY us.start_date DESC
-    ''', (session['user_id'],)).fetchall()
-
-    # Récupérer tous les bots de trading
-    trading_bots = conn.execute('''
+        WHERE us.user_id = ? AND (us.start_date, us.id) < (?, ?)
+        ORDER BY us.start_date DESC, us.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+    'trading': ('''
         SELECT utb.*, ts.name as strategy_name, ts.risk_level
         FROM user_trading_bots utb
         LEFT JOIN trading_strategies ts ON utb.strategy_id = ts.id
-        WHERE utb.user_id = ?
-        ORDER BY utb.start_date DESC
-    ''', (session['user_id'],)).fetchall()
-
-    # Récupérer tous les copy trades
-    copy_trades = conn.execute('''
+        WHERE utb.user_id = ? AND (utb.start_date, utb.id) < (?, ?)
+        ORDER BY utb.start_date DESC, utb.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+    'copy': ('''
         SELECT uct.*, tt.name as trader_name, tt.total_return
         FROM user_copy_trading uct
         LEFT JOIN top_traders tt ON uct.trader_id = tt.id
-        WHERE uct.user_id = ?
-        ORDER BY uct.start_date DESC
-    ''', (session['user_id'],)).fetchall()
-
-    # Récupérer les investissements dans les projets
-    project_investments = conn.execute('''
+        WHERE uct.user_id = ? AND (uct.start_date, uct.id) < (?, ?)
+        ORDER BY uct.start_date DESC, uct.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+    'project': ('''
         SELECT pi.*, p.title, p.status, p.expected_return
         FROM project_investments pi
         JOIN projects p ON pi.project_id = p.id
-        WHERE pi.user_id = ?
-        ORDER BY pi.investment_date DESC
-    ''', (session['user_id'],)).fetchall()
+        WHERE pi.user_id = ? AND (pi.investment_date, pi.id) < (?, ?)
+        ORDER BY pi.investment_date DESC, pi.id DESC
+        LIMIT ?
+    ''', 'investment_date'),
+}
+
+def parse_history_cursor(value):
+    """Curseur opaque "date|id" -> (date, id) ; None si absent ou invalide"""
+    if not value:
+        return None
+    date, _, position_id = value.rpartition('|')
+    if not date or not position_id.isdigit():
+        return None
+    return date, int(position_id)
+
+def load_keyset_page(conn, query, user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Une page (sql, colonne de date) après le curseur, et le curseur de la suivante (None en fin de liste)"""
+    sql, date_column = query
+    after_date, after_id = cursor or HISTORY_CURSOR_START
+    rows = conn.execute(sql, (user_id, after_date, after_id, limit + 1)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][date_column]}|{rows[-1]['id']}"
+    return rows, next_cursor
+
+def load_history_page(conn, user_id, kind, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Une page de positions d'un type pour la page d'historique"""
+    return load_keyset_page(conn, HISTORY_QUERIES[kind], user_id, cursor, limit)
+
+def load_portfolio_stats(conn, user_id):
+    """Résumé du portefeuille depuis user_portfolio_stats (une lecture par clé primaire)"""
+    row = conn.execute('''
+        SELECT total_invested, total_profits, active_count, completed_count, total_count
+        FROM user_portfolio_stats WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+    if row is None:
+        return {'total_invested': 0, 'total_profits': 0, 'active_count': 0, 'completed_count': 0, 'total_count': 0}
+    return dict(row)
 
-    conn.close()
+@app.route('/investment-history')
+@login_required
+def investment_history():
+    """Page d'historique : résumé agrégé et première page de chaque type de position"""
+    conn = get_db_connection()
 
-    # Calculer les statistiques globales
-    total_invested = 0
-    total_profits = 0
-    active_count = 0
-    completed_count = 0
-
-    # Traiter les investissements ROI
-    for inv in roi_investments:
-        total_invested += inv['amount'] if inv['amount'] else 0
-        total_profits += inv['total_earned'] if inv['total_earned'] else 0
-        if inv['is_active']:
-            active_count += 1
-        else:
-            completed_count += 1
-
-    # Traiter les investissements staking
-    for inv in staking_investments:
-        total_invested += inv['amount'] if inv['amount'] else 0
-        total_profits += inv['total_earned'] if inv['total_earned'] else 0
-        if inv['is_active']:
-            active_count += 1
-        else:
-            completed_count += 1
-
-    # Traiter les bots de trading
-    for bot in trading_bots:
-        total_invested += bot['amount'] if bot['amount'] else 0
-        total_profits += bot['total_profit'] if bot['total_profit'] else 0
-        if bot['is_active']:
-            active_count += 1
-        else:
-            completed_count += 1
-
-    # Traiter les copy trades
-    for trade in copy_trades:
-        total_invested += trade['amount'] if trade['amount'] else 0
-        total_profits += trade['total_profit'] if trade['total_profit'] else 0
-        if trade['is_active']:
-            active_count += 1
-        else:
-            completed_count += 1
-
-    # Traiter les investissements projets
-    for proj in project_investments:
-        total_invested += proj['amount'] if proj['amount'] else 0
-        # Les projets sont considérés comme actifs
-        active_count += 1
-
-    # Créer un dictionnaire de statistiques
-    stats = {
-        'total_invested': total_invested,
-        'total_profits': total_profits,
-        'active_count': active_count,
-        'completed_count': completed_count,
-        'total_count': len(roi_investments) + len(staking_investments) + len(trading_bots) + len(copy_trades) + len(project_investments)
-    }
+    stats = load_portfolio_stats(conn, session['user_id'])
+    pages = {kind: load_history_page(conn, session['user_id'], kind) for kind in HISTORY_QUERIES}
 
-    # Combiner tous les investissements pour les filtres
-    all_investments = []
-    
-    # Ajouter les investissements ROI
-    for inv in roi_investments:
-        all_investments.append({
-            'id': inv['id'],
-            'type': 'roi',
-            'amount': inv['amount'],
-            'total_earned': inv['total_earned'] if inv['total_earned'] else 0,
-            'is_active': inv['is_active'],
-            'start_date': inv['start_date']
-        })
-    
-    # Ajouter les autres types d'investissements
-    for inv in staking_investments:
-        all_investments.append({
-            'id': inv['id'],
-            'type': 'staking',
-            'amount': inv['amount'],
-            'total_earned': inv['total_earned'] if inv['total_earned'] else 0,
-            'is_active': inv['is_active'],
-            'start_date': inv['start_date']
-        })
-    
-    for bot in trading_bots:
-        all_investments.append({
-            'id': bot['id'],
-            'type': 'trading',
-            'amount': bot['amount'],
-            'total_earned': bot['total_profit'] if bot['total_profit'] else 0,
-            'is_active': bot['is_active'],
-            'start_date': bot['start_date']
-        })
-    
-    for trade in copy_trades:
-        all_investments.append({
-            'id': trade['id'],
-            'type': 'copy',
-            'amount': trade['amount'],
-            'total_earned': trade['total_profit'] if trade['total_profit'] else 0,
-            'is_active': trade['is_active'],
-            'start_date': trade['start_date']
-        })
-    
-    for proj in project_investments:
-        all_investments.append({
-            'id': proj['id'],
-            'type': 'project',
-            'amount': proj['amount'],
-            'total_earned': 0,  # Les projets n'ont pas encore de gains
-            'is_active': True,
-            'start_date': proj['investment_date']
-        })
+    conn.close()
 
     return render_template('investment_history.html',
-                         roi_investments=roi_investments,
-                         staking_investments=staking_investments,
-                         trading_bots=trading_bots,
-                         copy_trades=copy_trades,
-                         project_investments=project_investments,
-                         all_investments=all_investments,
+                         roi_investments=pages['roi'][0],
+                         staking_investments=pages['staking'][0],
+                         trading_bots=pages['trading'][0],
+                         copy_trades=pages['copy'][0],
+                         project_investments=pages['project'][0],
+                         cursors={kind: page[1] for kind, page in pages.items()},
                          stats=stats)
 
+@app.route('/investment-history/<kind>')
+@login_required
+def investment_history_page(kind):
+    """Page suivante d'un type de position, rendue avec les mêmes cartes que la page complète"""
+    if kind not in HISTORY_QUERIES:
+        return jsonify({'error': 'Type d\'investissement inconnu'}), 404
+
+    cursor = parse_history_cursor(request.args.get('cursor'))
+    if cursor is None:
+        return jsonify({'error': 'Curseur invalide'}), 400
+
+    conn = get_db_connection()
+    rows, next_cursor = load_history_page(conn, session['user_id'], kind, cursor)
+    conn.close()
+
+    history_cards = get_template_attribute('investment_history_cards.html', 'history_cards')
+    return jsonify({'html': str(history_cards(kind, rows)), 'next_cursor': next_cursor})
+
+# API JSON v1 : pages compactes par curseur (date de création, id), revalidées par ETag
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+API_RESOURCES = {
+    'transactions': ('''
+        SELECT id, type, amount, status, transaction_hash, created_at, updated_at
+        FROM transactions
+        WHERE user_id = ? AND (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', 'created_at'),
+    # Les positions n'ont pas de created_at : start_date est leur date de création
+    'trading-bots': ('''
+        SELECT utb.id, utb.strategy_id, ts.name as strategy_name, utb.amount, utb.daily_profit,
+               utb.total_profit, utb.is_active, utb.start_date, utb.end_date, utb.last_profit_date
+        FROM user_trading_bots utb
+        LEFT JOIN trading_strategies ts ON utb.strategy_id = ts.id
+        WHERE utb.user_id = ? AND (utb.start_date, utb.id) < (?, ?)
+        ORDER BY utb.start_date DESC, utb.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+    'copy-trading': ('''
+        SELECT uct.id, uct.trader_id, tt.name as trader_name, uct.amount, uct.copy_ratio,
+               uct.total_profit, uct.is_active, uct.start_date, uct.end_date
+        FROM user_copy_trading uct
+        LEFT JOIN top_traders tt ON uct.trader_id = tt.id
+        WHERE uct.user_id = ? AND (uct.start_date, uct.id) < (?, ?)
+        ORDER BY uct.start_date DESC, uct.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+    'staking': ('''
+        SELECT us.id, us.plan_id, sp.name as plan_name, us.amount, us.total_earned,
+               us.is_active, us.is_withdrawn, us.start_date, us.end_date
+        FROM user_staking us
+        LEFT JOIN staking_plans sp ON us.plan_id = sp.id
+        WHERE us.user_id = ? AND (us.start_date, us.id) < (?, ?)
+        ORDER BY us.start_date DESC, us.id DESC
+        LIMIT ?
+    ''', 'start_date'),
+}
+
+def api_json(payload, status=200):
+    """Réponse JSON compacte avec ETag ; 304 sans corps si If-None-Match correspond"""
+    response = app.response_class(
+        json.dumps(payload, separators=(',', ':'), default=str),
+        status=status,
+        mimetype='application/json'
+    )
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/v1/<resource>')
+@api_login_required
+def api_list(resource):
+    """GET /api/v1/<resource>?limit=&cursor= : une page, du plus récent au plus ancien"""
+    if resource not in API_RESOURCES:
+        return jsonify({'error': 'Ressource inconnue'}), 404
+
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = parse_history_cursor(request.args['cursor'])
+        if cursor is None:
+            return jsonify({'error': 'Curseur invalide'}), 400
+
+    conn = get_db_connection()
+    rows, next_cursor = load_keyset_page(conn, API_RESOURCES[resource], session['user_id'], cursor, limit)
+    conn.close()
+
+    return api_json({'data': [dict(row) for row in rows], 'next_cursor': next_cursor})
+
 @app.route('/projects')
 @login_required
 def projects():
@@ -1598,9 +2865,10 @@ def invest_project():
     if amount < project['min_investment'] or amount > project['max_investment']:
         return jsonify({'error': f'Montant doit être entre {project["min_investment"]} et {project["max_investment"]} USDT'}), 400
 
-    # Check user balance
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    # Debit user balance (check and write in a single statement)
+    transaction_hash = generate_transaction_hash()
+    if ledger.debit(conn, session['user_id'], amount, 'project_investment', transaction_hash) is None:
+        conn.rollback()
         return jsonify({'error': 'Solde insuffisant'}), 400
 
     # Create investment
@@ -1609,17 +2877,19 @@ def invest_project():
         VALUES (?, ?, ?, ?)
     ''', (session['user_id'], project_id, amount, generate_transaction_hash()))
 
-    # Update user balance and project raised amount
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
+    # Update project raised amount
     conn.execute('UPDATE projects SET raised_amount = raised_amount + ? WHERE id = ?', (amount, project_id))
 
     # Add transaction record
     conn.execute('''
         INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
         VALUES (?, 'project_investment', ?, 'completed', ?)
-    ''', (session['user_id'], amount, generate_transaction_hash()))
+    ''', (session['user_id'], amount, transaction_hash))
+
+    bump_portfolio_stats(conn, session['user_id'], invested=amount, opened=1)
 
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     return jsonify({'success': True, 'message': 'Investissement dans le projet réalisé avec succès!'})
@@ -1647,11 +2917,7 @@ def profile():
 @app.route('/staking-plans')
 @login_required
 def staking_plans():
-    conn = get_db_connection()
-    plans = conn.execute('SELECT * FROM staking_plans WHERE is_active = 1').fetchall()
-    conn.close()
-
-    return render_template('staking_plans.html', plans=plans)
+    return render_template('staking_plans.html', plans=catalog.rows('active_staking_plans'))
 
 @app.route('/invest-staking', methods=['POST'])
 @login_required
@@ -1660,10 +2926,8 @@ def invest_staking():
     plan_id = data.get('plan_id')
     amount = float(data.get('amount', 0))
 
-    conn = get_db_connection()
-
     # Get plan details
-    plan = conn.execute('SELECT * FROM staking_plans WHERE id = ?', (plan_id,)).fetchone()
+    plan = catalog.get('staking_plans', plan_id)
     if not plan:
         return jsonify({'error': 'Plan de staking non trouvé'}), 404
 
@@ -1671,25 +2935,28 @@ def invest_staking():
     if amount < plan['min_amount'] or amount > plan['max_amount']:
         return jsonify({'error': f'Montant doit être entre {plan["min_amount"]} et {plan["max_amount"]} USDT'}), 400
 
-    # Check user balance
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    conn = get_db_connection()
+
+    # Debit user balance (check and write in a single statement)
+    transaction_hash = generate_transaction_hash()
+    if ledger.debit(conn, session['user_id'], amount, 'staking', transaction_hash) is None:
+        conn.rollback()
         return jsonify({'error': 'Solde insuffisant'}), 400
 
     # Calculate dates
     start_date = datetime.now()
-    end_date = start_date + timedelta(days=plan['duration_days'])
+    end_date = yields.plan_end_date(start_date, plan['duration_days'])
 
     # Create staking
     conn.execute('''
         INSERT INTO user_staking (user_id, plan_id, amount, start_date, end_date, transaction_hash)
         VALUES (?, ?, ?, ?, ?, ?)
-    ''', (session['user_id'], plan_id, amount, start_date, end_date, generate_transaction_hash()))
+    ''', (session['user_id'], plan_id, amount, start_date, end_date, transaction_hash))
 
-    # Update user balance
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
+    bump_portfolio_stats(conn, session['user_id'], invested=amount, opened=1)
 
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     return jsonify({'success': True, 'message': 'Staking activé avec succès!'})
@@ -1697,11 +2964,7 @@ def invest_staking():
 @app.route('/frozen-plans')
 @login_required
 def frozen_plans():
-    conn = get_db_connection()
-    plans = conn.execute('SELECT * FROM frozen_plans WHERE is_active = 1').fetchall()
-    conn.close()
-
-    return render_template('frozen_plans.html', plans=plans)
+    return render_template('frozen_plans.html', plans=catalog.rows('active_frozen_plans'))
 
 @app.route('/invest-frozen', methods=['POST'])
 @login_required
@@ -1710,10 +2973,8 @@ def invest_frozen():
     plan_id = data.get('plan_id')
     amount = float(data.get('amount', 0))
 
-    conn = get_db_connection()
-
     # Get plan details
-    plan = conn.execute('SELECT * FROM frozen_plans WHERE id = ?', (plan_id,)).fetchone()
+    plan = catalog.get('frozen_plans', plan_id)
     if not plan:
         return jsonify({'error': 'Plan gelé non trouvé'}), 404
 
@@ -1721,30 +2982,43 @@ def invest_frozen():
     if amount < plan['min_amount'] or amount > plan['max_amount']:
         return jsonify({'error': f'Montant doit être entre {plan["min_amount"]} et {plan["max_amount"]} USDT'}), 400
 
-    # Check user balance
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    conn = get_db_connection()
+
+    # Debit user balance (check and write in a single statement)
+    transaction_hash = generate_transaction_hash()
+    if ledger.debit(conn, session['user_id'], amount, 'frozen_investment', transaction_hash) is None:
+        conn.rollback()
         return jsonify({'error': 'Solde insuffisant'}), 400
 
     # Calculate dates and final amount
     start_date = datetime.now()
-    end_date = start_date + timedelta(days=plan['duration_days'])
-    final_amount = amount * plan['total_return_rate']
+    end_date = yields.plan_end_date(start_date, plan['duration_days'])
+    final_amount = yields.frozen_final_amount(amount, plan['total_return_rate'])
 
     # Create frozen investment
     conn.execute('''
         INSERT INTO user_frozen_investments (user_id, plan_id, amount, start_date, end_date, final_amount, transaction_hash)
         VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (session['user_id'], plan_id, amount, start_date, end_date, final_amount, generate_transaction_hash()))
-
-    # Update user balance
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
+    ''', (session['user_id'], plan_id, amount, start_date, end_date, final_amount, transaction_hash))
 
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     return jsonify({'success': True, 'message': 'Investissement gelé créé avec succès!'})
 
+# Portefeuille diversifié : plans lus dans le catalogue, un executemany par table de positions
+PORTFOLIO_TYPES = ('roi', 'staking', 'project')
+PORTFOLIO_MAX_DISTRIBUTIONS = 100
+
+def fetch_rows_by_id(conn, table, ids):
+    """Lignes d'une table de référence indexées par id, en une seule requête"""
+    ids = list(set(ids))
+    if not ids:
+        return {}
+    rows = conn.execute(f'SELECT * FROM {table} WHERE id IN ({", ".join("?" * len(ids))})', ids).fetchall()
+    return {row['id']: row for row in rows}
+
 @app.route('/portfolio-invest', methods=['POST'])
 @login_required
 def portfolio_invest():
@@ -1752,52 +3026,81 @@ def portfolio_invest():
     total_amount = float(data.get('total_amount', 0))
     distributions = data.get('distributions', [])
 
-    if not distributions or total_amount <= 0:
+    if not distributions or total_amount <= 0 or len(distributions) > PORTFOLIO_MAX_DISTRIBUTIONS:
         return jsonify({'error': 'Données de répartition invalides'}), 400
 
-    conn = get_db_connection()
-
-    # Check user balance
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < total_amount:
-        return jsonify({'error': 'Solde insuffisant'}), 400
-
-    # Process each distribution
+    # Validate the whole distribution before touching the balance
+    entries = []
     for dist in distributions:
         investment_type = dist.get('type')
-        plan_id = dist.get('plan_id')
-        amount = float(dist.get('amount', 0))
-
-        if investment_type == 'roi':
-            plan = conn.execute('SELECT * FROM roi_plans WHERE id = ?', (plan_id,)).fetchone()
-            if plan:
-                start_date = datetime.now()
-                end_date = start_date + timedelta(days=plan['duration_days'])
-                daily_profit = amount * plan['daily_rate']
+        try:
+            plan_id = int(dist.get('plan_id'))
+            amount = float(dist.get('amount', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Données de répartition invalides'}), 400
+        if investment_type not in PORTFOLIO_TYPES or amount <= 0:
+            return jsonify({'error': 'Données de répartition invalides'}), 400
+        entries.append((investment_type, plan_id, amount))
+
+    invested = sum(amount for _, _, amount in entries)
+    if abs(invested - total_amount) > 0.01:
+        return jsonify({'error': 'La somme de la répartition ne correspond pas au montant total'}), 400
 
-                conn.execute('''
-                    INSERT INTO user_investments (user_id, plan_id, amount, start_date, end_date, daily_profit, transaction_hash)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (session['user_id'], plan_id, amount, start_date, end_date, daily_profit, generate_transaction_hash()))
+    conn = get_db_connection()
 
-        elif investment_type == 'staking':
-            plan = conn.execute('SELECT * FROM staking_plans WHERE id = ?', (plan_id,)).fetchone()
-            if plan:
-                start_date = datetime.now()
-                end_date = start_date + timedelta(days=plan['duration_days'])
+    # Plans ROI et staking depuis le catalogue ; projets (montant levé variable) en une requête
+    plans = {
+        'roi': catalog.by_id('roi_plans'),
+        'staking': catalog.by_id('staking_plans'),
+        'project': fetch_rows_by_id(conn, 'projects', [plan_id for kind, plan_id, _ in entries if kind == 'project']),
+    }
+    missing = [f'{kind}:{plan_id}' for kind, plan_id, _ in entries if plan_id not in plans[kind]]
+    if missing:
+        conn.close()
+        return jsonify({'error': f'Plans introuvables: {", ".join(missing)}'}), 404
 
-                conn.execute('''
-                    INSERT INTO user_staking (user_id, plan_id, amount, start_date, end_date, transaction_hash)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (session['user_id'], plan_id, amount, start_date, end_date, generate_transaction_hash()))
+    # Debit user balance (check and write in a single statement)
+    if ledger.debit(conn, session['user_id'], total_amount, 'portfolio') is None:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': 'Solde insuffisant'}), 400
 
-        elif investment_type == 'project':
-            conn.execute('''
-                INSERT INTO project_investments (user_id, project_id, amount, transaction_hash)
-                VALUES (?, ?, ?, ?)
-            ''', (session['user_id'], plan_id, amount, generate_transaction_hash()))
+    # Build the rows of each position table
+    start_date = datetime.now()
+    roi_rows, staking_rows, project_rows = [], [], []
+    raised = {}
+    for investment_type, plan_id, amount in entries:
+        plan = plans[investment_type][plan_id]
+        if investment_type == 'roi':
+            roi_rows.append((session['user_id'], plan_id, amount, start_date,
+                             yields.plan_end_date(start_date, plan['duration_days']),
+                             yields.roi_daily_profit(amount, plan['daily_rate']), generate_transaction_hash()))
+        elif investment_type == 'staking':
+            staking_rows.append((session['user_id'], plan_id, amount, start_date,
+                                 yields.plan_end_date(start_date, plan['duration_days']), generate_transaction_hash()))
+        else:
+            project_rows.append((session['user_id'], plan_id, amount, generate_transaction_hash()))
+            raised[plan_id] = raised.get(plan_id, 0) + amount
+
+    if roi_rows:
+        conn.executemany('''
+            INSERT INTO user_investments (user_id, plan_id, amount, start_date, end_date, daily_profit, transaction_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', roi_rows)
+    if staking_rows:
+        conn.executemany('''
+            INSERT INTO user_staking (user_id, plan_id, amount, start_date, end_date, transaction_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', staking_rows)
+    if project_rows:
+        conn.executemany('''
+            INSERT INTO project_investments (user_id, project_id, amount, transaction_hash)
+            VALUES (?, ?, ?, ?)
+        ''', project_rows)
+        conn.executemany('UPDATE projects SET raised_amount = raised_amount + ? WHERE id = ?',
+                         [(amount, project_id) for project_id, amount in raised.items()])
 
-            conn.execute('UPDATE projects SET raised_amount = raised_amount + ? WHERE id = ?', (amount, plan_id))
+    bump_portfolio_stats(conn, session['user_id'], invested=invested, opened=len(entries))
 
     # Save portfolio distribution
     conn.execute('''
@@ -1805,10 +3108,8 @@ def portfolio_invest():
         VALUES (?, ?, ?)
     ''', (session['user_id'], total_amount, json.dumps(distributions)))
 
-    # Update user balance
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (total_amount, session['user_id']))
-
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     return jsonify({'success': True, 'message': 'Portfolio diversifié créé avec succès!'})
@@ -1837,6 +3138,7 @@ def submit_deposit():
 
     deposit_id = cursor.lastrowid
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     # Notification admin pour nouveau dépôt
@@ -1873,14 +3175,11 @@ def submit_withdrawal():
 
     conn = get_db_connection()
 
-    # Vérifier le solde utilisateur
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    # Débiter temporairement le solde (contrôle et écriture en une seule requête)
+    if ledger.debit(conn, session['user_id'], amount, 'withdrawal') is None:
+        conn.rollback()
         return jsonify({'error': 'Solde insuffisant'}), 400
 
-    # Débiter temporairement le solde
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
-
     # Créer la transaction en attente
     cursor = conn.execute('''
         INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
@@ -1897,6 +3196,7 @@ def submit_withdrawal():
     ''', (f"{withdrawal_address}|{amount}", withdrawal_id))
 
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
 
     # Notification admin pour nouveau retrait
@@ -1925,22 +3225,15 @@ def support():
 
     # Get user's tickets
     tickets = conn.execute('''
-        SELECT st.*, 
-               (SELECT COUNT(*) FROM support_messages sm WHERE sm.ticket_id = st.id) as message_count,
-               (SELECT sm.created_at FROM support_messages sm WHERE sm.ticket_id = st.id ORDER BY sm.created_at DESC LIMIT 1) as last_message_at
+        SELECT st.*
         FROM support_tickets st
         WHERE st.user_id = ?
         ORDER BY st.created_at DESC
     ''', (session['user_id'],)).fetchall()
 
-    # Get FAQ
-    faq_items = conn.execute('''
-        SELECT * FROM faq WHERE is_active = 1 ORDER BY category, id
-    ''').fetchall()
-
     conn.close()
 
-    return render_template('support.html', tickets=tickets, faq_items=faq_items)
+    return render_template('support.html', tickets=tickets, faq_items=catalog.rows('faq'))
 
 @app.route('/support/ticket/<int:ticket_id>')
 @login_required
@@ -2002,8 +3295,8 @@ def create_support_ticket():
     try:
         # Create ticket
         cursor = conn.execute('''
-            INSERT INTO support_tickets (user_id, subject, category, priority)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO support_tickets (user_id, subject, category, priority, message_count, last_message_at)
+            VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP)
         ''', (session['user_id'], subject, category, priority))
 
         ticket_id = cursor.lastrowid
@@ -2048,6 +3341,85 @@ def create_support_ticket():
     finally:
         conn.close()
 
+# Flux des messages de support : pub/sub en mémoire + Server-Sent Events
+# Chaque flux ouvert occupe un thread gthread : leur nombre est plafonné par worker (la moitié
+# des threads par défaut), au-delà le navigateur se rabat sur /support/get-messages toutes les 30 s
+SUPPORT_STREAM_KEEPALIVE = float(os.environ.get('SUPPORT_STREAM_KEEPALIVE', 15))      # secondes : attente max d'une publication avant de relire la base
+SUPPORT_STREAM_MAX_SECONDS = float(os.environ.get('SUPPORT_STREAM_MAX_SECONDS', 60))  # le navigateur se reconnecte ensuite avec Last-Event-ID
+SUPPORT_STREAM_MAX_PER_WORKER = int(os.environ.get('SUPPORT_STREAM_MAX_PER_WORKER', max(1, GUNICORN_THREADS // 2)))
+
+class SupportMessageBroker:
+    """Réveille les flux SSE d'un ticket dès qu'un message y est publié dans ce processus"""
+
+    def __init__(self, max_streams):
+        self._condition = threading.Condition()
+        self._latest = {}
+        self._subscribers = {}
+        self.max_streams = max_streams
+        self.open_streams = 0
+
+    def open_stream(self, ticket_id):
+        """Réserve une place de flux ; False si le worker a déjà max_streams flux ouverts"""
+        with self._condition:
+            if self.open_streams >= self.max_streams:
+                return False
+            self.open_streams += 1
+            self._subscribers[ticket_id] = self._subscribers.get(ticket_id, 0) + 1
+            return True
+
+    def close_stream(self, ticket_id):
+        with self._condition:
+            self.open_streams -= 1
+            remaining = self._subscribers.get(ticket_id, 0) - 1
+            if remaining > 0:
+                self._subscribers[ticket_id] = remaining
+            else:
+                # Dernier abonné parti : plus rien à retenir pour ce ticket
+                self._subscribers.pop(ticket_id, None)
+                self._latest.pop(ticket_id, None)
+
+    def publish(self, ticket_id, message_id):
+        with self._condition:
+            # Sans abonné, rien à réveiller : un flux ouvert plus tard relit la base
+            if ticket_id not in self._subscribers:
+                return
+            self._latest[ticket_id] = max(message_id, self._latest.get(ticket_id, 0))
+            self._condition.notify_all()
+
+    def wait(self, ticket_id, since_id, timeout):
+        """True si un message plus récent que since_id a été publié avant timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._latest.get(ticket_id, 0) > since_id, timeout)
+
+support_broker = SupportMessageBroker(SUPPORT_STREAM_MAX_PER_WORKER)
+
+def support_message_payload(msg):
+    """Message de support -> dict JSON (noms NULL gérés proprement)"""
+    first_name = msg['first_name'] if msg['first_name'] else ''
+    last_name = msg['last_name'] if msg['last_name'] else ''
+
+    sender_name = 'Support' if msg['is_admin'] else f"{first_name} {last_name}".strip()
+    if not sender_name or sender_name.isspace():
+        sender_name = 'Utilisateur'
+
+    return {
+        'id': msg['id'],
+        'message': msg['message'] if msg['message'] else '',
+        'is_admin': bool(msg['is_admin']),
+        'created_at': msg['created_at'] if msg['created_at'] else '',
+        'sender_name': sender_name
+    }
+
+def load_support_messages(conn, ticket_id, since_id=0):
+    """Messages d'un ticket postérieurs à since_id, dans l'ordre d'envoi"""
+    return conn.execute('''
+        SELECT sm.*, u.first_name, u.last_name
+        FROM support_messages sm
+        LEFT JOIN users u ON sm.user_id = u.id
+        WHERE sm.ticket_id = ? AND sm.id > ?
+        ORDER BY sm.id ASC
+    ''', (ticket_id, since_id)).fetchall()
+
 @app.route('/support/send-message', methods=['POST'])
 @login_required
 def send_support_message():
@@ -2070,7 +3442,7 @@ def send_support_message():
         return jsonify({'error': 'Ticket non trouvé'}), 404
 
     # Add message
-    conn.execute('''
+    cursor = conn.execute('''
         INSERT INTO support_messages (ticket_id, user_id, message, is_admin)
         VALUES (?, ?, ?, 0)
     ''', (ticket_id, session['user_id'], message))
@@ -2078,18 +3450,22 @@ def send_support_message():
     # Update ticket timestamp
     conn.execute('''
         UPDATE support_tickets 
-        SET updated_at = CURRENT_TIMESTAMP, status = 'user_reply'
+        SET updated_at = CURRENT_TIMESTAMP, status = 'user_reply',
+            message_count = message_count + 1, last_message_at = CURRENT_TIMESTAMP
         WHERE id = ?
     ''', (ticket_id,))
 
     conn.commit()
     conn.close()
+    support_broker.publish(ticket['id'], cursor.lastrowid)
 
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'message_id': cursor.lastrowid})
 
 @app.route('/support/get-messages/<int:ticket_id>')
 @login_required
 def get_support_messages(ticket_id):
+    """Messages du ticket ; avec ?since_id= seulement les nouveaux (repli sans EventSource)"""
+    since_id = request.args.get('since_id', 0, type=int)
     try:
         conn = get_db_connection()
 
@@ -2103,38 +3479,13 @@ def get_support_messages(ticket_id):
             conn.close()
             return jsonify({'error': 'Ticket non trouvé'}), 404
 
-        # Get messages
-        messages = conn.execute('''
-            SELECT sm.*, u.first_name, u.last_name
-            FROM support_messages sm
-            LEFT JOIN users u ON sm.user_id = u.id
-            WHERE sm.ticket_id = ?
-            ORDER BY sm.created_at ASC
-        ''', (ticket_id,)).fetchall()
+        messages = load_support_messages(conn, ticket_id, since_id)
 
         conn.close()
 
-        messages_list = []
-        for msg in messages:
-            # Gérer les valeurs NULL proprement
-            first_name = msg['first_name'] if msg['first_name'] else ''
-            last_name = msg['last_name'] if msg['last_name'] else ''
-
-            sender_name = 'Support' if msg['is_admin'] else f"{first_name} {last_name}".strip()
-            if not sender_name or sender_name.isspace():
-                sender_name = 'Utilisateur'
-
-            messages_list.append({
-                'id': msg['id'],
-                'message': msg['message'] if msg['message'] else '',
-                'is_admin': bool(msg['is_admin']),
-                'created_at': msg['created_at'] if msg['created_at'] else '',
-                'sender_name': sender_name
-            })
-
         return jsonify({
             'success': True,
-            'messages': messages_list,
+            'messages': [support_message_payload(msg) for msg in messages],
             'ticket_id': ticket_id
         })
 
@@ -2142,6 +3493,53 @@ def get_support_messages(ticket_id):
         print(f"Erreur get_support_messages: {e}")
         return jsonify({'error': 'Erreur serveur'}), 500
 
+@app.route('/support/stream/<int:ticket_id>')
+@login_required
+def stream_support_messages(ticket_id):
+    """Flux SSE des nouveaux messages du ticket après since_id (ou Last-Event-ID)"""
+    since_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('since_id', 0, type=int)
+
+    conn = get_db_connection()
+    ticket = conn.execute('''
+        SELECT id FROM support_tickets 
+        WHERE id = ? AND user_id = ?
+    ''', (ticket_id, session['user_id'])).fetchone()
+    conn.close()
+
+    if not ticket:
+        return jsonify({'error': 'Ticket non trouvé'}), 404
+
+    # Plafond atteint : EventSource passe à l'état CLOSED et la page interroge /support/get-messages
+    if not support_broker.open_stream(ticket_id):
+        return jsonify({'error': 'Trop de flux ouverts, utilisez /support/get-messages'}), 503, {'Retry-After': '30'}
+
+    def events(last_id):
+        # Hors contexte de requête : chaque lecture emprunte puis rend une connexion du pool
+        deadline = time.monotonic() + SUPPORT_STREAM_MAX_SECONDS
+        yield "retry: 1000\n\n"
+        while time.monotonic() < deadline:
+            conn = get_db_connection()
+            try:
+                messages = load_support_messages(conn, ticket_id, last_id)
+            finally:
+                conn.close()
+
+            for msg in messages:
+                last_id = msg['id']
+                yield f"id: {last_id}\nevent: message\ndata: {json.dumps(support_message_payload(msg))}\n\n"
+
+            # Réveil immédiat si le message est publié dans ce worker, relecture sinon
+            if not support_broker.wait(ticket_id, last_id, min(SUPPORT_STREAM_KEEPALIVE, max(deadline - time.monotonic(), 0))):
+                yield ": keepalive\n\n"
+
+    response = app.response_class(events(since_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Appelé par le serveur à la fermeture, même si le générateur n'a jamais démarré
+    response.call_on_close(lambda: support_broker.close_stream(ticket_id))
+    return response
+
 @app.route('/admin')
 def admin_panel():
     """Panneau d'administration principal - ACCÈS LIBRE"""
@@ -2167,12 +3565,8 @@ def admin_dashboard():
     """Dashboard administrateur avec statistiques"""
     conn = get_db_connection()
 
-    # Statistiques générales
-    stats = {}
-    stats['total_users'] = conn.execute('SELECT COUNT(*) as count FROM users').fetchone()['count']
-    stats['total_investments'] = conn.execute('SELECT COALESCE(SUM(amount), 0) as total FROM user_investments').fetchone()['total']
-    stats['total_projects'] = conn.execute('SELECT COUNT(*) as count FROM projects').fetchone()['count']
-    stats['pending_kyc'] = conn.execute('SELECT COUNT(*) as count FROM users WHERE kyc_status = "pending"').fetchone()['count']
+    # Statistiques générales (compteurs maintenus par triggers, recomptés par le job de réconciliation)
+    stats = load_platform_stats(conn)
 
     # Transactions récentes
     transactions = conn.execute('''
@@ -2183,16 +3577,23 @@ def admin_dashboard():
         LIMIT 10
     ''').fetchall()
 
-    # Tickets de support ouverts
-    try:
-        stats['open_tickets'] = conn.execute('SELECT COUNT(*) as count FROM support_tickets WHERE status != "closed"').fetchone()['count']
-    except:
-        stats['open_tickets'] = 0
-
     conn.close()
 
     return render_template('admin_dashboard.html', stats=stats, transactions=transactions)
 
+@app.route('/admin/db-pool-stats')
+@admin_required
+def admin_db_pool_stats():
+    """Compteurs du pool de connexions du worker courant (hits/misses/waits)"""
+    return jsonify(db_pool.stats())
+
+@app.route('/admin/cache-stats')
+@admin_required
+def admin_cache_stats():
+    """Compteurs des caches en mémoire du worker courant"""
+    return jsonify({'dashboard': dashboard_cache.stats(), 'admin_stats': admin_stats_cache.stats(),
+                    'catalog': catalog.stats(), 'fragments': fragment_cache.stats(), 'pages': page_cache.stats()})
+
 @app.route('/admin-activation-required')
 def admin_activation_required():
     """Page d'activation admin requis - ACCÈS LIBRE"""
@@ -2237,13 +3638,14 @@ def activate_admin_access():
     enable_admin_access(duration)
     session['is_admin'] = True
     session['admin_activated_at'] = datetime.now().isoformat()
+    expiry = get_admin_status()['expiry']
 
     log_security_action(session['user_id'], 'admin_access_activated', f'Accès admin activé pour {duration} minutes')
 
     return jsonify({
         'success': True, 
         'message': f'Accès admin activé pour {duration} minutes',
-        'expiry': ADMIN_ACCESS_EXPIRY.isoformat() if ADMIN_ACCESS_EXPIRY else None
+        'expiry': expiry.isoformat() if expiry else None
     })
 
 @app.route('/admin/deactivate', methods=['POST'])
@@ -2335,6 +3737,7 @@ def restore_user_investments(user_id, investments_data=None):
                 inv_data.get('total_earned', 0),
                 generate_transaction_hash()
             ))
+            bump_portfolio_stats(conn, user_id, invested=inv_data['amount'], profits=inv_data.get('total_earned', 0), opened=1)
         
         conn.commit()
         conn.close()
@@ -2356,6 +3759,13 @@ def restore_user_investments(user_id, investments_data=None):
         print(f"❌ Erreur restauration investissements: {e}")
         return False
 
+# Deltas de la page admin des transactions : curseur sur updated_at avec recouvrement
+TRANSACTIONS_DELTA_OVERLAP = '-5 seconds'  # couvre les écritures validées juste après la lecture
+TRANSACTION_REVIEW_TYPES = ('deposit', 'withdrawal')
+
+def transactions_delta_cursor(conn):
+    return conn.execute('SELECT datetime(\'now\', ?)', (TRANSACTIONS_DELTA_OVERLAP,)).fetchone()[0]
+
 @app.route('/admin/transactions')
 @admin_required
 def admin_transactions():
@@ -2370,19 +3780,55 @@ def admin_transactions():
         WHERE t.status = 'pending'
         ORDER BY t.created_at DESC
     ''').fetchall()
+    cursor = transactions_delta_cursor(conn)
 
     conn.close()
 
-    return render_template('admin_transactions.html', transactions=pending_transactions)
+    return render_template('admin_transactions.html', transactions=pending_transactions, cursor=cursor)
+
+@app.route('/admin/transactions/changes')
+@admin_required
+def admin_transactions_changes():
+    """Transactions en attente modifiées, et celles traitées, depuis le curseur ?since="""
+    since = request.args.get('since', '')
+    try:
+        datetime.strptime(since, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return jsonify({'error': 'Curseur invalide'}), 400
+
+    conn = get_db_connection()
+
+    changed = conn.execute('''
+        SELECT t.*, u.first_name, u.last_name, u.email
+        FROM transactions t
+        JOIN users u ON t.user_id = u.id
+        WHERE t.status = 'pending' AND t.updated_at >= ?
+        ORDER BY t.created_at ASC
+    ''', (since,)).fetchall()
+
+    resolved = conn.execute('''
+        SELECT id FROM transactions
+        WHERE status IN ('completed', 'failed') AND updated_at >= ? AND type IN (?, ?)
+    ''', (since, *TRANSACTION_REVIEW_TYPES)).fetchall()
+
+    cursor = transactions_delta_cursor(conn)
+    conn.close()
+
+    transaction_row = get_template_attribute('admin_transaction_row.html', 'transaction_row')
+    return jsonify({
+        'changed': [{'id': row['id'], 'type': row['type'], 'html': str(transaction_row(row))} for row in changed],
+        'resolved': [row['id'] for row in resolved],
+        'cursor': cursor
+    })
 
 @app.route('/restore-from-backup', methods=['POST'])
-@login_required
+@admin_required
 def restore_from_backup():
     """Restaurer manuellement depuis la sauvegarde"""
     try:
-        if not REPLIT_DB_AVAILABLE:
+        if not BACKUP_ENABLED:
             return jsonify({
-                'error': 'Sauvegarde Replit non disponible'
+                'error': f'Sauvegarde {BACKUP_TARGET} non disponible'
             }), 400
         
         success = restore_critical_data()
@@ -2403,16 +3849,20 @@ def restore_from_backup():
         }), 500
 
 @app.route('/force-backup', methods=['POST'])
-@login_required
+@admin_required
 def force_backup():
     """Forcer une sauvegarde manuelle"""
     try:
-        if not REPLIT_DB_AVAILABLE:
+        if not BACKUP_ENABLED:
             return jsonify({
-                'error': 'Sauvegarde Replit non disponible'
+                'error': f'Sauvegarde {BACKUP_TARGET} non disponible'
             }), 400
         
-        backup_critical_data()
+        result = backup_critical_data()
+        if BACKUP_TARGET == 'local' and not result:
+            return jsonify({
+                'error': 'Échec de l\'instantané local'
+            }), 500
         
         return jsonify({
             'success': True,
@@ -2453,15 +3903,29 @@ def approve_transaction(transaction_id):
             conn.close()
             return jsonify({'error': 'Montant de transaction invalide'}), 400
 
+        if transaction['type'] not in ('deposit', 'withdrawal'):
+            conn.close()
+            return jsonify({'error': 'Type de transaction non supporté'}), 400
+
+        # Marquer la transaction comme complétée avant tout crédit : seule la requête
+        # qui la fait sortir de l'état pending continue (pas de double approbation)
+        completed = conn.execute('''
+            UPDATE transactions 
+            SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'pending'
+            RETURNING id
+        ''', (transaction_id,)).fetchall()
+
+        if not completed:
+            conn.rollback()
+            conn.close()
+            return jsonify({'error': 'Transaction non trouvée ou déjà traitée'}), 404
+
         # Traiter selon le type de transaction
         if transaction['type'] == 'deposit':
             # Approuver le dépôt - créditer le compte
-            new_balance = transaction['balance'] + transaction['amount']
-            conn.execute('''
-                UPDATE users 
-                SET balance = ?
-                WHERE id = ?
-            ''', (new_balance, transaction['user_id']))
+            new_balance = ledger.credit(conn, transaction['user_id'], transaction['amount'], 'deposit',
+                                        f"transactions:{transaction['id']}")
 
             # Message de notification pour dépôt
             notification_msg = f'Votre dépôt de {transaction["amount"]:.2f} USDT a été approuvé et crédité à votre compte. Nouveau solde: {new_balance:.2f} USDT'
@@ -2470,21 +3934,11 @@ def approve_transaction(transaction_id):
             # Le montant a déjà été débité lors de la demande
             # Message de notification pour retrait
             notification_msg = f'Votre retrait de {transaction["amount"]:.2f} USDT a été traité avec succès et sera envoyé à votre adresse.'
-            
-        else:
-            conn.close()
-            return jsonify({'error': 'Type de transaction non supporté'}), 400
-
-        # Marquer la transaction comme complétée avec updated_at
-        conn.execute('''
-            UPDATE transactions 
-            SET status = 'completed', updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (transaction_id,))
 
         # Valider toutes les modifications
         conn.commit()
         conn.close()
+        invalidate_dashboard(transaction['user_id'])
 
         # Ajouter notification après fermeture de la connexion
         add_notification(
@@ -2542,22 +3996,27 @@ def reject_transaction(transaction_id):
         if not transaction:
             return jsonify({'error': 'Transaction non trouvée'}), 404
 
+        # Marquer comme rejetée d'abord : un seul rejet rembourse, et jamais une transaction déjà traitée
+        rejected = conn.execute('''
+            UPDATE transactions 
+            SET status = 'failed', updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'pending'
+            RETURNING id
+        ''', (transaction_id,)).fetchall()
+
+        if not rejected:
+            conn.rollback()
+            return jsonify({'error': 'Transaction déjà traitée'}), 409
+
         if transaction['type'] == 'withdrawal':
             # Rembourser le montant au solde utilisateur
-            conn.execute('''
-                UPDATE users 
-                SET balance = balance + ? 
-                WHERE id = ?
-            ''', (transaction['amount'], transaction['user_id']))
+            ledger.credit(conn, transaction['user_id'], transaction['amount'], 'withdrawal_refund',
+                          f"transactions:{transaction['id']}")
 
-        # Marquer comme rejetée
-        conn.execute('''
-            UPDATE transactions 
-            SET status = 'failed' 
-            WHERE id = ?
-        ''', (transaction_id,))
+        conn.commit()
+        invalidate_dashboard(transaction['user_id'])
 
-        # Ajouter notification
+        # Notification seulement une fois le rejet validé
         add_notification(
             transaction['user_id'],
             'Transaction rejetée',
@@ -2565,8 +4024,6 @@ def reject_transaction(transaction_id):
             'error'
         )
 
-        conn.commit()
-
         return jsonify({'success': True, 'message': 'Transaction rejetée'})
 
     except Exception as e:
@@ -2575,26 +4032,132 @@ def reject_transaction(transaction_id):
     finally:
         conn.close()
 
+# Recherche du support : classement bm25 (le sujet/la question pèse plus que le corps)
+SUPPORT_SEARCH_LIMIT = 20
+SUPPORT_SEARCH_MAX_TERMS = 8
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+def support_search_query(text):
+    """Texte libre -> requête FTS5 sûre : chaque mot entre guillemets, en préfixe, tous requis"""
+    terms = re.findall(r'\w+', text or '')[:SUPPORT_SEARCH_MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def highlight_snippet(snippet):
+    """Échapper l'extrait (contenu utilisateur) avant de poser les balises de surlignage"""
+    return html.escape(snippet or '').replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>')
+
+def search_support(conn, text, user_id=None, limit=SUPPORT_SEARCH_LIMIT):
+    """Tickets, messages et FAQ active correspondant au texte ; user_id restreint aux tickets de l'utilisateur"""
+    query = support_search_query(text)
+    if not query:
+        return []
+
+    rows = conn.execute('''
+        SELECT s.rowid, s.ticket_id, st.status, st.user_id, u.email,
+               COALESCE(f.question, st.subject) as title,
+               snippet(support_search, -1, ?, ?, '…', 16) as snippet
+        FROM support_search s
+        LEFT JOIN support_tickets st ON st.id = s.ticket_id
+        LEFT JOIN users u ON u.id = st.user_id
+        LEFT JOIN faq f ON s.rowid % 3 = 2 AND f.id = s.rowid / 3
+        WHERE support_search MATCH ?
+          AND ((s.rowid % 3 = 2 AND f.is_active = 1) OR (s.rowid % 3 != 2 AND (? IS NULL OR st.user_id = ?)))
+        ORDER BY bm25(support_search, 0.0, 4.0, 1.0)
+        LIMIT ?
+    ''', (SNIPPET_OPEN, SNIPPET_CLOSE, query, user_id, user_id, limit)).fetchall()
+
+    results = []
+    for row in rows:
+        kind = SUPPORT_SEARCH_KINDS[row['rowid'] % 3]
+        result = {'kind': kind, 'id': row['rowid'] // 3, 'title': row['title'],
+                  'snippet': highlight_snippet(row['snippet'])}
+        if kind != 'faq':
+            result.update({'ticket_id': row['ticket_id'], 'status': row['status']})
+            if user_id is None:
+                result['email'] = row['email']
+        results.append(result)
+    return results
+
+@app.route('/support/search')
+@login_required
+def support_search():
+    """Recherche dans la FAQ et les tickets de l'utilisateur (?q=)"""
+    conn = get_db_connection()
+    try:
+        results = search_support(conn, request.args.get('q', ''), user_id=session['user_id'])
+    finally:
+        conn.close()
+    return jsonify({'results': results})
+
+@app.route('/admin/support/search')
+@admin_required
+def admin_support_search():
+    """Recherche dans tous les tickets, messages et la FAQ (?q=)"""
+    limit = min(request.args.get('limit', SUPPORT_SEARCH_LIMIT, type=int), API_MAX_PAGE_SIZE)
+    conn = get_db_connection()
+    try:
+        results = search_support(conn, request.args.get('q', ''), limit=max(1, limit))
+    finally:
+        conn.close()
+    return jsonify({'results': results})
+
+# Listing admin des tickets : pages par curseur (created_at, id), filtres appliqués en SQL
+ADMIN_TICKETS_PAGE_SIZE = 50
+SUPPORT_TICKET_STATUSES = ('open', 'user_reply', 'admin_reply', 'closed')
+SUPPORT_TICKET_PRIORITIES = ('normal', 'high', 'urgent')
+
+def load_admin_tickets(conn, status=None, priority=None, cursor=None, limit=ADMIN_TICKETS_PAGE_SIZE):
+    """Une page de tickets (plus récents d'abord) et le curseur de la suivante"""
+    filters = []
+    params = []
+    if status:
+        filters.append('st.status = ?')
+        params.append(status)
+    if priority:
+        filters.append('st.priority = ?')
+        params.append(priority)
+
+    after_date, after_id = cursor or HISTORY_CURSOR_START
+    rows = conn.execute(f'''
+        SELECT st.*, u.first_name, u.last_name, u.email
+        FROM support_tickets st
+        JOIN users u ON st.user_id = u.id
+        WHERE {' AND '.join(filters + ['(st.created_at, st.id) < (?, ?)'])}
+        ORDER BY st.created_at DESC, st.id DESC
+        LIMIT ?
+    ''', params + [after_date, after_id, limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['created_at']}|{rows[-1]['id']}"
+    return rows, next_cursor
+
 @app.route('/admin/support')
 @admin_required
 def admin_support():
-    """Gestion des tickets de support"""
+    """Gestion des tickets de support (?status=, ?priority=, ?cursor=)"""
+    status = request.args.get('status', '')
+    priority = request.args.get('priority', '')
+    if status not in SUPPORT_TICKET_STATUSES:
+        status = ''
+    if priority not in SUPPORT_TICKET_PRIORITIES:
+        priority = ''
+    cursor = parse_history_cursor(request.args.get('cursor'))
+
     conn = get_db_connection()
 
     try:
-        tickets = conn.execute('''
-            SELECT st.*, u.first_name, u.last_name, u.email,
-                   (SELECT COUNT(*) FROM support_messages sm WHERE sm.ticket_id = st.id) as message_count
-            FROM support_tickets st
-            JOIN users u ON st.user_id = u.id
-            ORDER BY st.created_at DESC
-        ''').fetchall()
-    except:
-        tickets = []
+        tickets, next_cursor = load_admin_tickets(conn, status, priority, cursor)
+        status_counts = load_ticket_status_counts(conn)
+    except sqlite3.Error:
+        tickets, next_cursor, status_counts = [], None, {}
 
     conn.close()
 
-    return render_template('admin_support.html', tickets=tickets)
+    return render_template('admin_support.html', tickets=tickets, next_cursor=next_cursor,
+                         status_counts=status_counts, filters={'status': status, 'priority': priority},
+                         is_first_page=cursor is None)
 
 @app.route('/admin/support/ticket/<int:ticket_id>')
 @admin_required
@@ -2642,7 +4205,7 @@ def admin_support_reply():
 
     try:
         # Ajouter la réponse admin
-        conn.execute('''
+        cursor = conn.execute('''
             INSERT INTO support_messages (ticket_id, message, is_admin)
             VALUES (?, ?, 1)
         ''', (ticket_id, message))
@@ -2650,7 +4213,8 @@ def admin_support_reply():
         # Mettre à jour le statut du ticket
         conn.execute('''
             UPDATE support_tickets 
-            SET status = 'admin_reply'
+            SET status = 'admin_reply',
+                message_count = message_count + 1, last_message_at = CURRENT_TIMESTAMP
             WHERE id = ?
         ''', (ticket_id,))
 
@@ -2664,8 +4228,10 @@ def admin_support_reply():
 
         conn.commit()
 
-        # Ajouter notification à l'utilisateur
         if ticket:
+            support_broker.publish(ticket['id'], cursor.lastrowid)
+
+            # Ajouter notification à l'utilisateur
             add_notification(
                 ticket['user_id'],
                 'Réponse du support',
@@ -2726,7 +4292,12 @@ def admin_close_ticket(ticket_id):
 def admin_calculate_profits():
     """Déclencher manuellement le calcul des profits quotidiens"""
     try:
-        calculate_daily_profits()
+        result = calculate_daily_profits()
+        if result['already_completed']:
+            return jsonify({
+                'success': True,
+                'message': f'Profits du {result["run_date"]} déjà calculés, aucun nouveau crédit.'
+            })
         return jsonify({
             'success': True, 
             'message': 'Profits quotidiens calculés avec succès!'
@@ -2741,7 +4312,12 @@ def admin_calculate_profits():
 def user_calculate_profits():
     """Permettre aux utilisateurs de déclencher le calcul des profits"""
     try:
-        calculate_daily_profits()
+        result = calculate_daily_profits()
+        if result['already_completed']:
+            return jsonify({
+                'success': True,
+                'message': 'Vos profits du jour ont déjà été versés.'
+            })
         return jsonify({
             'success': True, 
             'message': 'Vos profits ont été recalculés!'
@@ -2797,12 +4373,8 @@ def auto_trading():
     """Page d'auto-trading IA"""
     conn = get_db_connection()
     
-    # Récupérer les stratégies de trading
-    strategies = conn.execute('''
-        SELECT * FROM trading_strategies 
-        WHERE is_active = 1
-        ORDER BY risk_level, expected_daily_return DESC
-    ''').fetchall()
+    # Stratégies de trading depuis le catalogue en mémoire
+    strategies = catalog.rows('active_trading_strategies')
     
     # Récupérer les bots actifs de l'utilisateur
     user_bots = conn.execute('''
@@ -2823,12 +4395,8 @@ def copy_trading():
     """Page de copy trading"""
     conn = get_db_connection()
     
-    # Récupérer les top traders
-    top_traders = conn.execute('''
-        SELECT * FROM top_traders 
-        WHERE is_active = 1
-        ORDER BY total_return DESC
-    ''').fetchall()
+    # Top traders depuis le catalogue en mémoire
+    top_traders = catalog.rows('active_top_traders')
     
     # Récupérer les copy trades actifs de l'utilisateur
     user_copies = conn.execute('''
@@ -2851,27 +4419,26 @@ def start_trading_bot():
     strategy_id = data.get('strategy_id')
     amount = float(data.get('amount', 0))
     
-    conn = get_db_connection()
-    
     # Récupérer les détails de la stratégie
-    strategy = conn.execute('SELECT * FROM trading_strategies WHERE id = ?', (strategy_id,)).fetchone()
+    strategy = catalog.get('trading_strategies', strategy_id)
     if not strategy:
-        conn.close()
         return jsonify({'error': 'Stratégie non trouvée'}), 404
     
     # Vérifier les limites de montant
     if amount < strategy['min_amount'] or amount > strategy['max_amount']:
-        conn.close()
         return jsonify({'error': f'Montant doit être entre {strategy["min_amount"]} et {strategy["max_amount"]} USDT'}), 400
     
-    # Vérifier le solde utilisateur
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    conn = get_db_connection()
+    
+    # Débiter le solde utilisateur (contrôle et écriture en une seule requête)
+    transaction_hash = generate_transaction_hash()
+    if ledger.debit(conn, session['user_id'], amount, 'trading_bot', transaction_hash) is None:
+        conn.rollback()
         conn.close()
         return jsonify({'error': 'Solde insuffisant'}), 400
     
     # Calculer le profit quotidien estimé
-    daily_profit = amount * strategy['expected_daily_return']
+    daily_profit = yields.bot_daily_profit(amount, strategy['expected_daily_return'])
     
     # Créer le bot de trading
     cursor = conn.execute('''
@@ -2879,16 +4446,16 @@ def start_trading_bot():
         VALUES (?, ?, ?, ?, ?)
     ''', (session['user_id'], strategy_id, amount, daily_profit, generate_transaction_hash()))
     
-    # Mettre à jour le solde utilisateur
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
-    
     # Ajouter transaction
     conn.execute('''
         INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
         VALUES (?, 'trading_bot', ?, 'completed', ?)
-    ''', (session['user_id'], amount, generate_transaction_hash()))
+    ''', (session['user_id'], amount, transaction_hash))
     
+    bump_portfolio_stats(conn, session['user_id'], invested=amount, opened=1)
+
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
     
     # Ajouter notification
@@ -2910,22 +4477,21 @@ def start_copy_trading():
     amount = float(data.get('amount', 0))
     copy_ratio = float(data.get('copy_ratio', 1.0))
     
-    conn = get_db_connection()
-    
     # Récupérer les détails du trader
-    trader = conn.execute('SELECT * FROM top_traders WHERE id = ?', (trader_id,)).fetchone()
+    trader = catalog.get('top_traders', trader_id)
     if not trader:
-        conn.close()
         return jsonify({'error': 'Trader non trouvé'}), 404
     
     # Vérifier les limites de montant
     if amount < trader['min_copy_amount'] or amount > trader['max_copy_amount']:
-        conn.close()
         return jsonify({'error': f'Montant doit être entre {trader["min_copy_amount"]} et {trader["max_copy_amount"]} USDT'}), 400
     
-    # Vérifier le solde utilisateur
-    user = conn.execute('SELECT balance FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-    if user['balance'] < amount:
+    conn = get_db_connection()
+    
+    # Débiter le solde utilisateur (contrôle et écriture en une seule requête)
+    transaction_hash = generate_transaction_hash()
+    if ledger.debit(conn, session['user_id'], amount, 'copy_trading', transaction_hash) is None:
+        conn.rollback()
         conn.close()
         return jsonify({'error': 'Solde insuffisant'}), 400
     
@@ -2935,9 +4501,6 @@ def start_copy_trading():
         VALUES (?, ?, ?, ?, ?)
     ''', (session['user_id'], trader_id, amount, copy_ratio, generate_transaction_hash()))
     
-    # Mettre à jour le solde utilisateur
-    conn.execute('UPDATE users SET balance = balance - ? WHERE id = ?', (amount, session['user_id']))
-    
     # Mettre à jour le nombre de followers du trader
     conn.execute('UPDATE top_traders SET followers_count = followers_count + 1 WHERE id = ?', (trader_id,))
     
@@ -2945,9 +4508,13 @@ def start_copy_trading():
     conn.execute('''
         INSERT INTO transactions (user_id, type, amount, status, transaction_hash)
         VALUES (?, 'copy_trading', ?, 'completed', ?)
-    ''', (session['user_id'], amount, generate_transaction_hash()))
+    ''', (session['user_id'], amount, transaction_hash))
     
+    bump_portfolio_stats(conn, session['user_id'], invested=amount, opened=1)
+
     conn.commit()
+    invalidate_dashboard(session['user_id'])
+    catalog.invalidate()  # followers_count a changé
     conn.close()
     
     # Ajouter notification
@@ -2966,28 +4533,28 @@ def stop_trading_bot(bot_id):
     """Arrêter un bot de trading"""
     conn = get_db_connection()
     
-    # Récupérer et vérifier le bot
-    bot = conn.execute('''
-        SELECT * FROM user_trading_bots 
+    # Arrêter le bot : seule la requête qui le fait passer de actif à arrêté rembourse
+    stopped = conn.execute('''
+        UPDATE user_trading_bots 
+        SET is_active = 0, end_date = CURRENT_TIMESTAMP 
         WHERE id = ? AND user_id = ? AND is_active = 1
-    ''', (bot_id, session['user_id'])).fetchone()
+        RETURNING amount, total_profit
+    ''', (bot_id, session['user_id'])).fetchall()
     
-    if not bot:
+    if not stopped:
+        conn.rollback()
         conn.close()
         return jsonify({'error': 'Bot non trouvé ou déjà arrêté'}), 404
-    
-    # Arrêter le bot
-    conn.execute('''
-        UPDATE user_trading_bots 
-        SET is_active = 0, end_date = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (bot_id,))
+    bot = stopped[0]
     
     # Rembourser le capital + profits
     total_amount = bot['amount'] + bot['total_profit']
-    conn.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (total_amount, session['user_id']))
+    ledger.credit(conn, session['user_id'], total_amount, 'trading_bot_stop', f'user_trading_bots:{bot_id}')
     
+    bump_portfolio_stats(conn, session['user_id'], closed=1)
+
     conn.commit()
+    invalidate_dashboard(session['user_id'])
     conn.close()
     
     add_notification(
@@ -3005,31 +4572,32 @@ def stop_copy_trading(copy_id):
     """Arrêter le copy trading"""
     conn = get_db_connection()
     
-    # Récupérer et vérifier le copy trade
-    copy_trade = conn.execute('''
-        SELECT * FROM user_copy_trading 
+    # Arrêter le copy trading : seule la requête qui le fait passer de actif à arrêté rembourse
+    stopped = conn.execute('''
+        UPDATE user_copy_trading 
+        SET is_active = 0, end_date = CURRENT_TIMESTAMP 
         WHERE id = ? AND user_id = ? AND is_active = 1
-    ''', (copy_id, session['user_id'])).fetchone()
+        RETURNING amount, total_profit, trader_id
+    ''', (copy_id, session['user_id'])).fetchall()
     
-    if not copy_trade:
+    if not stopped:
+        conn.rollback()
         conn.close()
         return jsonify({'error': 'Copy trading non trouvé ou déjà arrêté'}), 404
-    
-    # Arrêter le copy trading
-    conn.execute('''
-        UPDATE user_copy_trading 
-        SET is_active = 0, end_date = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (copy_id,))
+    copy_trade = stopped[0]
     
     # Rembourser le capital + profits
     total_amount = copy_trade['amount'] + copy_trade['total_profit']
-    conn.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (total_amount, session['user_id']))
+    ledger.credit(conn, session['user_id'], total_amount, 'copy_trading_stop', f'user_copy_trading:{copy_id}')
     
     # Réduire le nombre de followers du trader
     conn.execute('UPDATE top_traders SET followers_count = followers_count - 1 WHERE id = ?', (copy_trade['trader_id'],))
     
+    bump_portfolio_stats(conn, session['user_id'], closed=1)
+
     conn.commit()
+    invalidate_dashboard(session['user_id'])
+    catalog.invalidate()  # followers_count a changé
     conn.close()
     
     add_notification(
@@ -3314,11 +4882,12 @@ def create_secure_admin(email, password, first_name="Admin", last_name="System")
         conn = get_db_connection()
 
         # Vérifier si l'admin existe déjà
-        existing_admin = conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+        existing_admin = conn.execute('SELECT id, password_hash FROM users WHERE email = ?', (email,)).fetchone()
         if existing_admin:
             print(f"⚠️ Administrateur {email} existe déjà")
-            # Mettre à jour le mot de passe si différent
-            update_admin_password(email, password)
+            # Mettre à jour le mot de passe seulement s'il est différent
+            if not check_password_hash(existing_admin['password_hash'], password):
+                update_admin_password(email, password)
             conn.close()
             return False
 
@@ -3382,7 +4951,58 @@ def log_security_action(user_id, action, details=""):
     except Exception as e:
         print(f"❌ Erreur log sécurité: {e}")
 
-if __name__ == '__main__':
+# Comptes administrateur créés au démarrage
+ADMIN_ACCOUNTS = [
+    ('admin@ttrust.com', 'AdminSecure2024!', 'Admin', 'Principal'),
+    ('support@ttrust.com', 'SupportSecure2024!', 'Support', 'Team'),
+    ('security@ttrust.com', 'SecuritySecure2024!', 'Security', 'Team'),
+    ('a@gmail.com', 'aaaaaa', 'Admin', 'User'),
+]
+
+def admin_seed_fingerprint():
+    """Empreinte de la configuration des comptes admin (change si un mot de passe configuré change)
+
+    HMAC avec la clé secrète de l'application : une copie de la base ne permet pas de retrouver
+    les mots de passe par force brute hors ligne."""
+    return hmac.new(app.secret_key.encode(), json.dumps(ADMIN_ACCOUNTS).encode(), hashlib.sha256).hexdigest()
+
+def is_database_initialized():
+    """Vrai si le schéma est à la dernière version et les comptes admin déjà semés avec cette configuration"""
+    try:
+        conn = sqlite3.connect(DATABASE, timeout=60.0)
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                return False
+            row = conn.execute("SELECT value FROM app_meta WHERE key = 'admin_seed_fingerprint'").fetchone()
+            return row is not None and row[0] == admin_seed_fingerprint()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+def seed_admin_accounts():
+    """Créer les comptes administrateur sécurisés et enregistrer l'empreinte de leur configuration"""
+    print("🔐 Initialisation des comptes administrateur...")
+    for email, password, first_name, last_name in ADMIN_ACCOUNTS:
+        create_secure_admin(email, password, first_name, last_name)
+
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO app_meta (key, value) VALUES ('admin_seed_fingerprint', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+    ''', (admin_seed_fingerprint(),))
+    conn.commit()
+    conn.close()
+
+def bootstrap_database():
+    """Initialiser la base au démarrage ; chemin rapide si schéma et comptes admin sont à jour"""
+    started = time.perf_counter()
+
+    if is_database_initialized():
+        print(f"⚡ Base de données déjà initialisée (schéma v{SCHEMA_VERSION}), démarrage rapide en {(time.perf_counter() - started) * 1000:.1f} ms")
+        return False
+
+
     # Initialize database with retry logic
     max_init_retries = 3
     for init_attempt in range(max_init_retries):
@@ -3390,33 +5010,62 @@ if __name__ == '__main__':
             init_db()
             print("✅ Base de données initialisée avec succès")
             
-            # Tenter de restaurer les données depuis la sauvegarde
-            if REPLIT_DB_AVAILABLE:
+            # Tenter de restaurer les données depuis la sauvegarde (un instantané local ne recharge qu'une base vide)
+            if BACKUP_ENABLED:
                 restore_critical_data()
             
             break
         except sqlite3.OperationalError as e:
             if "database is locked" in str(e) and init_attempt < max_init_retries - 1:
                 print(f"⚠️ Base de données verrouillée, tentative {init_attempt + 1}/{max_init_retries}")
-                import time
                 time.sleep(2)
                 continue
             else:
                 print(f"❌ Erreur initialisation DB: {e}")
-                break
+                return False
         except Exception as e:
             print(f"❌ Erreur inattendue initialisation: {e}")
-            break
+            return False
 
-    # Créer les comptes administrateur sécurisés
-    print("🔐 Initialisation des comptes administrateur...")
-    create_secure_admin('admin@ttrust.com', 'AdminSecure2024!', 'Admin', 'Principal')
-    create_secure_admin('support@ttrust.com', 'SupportSecure2024!', 'Support', 'Team')
-    create_secure_admin('security@ttrust.com', 'SecuritySecure2024!', 'Security', 'Team')
-    create_secure_admin('a@gmail.com', 'aaaaaa', 'Admin', 'User')
+    seed_admin_accounts()
+    print(f"✅ Initialisation complète en {time.perf_counter() - started:.2f}s")
+    return True
+
+# Verrous fichiers : un seul processus fait la DDL, un seul possède le scheduler
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BOOTSTRAP_LOCK_FILE = f'{DATABASE}.bootstrap.lock'
+SCHEDULER_LOCK_FILE = f'{DATABASE}.scheduler.lock'
+
+scheduler = None
+_scheduler_lock = None
 
-    # Mettre à jour le mot de passe du compte a@gmail.com
-    update_admin_password('a@gmail.com', 'aaaaaa')
+def _acquire_file_lock(path, blocking=True):
+    """Verrou exclusif sur un fichier ; None si non bloquant et déjà pris par un autre processus"""
+    lock_file = open(path, 'a+')
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lock_file
+    except BlockingIOError:
+        lock_file.close()
+        return None
+
+def start_scheduler():
+    """Démarrer le scheduler si ce processus devient leader (verrou conservé toute sa vie)"""
+    global scheduler, _scheduler_lock
+
+    if scheduler is not None:
+        return True
+
+    _scheduler_lock = _acquire_file_lock(SCHEDULER_LOCK_FILE, blocking=False)
+    if _scheduler_lock is None:
+        print(f"ℹ️ Scheduler déjà actif dans un autre processus, non démarré dans le pid {os.getpid()}")
+        return False
 
     # Setup scheduler for daily profit calculation and backup
     scheduler = BackgroundScheduler()
@@ -3428,8 +5077,16 @@ if __name__ == '__main__':
         id='daily_profits'
     )
     
-    # Sauvegarde périodique toutes les 30 minutes si Replit DB disponible
-    if REPLIT_DB_AVAILABLE:
+    # Recomptage complet des compteurs globaux (corrige la dérive éventuelle des triggers)
+    scheduler.add_job(
+        func=reconcile_platform_counters,
+        trigger="interval",
+        minutes=PLATFORM_COUNTERS_RECONCILE_MINUTES,
+        id='reconcile_platform_counters'
+    )
+
+    # Sauvegarde périodique toutes les 30 minutes vers la cible configurée
+    if BACKUP_ENABLED:
         scheduler.add_job(
             func=backup_critical_data,
             trigger="interval",
@@ -3438,8 +5095,27 @@ if __name__ == '__main__':
         )
     
     scheduler.start()
+    print(f"⏰ Scheduler démarré dans le processus {os.getpid()}")
 
     # Shutdown scheduler when exiting the app
     atexit.register(lambda: scheduler.shutdown())
+    return True
+
+def create_app(with_scheduler=True):
+    """Application factory : gunicorn "main:create_app()" l'appelle dans chaque worker"""
+    # La DDL ne s'exécute qu'une fois : les autres processus attendent puis prennent le chemin rapide
+    bootstrap_lock = _acquire_file_lock(BOOTSTRAP_LOCK_FILE)
+    try:
+        bootstrap_database()
+    finally:
+        bootstrap_lock.close()
+
+    if with_scheduler:
+        start_scheduler()
+
+    return app
+
+if __name__ == '__main__':
+    create_app()
 
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
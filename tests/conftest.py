@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# La configuration est lue à l'import de main : base et sauvegardes dans un répertoire jetable
+_IMPORT_DIR = tempfile.mkdtemp(prefix='ttrust-tests-')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_IMPORT_DIR, 'import.db'))
+os.environ.setdefault('BACKUP_TARGET', 'local')
+os.environ.setdefault('BACKUP_DIR', os.path.join(_IMPORT_DIR, 'backups'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as app_main  # noqa: E402
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    """Module main pointé sur une base neuve (schéma complet) propre au test"""
+    database = str(tmp_path / 'test.db')
+    monkeypatch.setattr(app_main, 'DATABASE', database)
+    monkeypatch.setattr(app_main, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(app_main, 'db_pool', app_main.SQLiteConnectionPool(database, max_size=4, timeout=5))
+    app_main._db_local.holder = None
+    app_main.init_db()
+    # L'échéance admin et le catalogue en cache viennent de la base du test précédent
+    app_main.admin_access.invalidate()
+    monkeypatch.setattr(app_main, 'catalog', app_main.CatalogCache(app_main.CATALOG_QUERIES, app_main.CATALOG_CHECK_TTL))
+    yield app_main
+    # L'outbox rend sa connexion au pool courant : la vider avant que le pool du test ne soit remplacé
+    app_main.notification_outbox.flush()
+    app_main._db_local.holder = None
+
+@pytest.fixture
+def db(main):
+    """Connexion directe à la base du test, hors pool"""
+    conn = main.sqlite3.connect(main.DATABASE, timeout=5)
+    conn.row_factory = main.sqlite3.Row
+    yield conn
+    conn.close()
+
+def login(main, user_id, is_admin=False):
+    """Client de test avec une session ouverte pour user_id"""
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['is_admin'] = is_admin
+    return client
+
+def create_user(conn, email='user@example.com', balance=0.0):
+    cursor = conn.execute('''
+        INSERT INTO users (email, password_hash, first_name, last_name, referral_code, balance)
+        VALUES (?, 'x', 'Test', 'User', ?, ?)
+    ''', (email, email, balance))
+    conn.commit()
+    return cursor.lastrowid
+
+def create_trading_bot(conn, user_id, amount=100.0, daily_profit=2.0):
+    strategy_id = conn.execute('''
+        INSERT INTO trading_strategies (name, description, risk_level, expected_daily_return,
+                                        min_amount, max_amount, strategy_type, parameters)
+        VALUES ('Test bot', 'test', 'low', 2.0, 10, 1000, 'grid', '{}')
+    ''').lastrowid
+    bot_id = conn.execute('''
+        INSERT INTO user_trading_bots (user_id, strategy_id, amount, daily_profit)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, strategy_id, amount, daily_profit)).lastrowid
+    conn.commit()
+    return bot_id
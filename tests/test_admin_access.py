@@ -0,0 +1,37 @@
+import time
+
+from conftest import create_user, login
+
+def write_expiry(conn, expiry):
+    # Écriture faite par un autre processus (CLI, autre worker)
+    conn.execute('''
+        INSERT OR REPLACE INTO app_meta (key, value) VALUES ('admin_access_expiry', ?)
+    ''', ('' if expiry is None else repr(expiry),))
+    conn.commit()
+
+def test_admin_access_is_shared_through_app_meta(main, db):
+    other_worker = main.AdminAccessState(ttl=0.05)
+    assert not other_worker.is_enabled()
+
+    main.enable_admin_access(duration_minutes=5)
+    time.sleep(0.1)
+    assert other_worker.is_enabled()
+
+    main.disable_admin_access()
+    time.sleep(0.1)
+    assert not other_worker.is_enabled()
+
+def test_admin_routes_follow_activation_from_another_process(main, db):
+    admin_id = create_user(db, 'admin@example.com')
+    client = login(main, admin_id, is_admin=True)
+    assert client.get('/admin/support').status_code == 302
+
+    write_expiry(db, time.time() + 300)
+    main.admin_access.invalidate()
+    assert client.get('/admin/support').status_code == 200
+
+    # Une échéance dépassée vaut désactivation
+    write_expiry(db, time.time() - 1)
+    main.admin_access.invalidate()
+    response = client.get('/admin/support')
+    assert response.status_code == 302 and 'activation' in response.headers['Location']
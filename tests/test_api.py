@@ -0,0 +1,53 @@
+from conftest import create_user, login
+
+def add_transactions(conn, user_id, count):
+    # Même created_at pour toutes : l'id départage le curseur
+    for index in range(count):
+        conn.execute('''
+            INSERT INTO transactions (user_id, type, amount, status, created_at)
+            VALUES (?, 'deposit', ?, 'completed', '2024-01-01 00:00:00')
+        ''', (user_id, index + 1))
+    conn.commit()
+
+def test_api_cursor_pages_cover_every_row_once(main, db):
+    user_id = create_user(db, 'api@example.com')
+    other_id = create_user(db, 'other@example.com')
+    add_transactions(db, user_id, 5)
+    add_transactions(db, other_id, 2)
+    client = login(main, user_id)
+
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/v1/transactions?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        assert len(page['data']) <= 2
+        seen += [row['id'] for row in page['data']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    expected = [row[0] for row in db.execute(
+        'SELECT id FROM transactions WHERE user_id = ? ORDER BY created_at DESC, id DESC', (user_id,)
+    )]
+    assert seen == expected
+
+    assert client.get('/api/v1/transactions?cursor=garbage').status_code == 400
+    assert client.get('/api/v1/unknown').status_code == 404
+
+def test_api_revalidates_with_etag(main, db):
+    user_id = create_user(db, 'etag@example.com')
+    add_transactions(db, user_id, 1)
+    client = login(main, user_id)
+
+    first = client.get('/api/v1/transactions')
+    assert first.status_code == 200 and first.headers['ETag']
+
+    unchanged = client.get('/api/v1/transactions', headers={'If-None-Match': first.headers['ETag']})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b''
+
+    add_transactions(db, user_id, 1)
+    changed = client.get('/api/v1/transactions', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert len(changed.get_json()['data']) == 2
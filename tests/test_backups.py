@@ -0,0 +1,88 @@
+from conftest import create_user, login
+
+def test_boot_restore_keeps_rows_written_after_snapshot(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_TARGET', 'local')
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', True)
+
+    main.bootstrap_database()
+    assert main._backup_to_local() is not None
+
+    user_id = create_user(db, 'after-snapshot@example.com')
+
+    # Empreinte admin effacée : le démarrage suivant reprend le chemin lent (init_db + restauration)
+    db.execute("DELETE FROM app_meta WHERE key = 'admin_seed_fingerprint'")
+    db.commit()
+    assert main.bootstrap_database() is True
+
+    assert db.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone() is not None
+
+def test_boot_restores_local_snapshot_into_empty_database(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_TARGET', 'local')
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', True)
+
+    user_id = create_user(db, 'snapshot@example.com')
+    assert main._backup_to_local() is not None
+    db.close()
+
+    for suffix in ('', '-wal', '-shm'):
+        if main.os.path.exists(main.DATABASE + suffix):
+            main.os.remove(main.DATABASE + suffix)
+
+    main.bootstrap_database()
+    conn = main.sqlite3.connect(main.DATABASE)
+    try:
+        assert conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone() is not None
+    finally:
+        conn.close()
+
+def test_local_backup_prunes_change_log(main, db):
+    for i in range(20):
+        create_user(db, f'user{i}@example.com', balance=i)
+    assert db.execute('SELECT COUNT(*) FROM backup_changes').fetchone()[0] >= 20
+
+    assert main._backup_to_local() is not None
+    assert db.execute('SELECT COUNT(*) FROM backup_changes').fetchone()[0] == 0
+
+    db.execute('UPDATE users SET balance = balance + 1')
+    db.commit()
+    assert main._backup_to_local() is not None
+    assert db.execute('SELECT COUNT(*) FROM backup_changes').fetchone()[0] == 0
+
+def test_restore_routes_require_admin(main, db):
+    user_id = create_user(db, 'plain@example.com')
+    client = login(main, user_id)
+
+    assert client.post('/restore-from-backup').status_code == 302
+    assert client.post('/force-backup').status_code == 302
+
+def test_local_restore_refused_on_a_serving_database(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_TARGET', 'local')
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', True)
+    admin_id = create_user(db, 'admin@example.com', balance=100.0)
+    assert main._backup_to_local() is not None
+
+    db.execute('UPDATE users SET balance = 0 WHERE id = ?', (admin_id,))
+    late_id = create_user(db, 'late@example.com')
+    main.enable_admin_access()
+    client = login(main, admin_id, is_admin=True)
+
+    assert client.post('/restore-from-backup').status_code == 400
+    assert db.execute('SELECT id FROM users WHERE id = ?', (late_id,)).fetchone() is not None
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (admin_id,)).fetchone()[0] == 0
+
+def test_restore_clears_caches_and_bumps_catalog_generation(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_TARGET', 'local')
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', True)
+    assert main._backup_to_local() is not None
+
+    # Écritures du catalogue après l'instantané : la génération restaurée serait plus ancienne
+    for _ in range(3):
+        db.execute("UPDATE roi_plans SET name = name")
+    db.commit()
+    generation = int(db.execute("SELECT value FROM app_meta WHERE key = 'catalog_generation'").fetchone()[0])
+    main.dashboard_cache.put(1, {'stale': True})
+
+    assert main.restore_critical_data() is True
+    assert main.dashboard_cache.get(1) is None
+    restored = int(db.execute("SELECT value FROM app_meta WHERE key = 'catalog_generation'").fetchone()[0])
+    assert restored > generation
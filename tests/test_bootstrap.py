@@ -0,0 +1,17 @@
+import hashlib
+import json
+
+def stored_fingerprint(db):
+    return db.execute("SELECT value FROM app_meta WHERE key = 'admin_seed_fingerprint'").fetchone()[0]
+
+def test_admin_fingerprint_is_keyed(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', False)
+    main.bootstrap_database()
+
+    fingerprint = stored_fingerprint(db)
+    assert fingerprint != hashlib.sha256(json.dumps(main.ADMIN_ACCOUNTS).encode()).hexdigest()
+
+    # Même clé : démarrage rapide ; autre clé : l'empreinte ne correspond plus
+    assert main.is_database_initialized()
+    monkeypatch.setattr(main.app, 'secret_key', 'autre-cle')
+    assert not main.is_database_initialized()
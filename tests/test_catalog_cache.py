@@ -0,0 +1,43 @@
+from conftest import create_user, login
+
+def generation(conn):
+    return int(conn.execute("SELECT value FROM app_meta WHERE key = 'catalog_generation'").fetchone()[0])
+
+def test_catalog_write_bumps_the_generation(main, db):
+    before = generation(db)
+    plan_id = db.execute('SELECT MIN(id) FROM roi_plans').fetchone()[0]
+    db.execute('UPDATE roi_plans SET daily_rate = 0.5 WHERE id = ?', (plan_id,))
+    db.execute("INSERT INTO faq (question, answer) VALUES ('Q', 'R')")
+    db.execute("DELETE FROM faq WHERE question = 'Q'")
+    db.commit()
+    assert generation(db) == before + 3
+
+def test_catalog_reloads_after_a_write_in_another_process(main, db):
+    worker = main.CatalogCache(main.CATALOG_QUERIES, check_ttl=60)
+    plan_id = db.execute('SELECT MIN(id) FROM roi_plans').fetchone()[0]
+    original = worker.get('roi_plans', plan_id)['daily_rate']
+    assert worker.reloads == 1
+
+    db.execute('UPDATE roi_plans SET daily_rate = ? WHERE id = ?', (original + 1, plan_id))
+    db.commit()
+    # Encore dans check_ttl : servi depuis la mémoire
+    assert worker.get('roi_plans', plan_id)['daily_rate'] == original
+
+    worker.invalidate()
+    assert worker.get('roi_plans', plan_id)['daily_rate'] == original + 1
+    assert worker.reloads == 2
+
+    # Génération inchangée : la relecture ne recharge pas les tables
+    worker.invalidate()
+    worker.rows('roi_plans')
+    assert worker.reloads == 2
+
+def test_follow_trader_refreshes_the_catalog(main, db):
+    user_id = create_user(db, 'follow@example.com', balance=1000.0)
+    trader = main.catalog.rows('top_traders')[0]
+    followers = trader['followers_count']
+
+    response = login(main, user_id).post('/start-copy-trading', json={
+        'trader_id': trader['id'], 'amount': trader['min_copy_amount']})
+    assert response.status_code == 200
+    assert main.catalog.get('top_traders', trader['id'])['followers_count'] == followers + 1
@@ -0,0 +1,51 @@
+from conftest import create_user
+
+def balance(db, user_id):
+    return db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+
+def test_nested_commit_is_deferred_to_the_owner(main, db):
+    user_id = create_user(db, 'nested@example.com', balance=10.0)
+
+    with main.app.test_request_context():
+        outer = main.get_db_connection()
+        outer.execute('UPDATE users SET balance = 0 WHERE id = ?', (user_id,))
+
+        # Un helper imbriqué valide : rien n'est encore écrit
+        main.log_security_action(user_id, 'test', 'helper imbriqué')
+        assert balance(db, user_id) == 10.0
+
+        # Le propriétaire annule : l'écriture du helper part avec la sienne
+        outer.rollback()
+        outer.close()
+
+    assert balance(db, user_id) == 10.0
+    assert db.execute('SELECT COUNT(*) FROM security_logs').fetchone()[0] == 0
+
+def test_nested_commit_is_applied_when_the_owner_finishes(main, db):
+    user_id = create_user(db, 'reader@example.com')
+
+    with main.app.test_request_context():
+        outer = main.get_db_connection()
+        outer.execute('SELECT 1').fetchone()
+        main.log_security_action(user_id, 'test', 'lecture seule côté propriétaire')
+        outer.close()
+
+    assert db.execute('SELECT COUNT(*) FROM security_logs').fetchone()[0] == 1
+
+def test_nested_commit_survives_request_teardown(main, db):
+    user_id = create_user(db, 'teardown@example.com')
+
+    with main.app.test_request_context():
+        main.get_db_connection().execute('SELECT 1').fetchone()  # jamais fermée par la route
+        main.log_security_action(user_id, 'test', 'validé en fin de requête')
+
+    assert db.execute('SELECT COUNT(*) FROM security_logs').fetchone()[0] == 1
+
+def test_close_all_drops_idle_connections(main):
+    conn = main.get_db_connection()
+    conn.execute('SELECT 1').fetchone()
+    conn.close()
+    assert main.db_pool.stats()['idle_connections'] == 1
+
+    assert main.db_pool.close_all() == 1
+    assert main.db_pool.stats()['open_connections'] == 0
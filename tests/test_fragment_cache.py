@@ -0,0 +1,25 @@
+from conftest import create_user
+
+def render_support(main, user_id, first_name, email):
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['first_name'] = first_name
+        session['email'] = email
+    response = client.get('/support')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+def test_nav_fragments_are_shared_between_users(main, db):
+    main.fragment_cache.clear()
+    users = [(create_user(db, f'user{i}@example.com'), f'Prenom{i}', f'user{i}@example.com') for i in range(5)]
+
+    sizes = []
+    for user_id, first_name, email in users:
+        page = render_support(main, user_id, first_name, email)
+        # Nom et email hors des fragments : chaque utilisateur voit les siens
+        assert first_name in page and email in page
+        assert all(other not in page for _, other, _ in users if other != first_name)
+        sizes.append(main.fragment_cache.stats()['size'])
+
+    assert len(set(sizes)) == 1
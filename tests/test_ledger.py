@@ -0,0 +1,88 @@
+import threading
+
+from conftest import create_trading_bot, create_user, login
+
+def ledger_entries(db, kind):
+    return db.execute('SELECT COUNT(*) FROM ledger_entries WHERE kind = ?', (kind,)).fetchone()[0]
+
+def test_stop_trading_bot_credits_once(main, db):
+    user_id = create_user(db, 'bot@example.com')
+    bot_id = create_trading_bot(db, user_id, amount=100.0)
+    client = login(main, user_id)
+
+    assert client.post(f'/stop-trading-bot/{bot_id}').status_code == 200
+    assert client.post(f'/stop-trading-bot/{bot_id}').status_code == 404
+
+    assert ledger_entries(db, 'trading_bot_stop') == 1
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 100.0
+
+def test_concurrent_stop_trading_bot_credits_once(main, db):
+    user_id = create_user(db, 'race@example.com')
+    bot_id = create_trading_bot(db, user_id, amount=100.0)
+    clients = [login(main, user_id) for _ in range(4)]
+    barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def stop(client):
+        barrier.wait()
+        statuses.append(client.post(f'/stop-trading-bot/{bot_id}').status_code)
+
+    threads = [threading.Thread(target=stop, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert sorted(statuses) == [200, 404, 404, 404]
+    assert ledger_entries(db, 'trading_bot_stop') == 1
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 100.0
+
+def test_stop_copy_trading_credits_once(main, db):
+    user_id = create_user(db, 'copy@example.com')
+    trader_id = db.execute('''
+        INSERT INTO top_traders (name, total_return, win_rate, followers_count, monthly_return,
+                                 risk_score, trading_style, min_copy_amount, max_copy_amount)
+        VALUES ('Trader', 10, 60, 1, 5, 3, 'swing', 10, 1000)
+    ''').lastrowid
+    copy_id = db.execute('''
+        INSERT INTO user_copy_trading (user_id, trader_id, amount) VALUES (?, ?, 50)
+    ''', (user_id, trader_id)).lastrowid
+    db.commit()
+    client = login(main, user_id)
+
+    assert client.post(f'/stop-copy-trading/{copy_id}').status_code == 200
+    assert client.post(f'/stop-copy-trading/{copy_id}').status_code == 404
+
+    assert ledger_entries(db, 'copy_trading_stop') == 1
+    assert db.execute('SELECT followers_count FROM top_traders WHERE id = ?', (trader_id,)).fetchone()[0] == 0
+
+def create_transaction(db, user_id, type, amount):
+    transaction_id = db.execute('''
+        INSERT INTO transactions (user_id, type, amount, status) VALUES (?, ?, ?, 'pending')
+    ''', (user_id, type, amount)).lastrowid
+    db.commit()
+    return transaction_id
+
+def test_approve_deposit_credits_once(main, db):
+    user_id = create_user(db, 'deposit@example.com')
+    transaction_id = create_transaction(db, user_id, 'deposit', 25.0)
+    main.enable_admin_access()
+    client = login(main, user_id, is_admin=True)
+
+    assert client.post(f'/admin/approve-transaction/{transaction_id}').status_code == 200
+    assert client.post(f'/admin/approve-transaction/{transaction_id}').status_code == 404
+
+    assert ledger_entries(db, 'deposit') == 1
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 25.0
+
+def test_reject_withdrawal_refunds_once(main, db):
+    user_id = create_user(db, 'withdraw@example.com')
+    transaction_id = create_transaction(db, user_id, 'withdrawal', 30.0)
+    main.enable_admin_access()
+    client = login(main, user_id, is_admin=True)
+
+    assert client.post(f'/admin/reject-transaction/{transaction_id}', json={}).status_code == 200
+    assert client.post(f'/admin/reject-transaction/{transaction_id}', json={}).status_code == 409
+
+    assert ledger_entries(db, 'withdrawal_refund') == 1
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 30.0
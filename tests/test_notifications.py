@@ -0,0 +1,22 @@
+import queue
+
+from conftest import create_user
+
+def test_full_outbox_never_commits_the_callers_transaction(main, db):
+    user_id = create_user(db, 'outbox@example.com', balance=10.0)
+    outbox = main.NotificationOutbox(max_size=1, put_timeout=0.05)
+    # File pleine et aucun thread d'écriture pour la vider
+    outbox._ensure_started = lambda: None
+    outbox._queue = queue.Queue(maxsize=1)
+    outbox._queue.put_nowait((user_id, 'Titre', 'Déjà en file', 'info'))
+
+    with main.app.test_request_context():
+        conn = main.get_db_connection()
+        conn.execute('UPDATE users SET balance = 0 WHERE id = ?', (user_id,))
+        outbox.put(user_id, 'Titre', 'Message', 'info')
+        conn.rollback()
+        conn.close()
+
+    assert outbox.dropped == 1
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 10.0
+    assert db.execute('SELECT COUNT(*) FROM notifications').fetchone()[0] == 0
@@ -0,0 +1,28 @@
+from conftest import create_user
+
+def test_ticket_status_counts_follow_triggers(main, db):
+    user_id = create_user(db, 'counters@example.com')
+    first = db.execute("INSERT INTO support_tickets (user_id, subject) VALUES (?, 'A')", (user_id,)).lastrowid
+    second = db.execute("INSERT INTO support_tickets (user_id, subject) VALUES (?, 'B')", (user_id,)).lastrowid
+    db.commit()
+    assert main.load_ticket_status_counts(db) == {'open': 2}
+
+    db.execute("UPDATE support_tickets SET status = 'closed' WHERE id = ?", (first,))
+    db.execute("UPDATE support_tickets SET subject = 'B2' WHERE id = ?", (second,))
+    db.commit()
+    assert main.load_ticket_status_counts(db) == {'open': 1, 'closed': 1}
+
+    db.execute('DELETE FROM support_tickets WHERE id = ?', (second,))
+    db.commit()
+    assert main.load_ticket_status_counts(db) == {'closed': 1}
+
+    recounted = dict(db.execute('SELECT status, COUNT(*) FROM support_tickets GROUP BY status').fetchall())
+    assert main.load_ticket_status_counts(db) == recounted
+
+def test_reconcile_resets_vanished_ticket_statuses(main, db):
+    db.execute("INSERT INTO platform_counters (name, value) VALUES ('tickets_status:user_reply', 3)")
+    db.commit()
+    main.reconcile_platform_counters(db)
+    db.commit()
+    assert main.load_ticket_status_counts(db) == {}
+    assert db.execute("SELECT value FROM platform_counters WHERE name = 'tickets_status:user_reply'").fetchone()[0] == 0
@@ -0,0 +1,48 @@
+from conftest import create_user, login
+
+def position_counts(conn, user_id):
+    return {
+        table: conn.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (user_id,)).fetchone()[0]
+        for table in ('user_investments', 'user_staking', 'project_investments',
+                      'portfolio_distributions', 'ledger_entries', 'user_portfolio_stats')
+    }
+
+def distribution(roi_id, staking_id, project_id, amount):
+    return [
+        {'type': 'roi', 'plan_id': roi_id, 'amount': amount},
+        {'type': 'staking', 'plan_id': staking_id, 'amount': amount},
+        {'type': 'project', 'plan_id': project_id, 'amount': amount},
+    ]
+
+def first_ids(conn):
+    return [conn.execute(f'SELECT MIN(id) FROM {table}').fetchone()[0]
+            for table in ('roi_plans', 'staking_plans', 'projects')]
+
+def test_portfolio_invest_without_funds_writes_nothing(main, db):
+    user_id = create_user(db, 'poor@example.com', balance=50.0)
+    roi_id, staking_id, project_id = first_ids(db)
+    raised = db.execute('SELECT raised_amount FROM projects WHERE id = ?', (project_id,)).fetchone()[0]
+    client = login(main, user_id)
+
+    response = client.post('/portfolio-invest', json={
+        'total_amount': 60, 'distributions': distribution(roi_id, staking_id, project_id, 20)})
+    assert response.status_code == 400
+
+    missing = client.post('/portfolio-invest', json={
+        'total_amount': 30, 'distributions': distribution(roi_id, staking_id, 999999, 10)})
+    assert missing.status_code == 404
+
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 50.0
+    assert set(position_counts(db, user_id).values()) == {0}
+    assert db.execute('SELECT raised_amount FROM projects WHERE id = ?', (project_id,)).fetchone()[0] == raised
+
+def test_portfolio_invest_writes_every_position(main, db):
+    user_id = create_user(db, 'rich@example.com', balance=100.0)
+    roi_id, staking_id, project_id = first_ids(db)
+
+    response = login(main, user_id).post('/portfolio-invest', json={
+        'total_amount': 60, 'distributions': distribution(roi_id, staking_id, project_id, 20)})
+    assert response.status_code == 200
+
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == 40.0
+    assert set(position_counts(db, user_id).values()) == {1}
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from conftest import create_trading_bot, create_user
+
+def test_daily_profits_survive_a_concurrent_commit(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', False)
+    user_id = create_user(db, 'bot@example.com', balance=10.0)
+    other_id = create_user(db, 'other@example.com', balance=5.0)
+    create_trading_bot(db, user_id, daily_profit=2.0)
+
+    writers = []
+    writer_errors = []
+
+    def concurrent_request():
+        # Une requête web qui commite pendant que le job calcule
+        conn = main.sqlite3.connect(main.DATABASE, timeout=10)
+        try:
+            conn.execute('UPDATE users SET balance = balance + 1 WHERE id = ?', (other_id,))
+            conn.commit()
+        except main.sqlite3.Error as e:
+            writer_errors.append(e)
+        finally:
+            conn.close()
+
+    collect = main._collect_profit_credits
+
+    def collect_then_commit_elsewhere(conn, run_date):
+        collect(conn, run_date)
+        writer = threading.Thread(target=concurrent_request)
+        writer.start()
+        writers.append(writer)
+        writer.join(timeout=0.5)
+
+    monkeypatch.setattr(main, '_collect_profit_credits', collect_then_commit_elsewhere)
+
+    result = main.calculate_daily_profits(run_date='2024-01-01', workers=0)
+
+    assert result['bots'] == 1
+    balances = dict(db.execute('SELECT id, balance FROM users').fetchall())
+    assert balances[user_id] == 12.0
+    # L'écriture concurrente attend la fin du job puis passe
+    writers[0].join(timeout=10)
+    assert not writer_errors
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (other_id,)).fetchone()[0] == 6.0
+    assert db.execute("SELECT COUNT(*) FROM ledger_entries WHERE kind = 'daily_profit'").fetchone()[0] == 1
+
+def create_copy_trade(conn, user_id, monthly_return, copy_ratio, amount=300.0):
+    trader_id = conn.execute('''
+        INSERT INTO top_traders (name, total_return, win_rate, monthly_return, risk_score,
+                                 trading_style, min_copy_amount, max_copy_amount)
+        VALUES ('Trader', 10, 60, ?, 3, 'swing', 10, 1000)
+    ''', (monthly_return,)).lastrowid
+    conn.execute('''
+        INSERT INTO user_copy_trading (user_id, trader_id, amount, copy_ratio) VALUES (?, ?, ?, ?)
+    ''', (user_id, trader_id, amount, copy_ratio))
+    conn.commit()
+
+def sql_credits(main, conn, run_date):
+    main._collect_profit_credits(conn, run_date)
+    rows = conn.execute('SELECT position_type, position_id, user_id, amount, label FROM temp.profit_credits').fetchall()
+    conn.rollback()
+    return rows
+
+def normalized(rows):
+    return sorted((kind, position_id, user_id, round(amount, 9), label) for kind, position_id, user_id, amount, label in rows)
+
+@pytest.mark.parametrize('numpy_available', [True, False])
+def test_sql_and_vectorized_yields_agree(main, db, monkeypatch, numpy_available):
+    if numpy_available and not main.yields.NUMPY_AVAILABLE:
+        pytest.skip('numpy non installé')
+    monkeypatch.setattr(main.yields, 'NUMPY_AVAILABLE', numpy_available)
+
+    user_id = create_user(db, 'parity@example.com')
+    create_trading_bot(db, user_id, daily_profit=2.5)
+    create_trading_bot(db, user_id, daily_profit=0.0)
+    create_copy_trade(db, user_id, monthly_return=25.2, copy_ratio=1.5)
+    create_copy_trade(db, user_id, monthly_return=12.0, copy_ratio=None)
+    create_copy_trade(db, user_id, monthly_return=0.0, copy_ratio=1.0)
+    create_copy_trade(db, user_id, monthly_return=-5.0, copy_ratio=1.0)
+
+    run_date = '2024-02-01'
+    vectorized = main.yields.credit_rows(main.yields.compute_daily_yields(main.yields.load_active_positions(db, run_date)))
+
+    assert normalized(sql_credits(main, db, run_date)) == normalized(vectorized)
+    assert len(vectorized) == 3
+
+def test_rerunning_a_profit_day_credits_nothing(main, db, monkeypatch):
+    monkeypatch.setattr(main, 'BACKUP_ENABLED', False)
+    user_id = create_user(db, 'rerun@example.com', balance=10.0)
+    create_trading_bot(db, user_id, daily_profit=2.0)
+    create_copy_trade(db, user_id, monthly_return=30.0, copy_ratio=1.0)
+
+    first = main.calculate_daily_profits(run_date='2024-03-01', workers=0)
+    assert (first['bots'], first['copies']) == (1, 1)
+    balance = db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+
+    again = main.calculate_daily_profits(run_date='2024-03-01', workers=0)
+    assert again['already_completed']
+
+    # Crash simulé après les crédits mais avant le checkpoint : la reprise ne recrédite rien
+    db.execute("UPDATE profit_run_days SET completed_at = NULL WHERE run_date = '2024-03-01'")
+    db.commit()
+    resumed = main.calculate_daily_profits(run_date='2024-03-01', workers=0)
+    assert (resumed['already_completed'], resumed['bots'], resumed['copies']) == (False, 0, 0)
+
+    assert db.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0] == balance
+    # Une entrée de journal par utilisateur crédité, une ligne profit_runs par position
+    assert db.execute("SELECT COUNT(*) FROM ledger_entries WHERE kind = 'daily_profit'").fetchone()[0] == 1
+    assert db.execute("SELECT COUNT(*) FROM profit_runs WHERE run_date = '2024-03-01'").fetchone()[0] == 2
@@ -0,0 +1,39 @@
+from conftest import create_user, login
+
+def open_ticket(conn, user_id, subject, message):
+    ticket_id = conn.execute('''
+        INSERT INTO support_tickets (user_id, subject) VALUES (?, ?)
+    ''', (user_id, subject)).lastrowid
+    conn.execute('''
+        INSERT INTO support_messages (ticket_id, user_id, message) VALUES (?, ?, ?)
+    ''', (ticket_id, user_id, message))
+    conn.commit()
+    return ticket_id
+
+def test_support_search_is_scoped_to_the_callers_tickets(main, db):
+    alice = create_user(db, 'alice@example.com')
+    bob = create_user(db, 'bob@example.com')
+    alice_ticket = open_ticket(db, alice, 'Retrait bloqué', 'Mon retrait zephyrine est bloqué')
+    bob_ticket = open_ticket(db, bob, 'Retrait bloqué aussi', 'Le retrait zephyrine de Bob')
+    db.execute("INSERT INTO faq (question, answer) VALUES ('Délai zephyrine ?', 'Sous 24 h')")
+    db.execute("INSERT INTO faq (question, answer, is_active) VALUES ('Ancienne zephyrine', 'Obsolète', 0)")
+    db.commit()
+
+    results = login(main, alice).get('/support/search?q=zephyrine').get_json()['results']
+    ticket_ids = {result['ticket_id'] for result in results if result['kind'] != 'faq'}
+    assert ticket_ids == {alice_ticket}
+    assert all('email' not in result for result in results)
+    assert [result['title'] for result in results if result['kind'] == 'faq'] == ['Délai zephyrine ?']
+
+    main.enable_admin_access()
+    admin_results = login(main, alice, is_admin=True).get('/admin/support/search?q=zephyrine').get_json()['results']
+    assert {result['ticket_id'] for result in admin_results if result['kind'] != 'faq'} == {alice_ticket, bob_ticket}
+
+def test_support_search_escapes_fts_syntax_and_snippets(main, db):
+    user_id = create_user(db, 'fts@example.com')
+    open_ticket(db, user_id, 'Balise', '<script>zephyrine</script>')
+
+    client = login(main, user_id)
+    assert client.get('/support/search?q=" OR NEAR(').get_json()['results'] == []
+    results = client.get('/support/search?q=zephyrine').get_json()['results']
+    assert results and '<script>' not in results[0]['snippet']
@@ -0,0 +1,48 @@
+from conftest import create_user
+
+def open_ticket(conn, user_id):
+    ticket_id = conn.execute('''
+        INSERT INTO support_tickets (user_id, subject) VALUES (?, 'Aide')
+    ''', (user_id,)).lastrowid
+    conn.commit()
+    return ticket_id
+
+def test_support_streams_are_capped_per_worker(main, db, monkeypatch):
+    monkeypatch.setattr(main.support_broker, 'max_streams', 1)
+    user_id = create_user(db, 'support@example.com')
+    ticket_id = open_ticket(db, user_id)
+
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    first = client.get(f'/support/stream/{ticket_id}', buffered=False)
+    assert first.status_code == 200
+
+    refused = client.get(f'/support/stream/{ticket_id}', buffered=False)
+    assert refused.status_code == 503
+    # Le repli par interrogation reste servi
+    assert client.get(f'/support/get-messages/{ticket_id}?since_id=0').status_code == 200
+
+    first.close()
+    assert main.support_broker.open_streams == 0
+
+    again = client.get(f'/support/stream/{ticket_id}', buffered=False)
+    assert again.status_code == 200
+    again.close()
+    assert main.support_broker.open_streams == 0
+
+def test_broker_forgets_tickets_without_subscribers(main):
+    broker = main.SupportMessageBroker(max_streams=4)
+
+    broker.publish(1, 10)
+    assert broker._latest == {}
+
+    assert broker.open_stream(1) and broker.open_stream(1)
+    broker.publish(1, 11)
+    assert broker.wait(1, 10, timeout=0)
+
+    broker.close_stream(1)
+    assert broker._latest == {1: 11}
+    broker.close_stream(1)
+    assert broker._latest == {} and broker.open_streams == 0
@@ -0,0 +1,137 @@
+"""Calcul des rendements des positions : formules unitaires pour les routes, version vectorisée pour le job quotidien"""
+from datetime import timedelta
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+DAYS_PER_MONTH = 30
+
+POSITION_BOT = 0
+POSITION_COPY = 1
+POSITION_TYPES = ('bot', 'copy')
+
+# Formules unitaires
+def plan_end_date(start_date, duration_days):
+    return start_date + timedelta(days=duration_days)
+
+def roi_daily_profit(amount, daily_rate):
+    return amount * daily_rate
+
+def frozen_final_amount(amount, total_return_rate):
+    return amount * total_return_rate
+
+def bot_daily_profit(amount, expected_daily_return):
+    return amount * expected_daily_return
+
+def copy_daily_profit(amount, monthly_return, copy_ratio):
+    """monthly_return est exprimé en pourcentage (25.2 = 25,2 % par mois)"""
+    return amount * (monthly_return / 100 / DAYS_PER_MONTH) * copy_ratio
+
+# Chargement en colonnes
+def load_active_positions(conn, run_date, user_id_min=None, user_id_max=None):
+    """Charge les bots et copy trades actifs non encore crédités pour run_date, colonne par colonne"""
+    user_filter = ''
+    range_params = []
+    if user_id_min is not None and user_id_max is not None:
+        user_filter = 'AND {alias}.user_id BETWEEN ? AND ?'
+        range_params = [user_id_min, user_id_max]
+
+    rows = conn.execute(f'''
+        SELECT {POSITION_BOT}, utb.id, utb.user_id, utb.amount, COALESCE(utb.daily_profit, 0), 0.0, 1.0, ts.name
+        FROM user_trading_bots utb
+        JOIN users u ON utb.user_id = u.id
+        JOIN trading_strategies ts ON utb.strategy_id = ts.id
+        WHERE utb.is_active = 1 {user_filter.format(alias='utb')}
+          AND NOT EXISTS (
+              SELECT 1 FROM profit_runs pr
+              WHERE pr.run_date = ? AND pr.position_type = 'bot' AND pr.position_id = utb.id
+          )
+        UNION ALL
+        SELECT {POSITION_COPY}, uct.id, uct.user_id, uct.amount, 0.0, tt.monthly_return, COALESCE(uct.copy_ratio, 1.0), tt.name
+        FROM user_copy_trading uct
+        JOIN users u ON uct.user_id = u.id
+        JOIN top_traders tt ON uct.trader_id = tt.id
+        WHERE uct.is_active = 1 {user_filter.format(alias='uct')}
+          AND NOT EXISTS (
+              SELECT 1 FROM profit_runs pr
+              WHERE pr.run_date = ? AND pr.position_type = 'copy' AND pr.position_id = uct.id
+          )
+    ''', range_params + [run_date] + range_params + [run_date]).fetchall()
+
+    kinds, position_ids, user_ids, amounts, daily_profits, monthly_returns, copy_ratios, labels = (
+        list(column) for column in zip(*rows)
+    ) if rows else ([], [], [], [], [], [], [], [])
+
+    if not NUMPY_AVAILABLE:
+        return {
+            'kind': kinds, 'position_id': position_ids, 'user_id': user_ids, 'amount': amounts,
+            'daily_profit': daily_profits, 'monthly_return': monthly_returns,
+            'copy_ratio': copy_ratios, 'label': labels
+        }
+
+    return {
+        'kind': np.array(kinds, dtype=np.int8),
+        'position_id': np.array(position_ids, dtype=np.int64),
+        'user_id': np.array(user_ids, dtype=np.int64),
+        'amount': np.array(amounts, dtype=np.float64),
+        'daily_profit': np.array(daily_profits, dtype=np.float64),
+        'monthly_return': np.array(monthly_returns, dtype=np.float64),
+        'copy_ratio': np.array(copy_ratios, dtype=np.float64),
+        'label': np.array(labels, dtype=object)
+    }
+
+# Calcul vectorisé
+def compute_daily_yields(columns):
+    """Calcule en une passe le crédit du jour de chaque position ; seules les positions > 0 sont gardées"""
+    if not NUMPY_AVAILABLE:
+        credits = {'kind': [], 'position_id': [], 'user_id': [], 'amount': [], 'label': []}
+        for i, kind in enumerate(columns['kind']):
+            if kind == POSITION_BOT:
+                profit = columns['daily_profit'][i]
+            else:
+                profit = copy_daily_profit(columns['amount'][i], columns['monthly_return'][i], columns['copy_ratio'][i])
+            if profit > 0:
+                credits['kind'].append(kind)
+                credits['position_id'].append(columns['position_id'][i])
+                credits['user_id'].append(columns['user_id'][i])
+                credits['amount'].append(profit)
+                credits['label'].append(columns['label'][i])
+        return credits
+
+    kind = columns['kind']
+    profit = np.where(
+        kind == POSITION_BOT,
+        columns['daily_profit'],
+        copy_daily_profit(columns['amount'], columns['monthly_return'], columns['copy_ratio'])
+    )
+    keep = profit > 0
+
+    return {
+        'kind': kind[keep],
+        'position_id': columns['position_id'][keep],
+        'user_id': columns['user_id'][keep],
+        'amount': profit[keep],
+        'label': columns['label'][keep]
+    }
+
+def credit_rows(credits):
+    """Lignes (position_type, position_id, user_id, amount, label) prêtes pour executemany"""
+    if NUMPY_AVAILABLE:
+        kinds = credits['kind'].tolist()
+        position_ids = credits['position_id'].tolist()
+        user_ids = credits['user_id'].tolist()
+        amounts = credits['amount'].tolist()
+        labels = credits['label'].tolist()
+    else:
+        kinds, position_ids, user_ids, amounts, labels = (
+            credits['kind'], credits['position_id'], credits['user_id'], credits['amount'], credits['label']
+        )
+
+    return [
+        (POSITION_TYPES[kind], position_id, user_id, amount, label)
+        for kind, position_id, user_id, amount, label in zip(kinds, position_ids, user_ids, amounts, labels)
+    ]